@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+# Local stand-in for the FEX /j_* API and the fs_upload hosts, used by
+# bench/run.py. Point the client at it with FEX_HOST=http://127.0.0.1:PORT
+
+import argparse
+import collections
+import hashlib
+import http.cookies
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fex.throttle import RateLimiter
+from fex.utils import parse_size
+
+READ_SIZE = 2 ** 16
+
+
+class FakeState:
+    def __init__(self, latency=0.0, bandwidth=0):
+        self.latency = latency
+        # One bucket for all connections, like a shared uplink
+        self.limiter = RateLimiter(bandwidth) if bandwidth else None
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.requests = collections.Counter()
+        self.bytes_received = 0
+        self.uploads = 0
+        # (object_id, parent folder or '') -> [(upload_id, name)]
+        self.folders = collections.defaultdict(list)
+        # object_id -> (secret, hint)
+        self.view_passes = {}
+        self.deleted = set()
+        # Copies answer without the new upload ids
+        self.copy_without_ids = False
+        # Sessions handed out by j_signin, only checked with require_login.
+        # expire_after counts down authenticated requests until every
+        # session expires, like a server side logout in the middle of a run
+        self.require_login = False
+        self.sessions = set()
+        self.expire_after = None
+        # Tests look at what arrived, upload_id -> (file name, bytes)
+        self.store_uploads = False
+        self.files = {}
+
+    def add_folder(self, object_id, parent, name):
+        folder_id = self.next_id()
+        with self.lock:
+            self.folders[(object_id, parent)].append((folder_id, name))
+        return folder_id
+
+    def delete_folder(self, object_id, folder_id):
+        # Like deleting it in the web interface, with everything below it
+        with self.lock:
+            for folders in self.folders.values():
+                folders[:] = [folder for folder in folders
+                              if folder[0] != folder_id]
+            stack = [folder_id]
+            while stack:
+                folder_id = stack.pop()
+                self.deleted.add(folder_id)
+                stack.extend(child for child, name in
+                             self.folders.pop((object_id, folder_id), []))
+
+    def new_session(self):
+        session = self.next_id()
+        with self.lock:
+            self.sessions.add(session)
+        return session
+
+    def check_session(self, session):
+        with self.lock:
+            if session not in self.sessions:
+                return False
+            if self.expire_after is not None:
+                self.expire_after -= 1
+                if self.expire_after < 0:
+                    self.sessions.clear()
+                    self.expire_after = None
+                    return False
+            return True
+
+    def get_folders(self, object_id, parent):
+        with self.lock:
+            return [{'is_folder': 1, 'upload_id': folder_id, 'name': name}
+                    for folder_id, name in self.folders[(object_id, parent)]]
+
+    def next_id(self):
+        with self.lock:
+            return 'id{0}'.format(next(self.ids))
+
+    def stats(self):
+        with self.lock:
+            return {'requests': dict(self.requests),
+                    'total_requests': sum(self.requests.values()),
+                    'bytes_received': self.bytes_received,
+                    'uploads': self.uploads}
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+            self.view_passes.clear()
+            self.copy_without_ids = False
+            self.require_login = False
+            self.sessions.clear()
+            self.expire_after = None
+            self.store_uploads = False
+            self.files.clear()
+            self.bytes_received = 0
+            self.uploads = 0
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, Nagle would delay the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def do_GET(self):
+        if self.path == '/_stats':
+            return self._send(self.state.stats())
+        self._send({'result': 0}, 404)
+
+    def do_POST(self):
+        endpoint = self.path.strip('/').split('/')[0]
+        is_api = endpoint.startswith('j_')
+        with self.state.lock:
+            self.state.requests[endpoint if is_api else 'upload'] += 1
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if not is_api:
+            if self._parse_path()[1] in self.state.deleted:
+                self._read_body()
+                return self._send({'result': 0}, 404)
+            return self._send(self._upload())
+
+        data = urllib.parse.parse_qs(self._read_body().decode(errors='replace'))
+        if endpoint == 'j_signin':
+            return self._send(self._api(endpoint, data),
+                              session=self.state.new_session())
+        if self.state.require_login and not self.state.check_session(
+                self._get_session()):
+            return self._send({'result': 0}, 401)
+        self._send(self._api(endpoint, data))
+
+    def _api(self, endpoint, data):
+        upload_url = 'http://{0}:{1}/upload'.format(
+            *self.server.server_address)
+        object_id, folder_id = self._parse_path()
+        if folder_id in self.state.deleted:
+            return {'result': 0}
+        if endpoint in ('j_signin', 'j_account'):
+            return {'result': 1, 'login': data.get('login', ['bench'])[0]}
+        if endpoint == 'j_object_create':
+            return {'result': 1, 'token': self.state.next_id(),
+                    'fs_upload': [upload_url]}
+        if endpoint == 'j_object_view':
+            return {'result': 1, 'can_edit': 1, 'public': 0,
+                    'post': 'bench\n', 'fs_upload': [upload_url],
+                    'upload_list': self.state.get_folders(object_id, '')}
+        if endpoint == 'j_object_folder_create':
+            return {'result': 1, 'upload_id': self.state.add_folder(
+                object_id, folder_id, data.get('name', [''])[0])}
+        if endpoint == 'j_upload_list_copy' and self.state.copy_without_ids:
+            return {'result': 1}
+        if endpoint == 'j_upload_list_copy':
+            return {'result': 1, 'upload_list': [
+                {'upload_id': self.state.next_id(), 'copied_from': upload_id}
+                for upload_id in data.get('list', [''])[0].split(',')]}
+        if endpoint == 'j_object_set_view_pass':
+            with self.state.lock:
+                self.state.view_passes[object_id] = (
+                    data.get('pass', [''])[0], data.get('pass_hint', [''])[0])
+            return {'result': 1}
+        if endpoint == 'j_object_folder_view':
+            return {'result': 1,
+                    'upload_list': self.state.get_folders(object_id,
+                                                          folder_id)}
+        return {'result': 1}
+
+    def _get_session(self):
+        cookie = http.cookies.SimpleCookie(self.headers.get('Cookie', ''))
+        return cookie['session'].value if 'session' in cookie else None
+
+    def _parse_path(self):
+        # /j_endpoint/object_id/folder_id + setter, the client writes a
+        # missing folder or setter as 'None'
+        parts = self.path.split('/') + ['', '']
+        folder_id = parts[3].replace('None', '')
+        return parts[2], '' if folder_id == '0' else folder_id
+
+    def _upload(self):
+        # Hashes the file part of the multipart body on the fly so
+        # --verify works, without holding the body in memory
+        boundary = self.headers.get_param('boundary', '')
+        tail = len('\r\n--{0}--\r\n'.format(boundary))
+        sha1 = hashlib.sha1()
+        crc32 = 0
+        size = 0
+        pending = b''
+        in_file = False
+        name = 'bench'
+        stored = [] if self.state.store_uploads else None
+        for chunk in self._iter_body():
+            pending += chunk
+            if not in_file:
+                header_end = pending.find(b'\r\n\r\n')
+                if header_end < 0:
+                    continue
+                match = re.search(rb'filename="([^"]*)"', pending[:header_end])
+                if match:
+                    name = match.group(1).decode(errors='replace')
+                pending = pending[header_end + 4:]
+                in_file = True
+            if len(pending) > tail:
+                data, pending = pending[:-tail], pending[-tail:]
+                if stored is not None:
+                    stored.append(data)
+                sha1.update(data)
+                crc32 = zlib.crc32(data, crc32)
+                size += len(data)
+
+        upload_id = self.state.next_id()
+        with self.state.lock:
+            self.state.uploads += 1
+            if stored is not None:
+                self.state.files[upload_id] = (name, b''.join(stored))
+        return {'result': 1, 'upload_id': upload_id, 'size': size,
+                'name': name, 'sha1': sha1.hexdigest(),
+                'crc32': '{0:08x}'.format(crc32 & 0xffffffff)}
+
+    def _iter_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            while True:
+                length = int(self.rfile.readline().split(b';')[0], 16)
+                if not length:
+                    self.rfile.readline()
+                    return
+                left = length
+                while left:
+                    chunk = self._read(min(left, READ_SIZE))
+                    left -= len(chunk)
+                    yield chunk
+                self.rfile.readline()
+
+        left = int(self.headers.get('Content-Length', 0))
+        while left:
+            chunk = self._read(min(left, READ_SIZE))
+            if not chunk:
+                return
+            left -= len(chunk)
+            yield chunk
+
+    def _read(self, size):
+        if self.state.limiter:
+            self.state.limiter.consume(size)
+        chunk = self.rfile.read(size)
+        with self.state.lock:
+            self.state.bytes_received += len(chunk)
+        return chunk
+
+    def _read_body(self):
+        return b''.join(self._iter_body())
+
+    def _send(self, obj, status=200, session=None):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if session:
+            self.send_header('Set-Cookie', 'session={0}; Path=/'.format(
+                session))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(host='127.0.0.1', port=0, latency=0.0, bandwidth=0):
+    server = ThreadingHTTPServer((host, port), FakeHandler)
+    server.daemon_threads = True
+    server.state = FakeState(latency, bandwidth)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Fake FEX server')
+    parser.add_argument('--host', action='store', default='127.0.0.1')
+    parser.add_argument('--port', action='store', type=int, default=8000)
+    parser.add_argument('--latency', action='store', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('--bandwidth', action='store', default='0',
+                        help='shared upload bandwidth, e.g. 100M, 0 is '
+                             'unlimited')
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, args.latency,
+                          parse_size(args.bandwidth))
+    logging.info('Serving on http://{0}:{1}'.format(*server.server_address))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
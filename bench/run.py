@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+# Runs fex_uploader.py against bench/fake_server.py for a set of workloads
+# and saves throughput, peak RSS, CPU per GB and requests per second as JSON.
+# Pass --compare with an older result file to catch regressions
+
+import argparse
+import json
+import os
+import platform
+import shlex
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_server import start_server
+from fex.utils import convert_size, parse_size
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOADER = os.path.join(ROOT, 'fex_uploader.py')
+SCENARIOS = ('large_file', 'small_files', 'deep_tree', 'own')
+# Higher is better for these, lower for the rest
+HIGHER_BETTER = ('throughput', 'requests_per_second')
+COMPARED = ('throughput', 'requests_per_second', 'cpu_per_gb', 'peak_rss',
+            'wall')
+
+
+class Benchmark:
+    def __init__(self, args):
+        self._args = args
+        self._work_dir = tempfile.mkdtemp(prefix='fex_bench_')
+        self._server = start_server(latency=args.latency,
+                                    bandwidth=parse_size(args.bandwidth))
+        self._host = 'http://{0}:{1}'.format(*self._server.server_address)
+        self._runs = 0
+
+    def close(self):
+        self._server.shutdown()
+        shutil.rmtree(self._work_dir, ignore_errors=True)
+
+    def run(self):
+        results = {}
+        for scenario in self._args.scenarios:
+            arguments, size = getattr(self, '_prepare_{0}'.format(scenario))()
+            runs = [self._measure(arguments, size)
+                    for _ in range(self._args.repeat)]
+            results[scenario] = dict(self._median(runs), runs=runs,
+                                     arguments=arguments)
+            result = results[scenario]
+            print('{0:12} {1:>12}/s {2:>10} rss {3:>8} cpu s/GB {4:>9.1f} '
+                  'req/s {5:>8.2f}s exit {6}'.format(
+                      scenario, convert_size(result['throughput']),
+                      convert_size(result['peak_rss']),
+                      '-' if result['cpu_per_gb'] is None
+                      else '{0:.2f}'.format(result['cpu_per_gb']),
+                      result['requests_per_second'], result['wall'],
+                      result['exit_code']))
+        return results
+
+    def _measure(self, arguments, size):
+        self._server.state.reset()
+        self._runs += 1
+        env = dict(os.environ, FEX_HOST=self._host)
+        # With the folder cache in the temp dir, runs would reuse folders of
+        # earlier runs and of other benchmarks instead of creating them
+        folder_cache = os.path.join(self._work_dir,
+                                    'folders{0}.sqlite'.format(self._runs))
+        command = [sys.executable, UPLOADER] + arguments + \
+            ['--folder-cache', folder_cache] + \
+            shlex.split(self._args.uploader_args)
+        started = time.monotonic()
+        process = subprocess.Popen(command, cwd=self._work_dir, env=env,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        # wait4 gives the rusage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.monotonic() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        stats = self._server.state.stats()
+        cpu = usage.ru_utime + usage.ru_stime
+        return {
+            'exit_code': process.returncode,
+            'wall': round(wall, 4),
+            'bytes': size,
+            'throughput': int(size / wall) if wall else 0,
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            'peak_rss': usage.ru_maxrss * (1 if sys.platform == 'darwin'
+                                           else 1024),
+            'cpu': round(cpu, 4),
+            'cpu_per_gb': round(cpu / (size / 2 ** 30), 4) if size else None,
+            'requests': stats['total_requests'],
+            'requests_per_second': round(stats['total_requests'] / wall, 2)
+            if wall else 0,
+            'server_requests': stats['requests'],
+        }
+
+    def _prepare_large_file(self):
+        path = os.path.join(self._work_dir, 'large.bin')
+        size = parse_size(self._args.large_size)
+        if not os.path.isfile(path):
+            self._write_file(path, size)
+        return ['-a', '-f', path], size
+
+    def _prepare_small_files(self):
+        directory = os.path.join(self._work_dir, 'small')
+        size = parse_size(self._args.small_size)
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+            for number in range(self._args.small_count):
+                self._write_file(os.path.join(directory,
+                                              'f{0}.bin'.format(number)),
+                                 size)
+        return ['-a', '-d', directory], size * self._args.small_count
+
+    def _prepare_deep_tree(self):
+        directory = os.path.join(self._work_dir, 'tree')
+        size = parse_size(self._args.small_size)
+        total = 0
+        if not os.path.isdir(directory):
+            level = [directory]
+            for depth in range(self._args.tree_depth):
+                next_level = []
+                for path in level:
+                    os.makedirs(path, exist_ok=True)
+                    for number in range(self._args.tree_files):
+                        self._write_file(os.path.join(
+                            path, 'f{0}.bin'.format(number)), size)
+                    next_level.extend(os.path.join(path, 'd{0}'.format(n))
+                                      for n in range(self._args.tree_fanout))
+                level = next_level if depth + 1 < self._args.tree_depth \
+                    else []
+        for path, _, files in os.walk(directory):
+            total += sum(os.path.getsize(os.path.join(path, name))
+                         for name in files)
+        return ['-a', '-d', directory], total
+
+    def _prepare_own(self):
+        object_ids = ['bench{0}'.format(n) for n in range(self._args.own_count)]
+        return ['-u', 'bench', '-p', 'bench', '--force',
+                '--own'] + object_ids, 0
+
+    @staticmethod
+    def _write_file(path, size):
+        block = os.urandom(min(size, 2 ** 20))
+        with open(path, 'wb') as f:
+            written = 0
+            while written < size:
+                written += f.write(block[:size - written])
+
+    @staticmethod
+    def _median(runs):
+        return {key: statistics.median(run[key] for run in runs)
+                if all(isinstance(run[key], (int, float)) for run in runs)
+                else runs[-1][key]
+                for key in runs[0] if key != 'server_requests'}
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for scenario, result in results.items():
+        old = baseline.get('results', {}).get(scenario)
+        if not old:
+            continue
+        for key in COMPARED:
+            if not old.get(key) or result.get(key) is None:
+                continue
+            change = (result[key] - old[key]) / old[key]
+            worse = -change if key in HIGHER_BETTER else change
+            flag = ''
+            if worse > threshold:
+                flag = '  REGRESSION'
+                regressions.append((scenario, key))
+            print('{0:12} {1:20} {2:+8.1%}{3}'.format(scenario, key, change,
+                                                      flag))
+    return regressions
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='fex-uploader benchmarks')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS,
+                        default=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per scenario, the median is reported')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the fake server adds to each request')
+    parser.add_argument('--bandwidth', default='0',
+                        help='fake server bandwidth, e.g. 100M, 0 is '
+                             'unlimited')
+    parser.add_argument('--large-size', default='256M')
+    parser.add_argument('--small-count', type=int, default=1000)
+    parser.add_argument('--small-size', default='4K')
+    parser.add_argument('--tree-depth', type=int, default=6)
+    parser.add_argument('--tree-fanout', type=int, default=2)
+    parser.add_argument('--tree-files', type=int, default=4)
+    parser.add_argument('--own-count', type=int, default=500)
+    parser.add_argument('--uploader-args', default='',
+                        help='extra fex_uploader.py arguments, e.g. "-j 8"')
+    parser.add_argument('--out', default='bench_results.json',
+                        help='result file, default bench_results.json')
+    parser.add_argument('--compare', help='earlier result file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change reported as a regression, '
+                             'default 0.1')
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args)
+    try:
+        results = benchmark.run()
+    finally:
+        benchmark.close()
+
+    report = {
+        'revision': get_revision(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('out', 'compare', 'threshold')},
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results saved to {0}'.format(args.out))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(1)
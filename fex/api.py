@@ -1,30 +1,64 @@
 import logging
 import os
-import sys
+import threading
+import time
 from http.cookiejar import LWPCookieJar
 
 import requests
 
 import fex.exceptions
-from fex.constants import HOST, REQUEST_HEADERS, API_ENDPOINTS
+from fex.constants import (HOST, REQUEST_HEADERS, API_ENDPOINTS,
+                           IDEMPOTENT_ENDPOINTS, AUTH_ERROR_CODES, SESSION_TTL)
+from fex.metrics import Metrics
+from fex.retry import RetryPolicy
+from fex.session import SessionCache
+from fex.utils import get_temp_dir
 
 
 class API:
-    def __init__(self):
+    def __init__(self, pool_size=1, retry=None, metrics=None,
+                 session_ttl=SESSION_TTL):
         self._log = logging.getLogger(self.__class__.__name__)
         self._base_url = '{host}{endpoint}{object_id}/{folder_id}{setter}'
+        self._retry = retry or RetryPolicy()
+        self._metrics = metrics or Metrics()
 
         self._session = requests.Session()
         self._session.headers.update(REQUEST_HEADERS)
+        # Keep one connection per concurrent upload job
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=max(pool_size, requests.adapters.DEFAULT_POOLSIZE))
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
         self._session.cookies = None
         self._cookie_file = None
+        self._session_ttl = session_ttl
+        self._session_cache = None
+        self._credentials = None
+        self._account = None
+        # Bumped on every relogin, tells a thread whether the session it
+        # failed with was already replaced
+        self._generation = 0
+        self._relogin_lock = threading.Lock()
+
+    @property
+    def cookies(self):
+        return self._session.cookies
+
+    @property
+    def account(self):
+        return self._account
+
+    @property
+    def can_relogin(self):
+        return self._credentials is not None
 
     def initialize_cookies(self, username):
         self._log.debug('Initializing cookies')
-        path = '{0}\\'.format(os.getenv('Temp')) if sys.platform == 'win32' \
-                                                                   else '/tmp/'
-        self._cookie_file = '{0}{1}_cookiejar'.format(path, username)
+        self._cookie_file = '{0}{1}_cookiejar'.format(get_temp_dir(), username)
         self._session.cookies = LWPCookieJar(self._cookie_file)
+        self._session_cache = SessionCache(
+            '{0}.session'.format(self._cookie_file), self._session_ttl)
 
     def process_cookies(self):
         if os.path.isfile(self._cookie_file) and os.stat(
@@ -32,7 +66,17 @@ class API:
             self._session.cookies.load(ignore_discard=True)
             self._log.info('Cookies from {0} loaded'.format(self._cookie_file))
 
-            if self.get_account():
+            # Checked recently by this or another process, a stale session
+            # is caught by _make_request on the first auth failure
+            self._account = self._session_cache.get_account()
+            if self._account is not None:
+                self._log.info('Session validated less than {0}s ago, '
+                               'skipping check'.format(self._session_ttl))
+                return True
+
+            self._account = self.get_account()
+            if self._account:
+                self._session_cache.validated(self._account)
                 return True
             else:
                 self._log.warning('Cookies invalid, probably expired')
@@ -43,9 +87,13 @@ class API:
         self._log.info('Purging cookies')
         with open(self._cookie_file, 'w'):
             pass
+        self._session_cache.invalidate()
 
     def save_cookies(self):
-        self._session.cookies.save(ignore_discard=True)
+        # Other processes may be loading the jar, never expose a partial one
+        tmp_file = '{0}.tmp'.format(self._cookie_file)
+        self._session.cookies.save(tmp_file, ignore_discard=True)
+        os.replace(tmp_file, self._cookie_file)
         self._log.info('Cookies saved to {0}'.format(self._cookie_file))
 
     def _make_request(self, endpoint, return_json=True, **kwargs):
@@ -58,18 +106,49 @@ class API:
 
         self._log.debug('Current url: {0}'.format(url))
 
-        try:
-            response = self._session.post(url, data=kwargs.get('data'),
-                                          headers=kwargs.get('headers'))
-            response.raise_for_status()
-            # self._log.debug(
-            #     'Current response from server: {0}'.format(response.json()))
-            response = response.json() if return_json else response
-        except Exception as err:
-            err_msg = 'Fex API Error.'
-            self._log.exception(err_msg)
-            raise fex.exceptions.APIError(err_msg)
-        return response
+        attempt = 0
+        relogged = False
+        while True:
+            if self._retry.breaker.is_open(HOST):
+                err_msg = 'Fex API Error, too many failures in a row.'
+                self._log.error(err_msg)
+                raise fex.exceptions.APIError(err_msg)
+            generation = self._generation
+            started = time.monotonic()
+            try:
+                response = self._session.post(url, data=kwargs.get('data'),
+                                              headers=kwargs.get('headers'))
+                response.raise_for_status()
+                # self._log.debug(
+                #     'Current response from server: {0}'.format(response.json()))
+                response = response.json() if return_json else response
+            except Exception as err:
+                self._metrics.observe_request(endpoint,
+                                              time.monotonic() - started,
+                                              error=True)
+                if not relogged and self._is_auth_error(err, endpoint):
+                    self._log.warning('Session expired, logging in again')
+                    relogged = True
+                    self._relogin(generation)
+                    continue
+                delay = self._retry.get_delay(
+                    attempt, err, endpoint in IDEMPOTENT_ENDPOINTS)
+                if delay is None:
+                    # A call that ran out of retries is one failure, counting
+                    # every attempt would open the circuit on the first call
+                    self._retry.breaker.record_failure(HOST)
+                    err_msg = 'Fex API Error.'
+                    self._log.exception(err_msg)
+                    raise fex.exceptions.APIError(err_msg)
+                self._log.warning('Request to {0} failed: {1}, retrying in '
+                                  '{2:.1f}s'.format(endpoint, err, delay))
+                self._metrics.increment('api_retries')
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._metrics.observe_request(endpoint, time.monotonic() - started)
+            self._retry.breaker.record_success(HOST)
+            return response
 
     def get_account(self):
         return self._make_request(API_ENDPOINTS['account'])
@@ -87,8 +166,8 @@ class API:
     def get_object_create(self):
         res = self._make_request(API_ENDPOINTS['object_create'])
         object_id = res.get('token')
-        upload_server = res.get('fs_upload')[0]
-        return upload_server, object_id
+        upload_servers = res.get('fs_upload')
+        return upload_servers, object_id
 
     def get_object_folder_create(self, object_id, folder_name, **kwargs):
         self._log.debug(
@@ -108,8 +187,9 @@ class API:
     def get_object_folder_list(self, data):
         return self._make_request(API_ENDPOINTS['object_folder_list'], data=data)
 
-    def get_object_folder_view(self, folder_id):
+    def get_object_folder_view(self, folder_id, object_id=None):
         return self._make_request(API_ENDPOINTS['object_folder_view'],
+                                 object_id=object_id or '',
                                  folder_id=folder_id)
 
     def get_object_free(self):
@@ -145,11 +225,11 @@ class API:
         res = self.get_object_view(view_password=view_password,
                                    object_id=object_id)
         if res.get('can_edit'):
-            upload_server = res.get('fs_upload')[0]
+            upload_servers = res.get('fs_upload')
         else:
             raise fex.exceptions.ObjectUploadPermissionsError('You don\'t '
                                    'have permissions to upload to this Object')
-        return upload_server, res
+        return upload_servers, res
 
     def get_object_view(self, object_id, view_password=None):
         res = self._make_request(API_ENDPOINTS['object_view'],
@@ -158,17 +238,46 @@ class API:
         return res
 
     def login(self, username, password, force=False):
-        if force:
-            self._log.info('Force login')
-            self.purge_cookies()
-
-        if not self.process_cookies():
-            self._log.debug('Trying to log in')
-            credentials = {'login': username,
-                           'password': password}
-            response = self._get_signin(credentials)
-            self._verify_login(response, username)
-            self.save_cookies()
+        self._credentials = {'login': username, 'password': password}
+        with self._session_cache.lock():
+            if force:
+                self._log.info('Force login')
+                self.purge_cookies()
+
+            if not self.process_cookies():
+                self._signin()
+
+    def _signin(self):
+        self._log.debug('Trying to log in')
+        response = self._get_signin(self._credentials)
+        self._verify_login(response, self._credentials['login'])
+        self.save_cookies()
+        self._account = response.get('user') or response
+        self._session_cache.validated(self._account)
+
+    def _relogin(self, generation):
+        # Workers that hit the expired session together all end up here,
+        # only the first signs in and the rest retry with its session
+        with self._relogin_lock:
+            if generation != self._generation:
+                self._log.debug('Session already renewed by another thread')
+                return
+            with self._session_cache.lock():
+                self._session_cache.invalidate()
+                self._session.cookies.clear()
+                self._signin()
+            self._generation += 1
+
+    def relogin(self):
+        # For clients sharing this session, they keep their own generation
+        self._relogin(self._generation)
+
+    def _is_auth_error(self, err, endpoint):
+        response = getattr(err, 'response', None)
+        return self._credentials is not None \
+            and endpoint != API_ENDPOINTS['signin'] \
+            and response is not None \
+            and response.status_code in AUTH_ERROR_CODES
 
     def _verify_login(self, response, username):
         err_msg = ''
@@ -201,8 +310,15 @@ class API:
     def _get_signin(self, credentials):
         return self._make_request(API_ENDPOINTS['signin'], data=credentials)
 
-    def get_upload_list_copy(self):
-        return self._make_request(API_ENDPOINTS['upload_list_copy'])
+    def get_upload_list_copy(self, object_id, upload_ids, folder_id=None):
+        res = self._make_request(API_ENDPOINTS['upload_list_copy'],
+                                 object_id=object_id,
+                                 folder_id=folder_id or '',
+                                 data={'list': ','.join(upload_ids)})
+        if not res.get('result'):
+            raise fex.exceptions.APIError('Copy failed for '
+                                          '{0}'.format(upload_ids))
+        return res
 
     def get_upload_list_delete(self):
         return self._make_request(API_ENDPOINTS['upload_list_delete'])
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+from yarl import URL
+
+import fex.exceptions
+from fex.constants import (HOST, REQUEST_HEADERS, API_ENDPOINTS,
+                           IDEMPOTENT_ENDPOINTS, AUTH_ERROR_CODES,
+                           ASYNC_CONNECTION_LIMIT,
+                           ASYNC_HOST_CONNECTION_LIMIT)
+from fex.metrics import Metrics
+from fex.retry import RetryPolicy
+
+
+# Non-blocking counterpart of fex.api.API, methods are coroutines with the
+# same names and results
+class AsyncAPI:
+    def __init__(self, limit=ASYNC_CONNECTION_LIMIT,
+                 limit_per_host=ASYNC_HOST_CONNECTION_LIMIT, retry=None,
+                 metrics=None):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._base_url = '{host}{endpoint}{object_id}/{folder_id}{setter}'
+        self._retry = retry or RetryPolicy()
+        self._metrics = metrics or Metrics()
+        self._connector = aiohttp.TCPConnector(limit=limit,
+                                               limit_per_host=limit_per_host)
+        # unsafe keeps cookies of a FEX_HOST given as an address, like the
+        # fake server's
+        self._session = aiohttp.ClientSession(
+            connector=self._connector, headers=REQUEST_HEADERS,
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(total=None))
+        # Blocking API whose session is shared, it signs in again when the
+        # session expires. Bumped on every relogin like API._generation
+        self._login_api = None
+        self._generation = 0
+        self._relogin_lock = asyncio.Lock()
+
+    async def close(self):
+        await self._session.close()
+
+    def share_session(self, api):
+        # Login stays with the blocking API, its cookie jar is shared here
+        self._login_api = api
+        self.load_cookies(api.cookies or [])
+
+    def load_cookies(self, cookies):
+        for cookie in cookies:
+            self._session.cookie_jar.update_cookies(
+                {cookie.name: cookie.value}, URL(HOST))
+
+    async def _make_request(self, endpoint, return_json=True, **kwargs):
+        url = self._base_url.format(
+            host=HOST,
+            endpoint=endpoint,
+            object_id=kwargs.get('object_id') or '',
+            folder_id=kwargs.get('folder_id') or '',
+            setter=kwargs.get('setter') or '')
+        # aiohttp doesn't drop None fields like requests does
+        data = {key: value for key, value in (kwargs.get('data') or {}).items()
+                if value is not None}
+
+        self._log.debug('Current url: {0}'.format(url))
+
+        attempt = 0
+        relogged = False
+        while True:
+            if self._retry.breaker.is_open(HOST):
+                err_msg = 'Fex API Error, too many failures in a row.'
+                self._log.error(err_msg)
+                raise fex.exceptions.APIError(err_msg)
+            generation = self._generation
+            started = time.monotonic()
+            try:
+                async with self._session.post(url, data=data,
+                                              headers=kwargs.get('headers')) \
+                        as response:
+                    response.raise_for_status()
+                    if return_json:
+                        result = await response.json(content_type=None)
+                    else:
+                        await response.read()
+                        result = response
+            except Exception as err:
+                self._metrics.observe_request(endpoint,
+                                              time.monotonic() - started,
+                                              error=True)
+                if not relogged and self._is_auth_error(err):
+                    self._log.warning('Session expired, logging in again')
+                    relogged = True
+                    await self._relogin(generation)
+                    continue
+                delay = self._retry.get_delay(
+                    attempt, err, endpoint in IDEMPOTENT_ENDPOINTS)
+                if delay is None:
+                    # A call that ran out of retries is one failure, counting
+                    # every attempt would open the circuit on the first call
+                    self._retry.breaker.record_failure(HOST)
+                    err_msg = 'Fex API Error.'
+                    self._log.exception(err_msg)
+                    raise fex.exceptions.APIError(err_msg)
+                self._log.warning('Request to {0} failed: {1}, retrying in '
+                                  '{2:.1f}s'.format(endpoint, err, delay))
+                self._metrics.increment('api_retries')
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self._metrics.observe_request(endpoint, time.monotonic() - started)
+            self._retry.breaker.record_success(HOST)
+            return result
+
+    async def _relogin(self, generation):
+        # Requests that hit the expired session together all end up here,
+        # only the first has the blocking API sign in and the rest retry
+        # with the cookies it got
+        async with self._relogin_lock:
+            if generation != self._generation:
+                self._log.debug('Session already renewed')
+                return
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._login_api.relogin)
+            self._session.cookie_jar.clear()
+            self.load_cookies(self._login_api.cookies)
+            self._generation += 1
+
+    def _is_auth_error(self, err):
+        return self._login_api is not None and self._login_api.can_relogin \
+            and isinstance(err, aiohttp.ClientResponseError) \
+            and err.status in AUTH_ERROR_CODES
+
+    async def post(self, url, data):
+        # Raw upload to an fs_upload server
+        async with self._session.post(url, data=data) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None), response.headers
+
+    async def get_account(self):
+        return await self._make_request(API_ENDPOINTS['account'])
+
+    async def get_archive(self):
+        return await self._make_request(API_ENDPOINTS['archive'])
+
+    async def get_home(self):
+        res = await self._make_request(API_ENDPOINTS['home'])
+        return res.get('object_list', [])
+
+    async def get_object_access(self):
+        return await self._make_request(API_ENDPOINTS['object_access'])
+
+    async def get_object_create(self):
+        res = await self._make_request(API_ENDPOINTS['object_create'])
+        object_id = res.get('token')
+        upload_servers = res.get('fs_upload')
+        return upload_servers, object_id
+
+    async def get_object_folder_create(self, object_id, folder_name, **kwargs):
+        self._log.debug(
+            'Folder id passed to API: {0}'.format(kwargs.get('folder_id')))
+        data = {'name': folder_name}
+        res = await self._make_request(API_ENDPOINTS['object_folder_create'],
+                                       data=data,
+                                       folder_id=kwargs.get('folder_id'),
+                                       setter=kwargs.get('setter'),
+                                       object_id=object_id)
+        if not res.get('result'):
+            self._log.error('Folder {0} wasn\'t created: {1}'.format(folder_name, res))
+            raise fex.exceptions.APIError
+        return res.get('upload_id')
+
+    async def get_object_folder_list(self, data):
+        return await self._make_request(API_ENDPOINTS['object_folder_list'],
+                                        data=data)
+
+    async def get_object_folder_view(self, folder_id, object_id=None):
+        return await self._make_request(API_ENDPOINTS['object_folder_view'],
+                                        object_id=object_id,
+                                        folder_id=folder_id)
+
+    async def get_object_free(self):
+        return await self._make_request(API_ENDPOINTS['object_free'])
+
+    async def get_object_own(self, object_id):
+        res = await self._make_request(API_ENDPOINTS['object_own'],
+                                       object_id=object_id)
+        if not res.get('result'):
+            raise fex.exceptions.OwnObjectError('Own failed for '
+                                                'object {0}'.format(object_id))
+
+    async def get_object_public(self, object_id, **kwargs):
+        return await self._make_request(API_ENDPOINTS['object_public'],
+                                        object_id=object_id,
+                                        setter=kwargs.get('setter'))
+
+    async def get_object_set_delete_time(self):
+        return await self._make_request(API_ENDPOINTS['object_set_delete_time'])
+
+    async def get_object_set_view_pass(self, object_id, secret, hint=None):
+        payload = {'pass': secret, 'pass_hint': hint}
+        res = await self._make_request(API_ENDPOINTS['object_set_view_pass'],
+                                       object_id=object_id, data=payload)
+        if not res.get('result'):
+            raise fex.exceptions.UploaderError('Password wasn\'t set')
+
+    async def get_object_update(self):
+        return await self._make_request(API_ENDPOINTS['object_update'])
+
+    async def get_upload_server(self, object_id, view_password=None):
+        res = await self.get_object_view(view_password=view_password,
+                                         object_id=object_id)
+        if res.get('can_edit'):
+            upload_servers = res.get('fs_upload')
+        else:
+            raise fex.exceptions.ObjectUploadPermissionsError('You don\'t '
+                                   'have permissions to upload to this Object')
+        return upload_servers, res
+
+    async def get_object_view(self, object_id, view_password=None):
+        return await self._make_request(API_ENDPOINTS['object_view'],
+                                        object_id=object_id,
+                                        data={'pass': view_password})
+
+    async def get_upload_list_copy(self, object_id, upload_ids,
+                                   folder_id=None):
+        res = await self._make_request(API_ENDPOINTS['upload_list_copy'],
+                                       object_id=object_id,
+                                       folder_id=folder_id,
+                                       data={'list': ','.join(upload_ids)})
+        if not res.get('result'):
+            raise fex.exceptions.APIError('Copy failed for '
+                                          '{0}'.format(upload_ids))
+        return res
+
+    async def get_upload_list_delete(self):
+        return await self._make_request(API_ENDPOINTS['upload_list_delete'])
+
+    async def get_upload_list_move(self):
+        return await self._make_request(API_ENDPOINTS['upload_list_move'])
@@ -0,0 +1,293 @@
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+
+from fex.exceptions import APIError, UploaderError
+from fex.metrics import Metrics
+from fex.progress import ProgressReporter
+from fex.retry import RetryPolicy
+from fex.servers import UploadServerPool
+from fex.uploader import Uploader
+
+
+# Uploader driven by fex.async_api.AsyncAPI, folders and files are created
+# and sent as concurrent tasks on one event loop
+class AsyncUploader:
+    def __init__(self, api, printer, obj, retry=None, progress=None,
+                 metrics=None, folders=None):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._api = api
+        self._printer = printer
+        self._obj = obj
+        self._retry = retry or RetryPolicy()
+        self._progress = progress or ProgressReporter('quiet')
+        self._metrics = metrics or Metrics()
+        self._folders = folders
+        self._errors = []
+        self._uploaded = 0
+        self._semaphore = None
+        # Folders taken from the cache, token -> how to create them again,
+        # and the tasks creating those found deleted
+        self._reused_folders = {}
+        self._replaced_folders = {}
+        self._servers = None
+
+    async def upload(self):
+        self._errors = []
+        self._uploaded = 0
+        self._semaphore = asyncio.Semaphore(self._obj.jobs)
+        self._reused_folders = {}
+        self._replaced_folders = {}
+
+        if not self._obj.object_id:
+            self._log.info('Object ID not provided, creating new')
+            upload_servers, self._obj.object_id = \
+                await self._api.get_object_create()
+            self._log.info('Created Object ID: {0}'.format(self._obj.object_id))
+            view_response = await self._api.get_object_view(
+                view_password=self._obj.view_password,
+                object_id=self._obj.object_id)
+        else:
+            upload_servers, view_response = await self._api.get_upload_server(
+                self._obj.object_id, self._obj.view_password)
+        self._servers = UploadServerPool(upload_servers, self._retry.breaker)
+        if self._folders and self._obj.dir_path:
+            await self._check_folders(view_response)
+
+        if self._obj.public:
+            await self._set_object_permissions(self._obj.public,
+                                               view_response.get('public'))
+        if self._obj.secret:
+            await self._api.get_object_set_view_pass(
+                object_id=self._obj.object_id, secret=self._obj.secret,
+                hint=self._obj.hint)
+
+        self._progress.start()
+        try:
+            if self._obj.dir_path:
+                await self._upload_dir(self._obj.dir_path,
+                                       self._obj.folder_id)
+            elif self._obj.file_list:
+                await asyncio.gather(*[
+                    self._upload_file(file, self._obj.folder_id,
+                                      view_response)
+                    for file in self._obj.file_list])
+        finally:
+            self._progress.stop()
+
+        self._printer.print_summary([
+            ['Files uploaded:', self._uploaded],
+            ['Files failed:', len(self._errors)],
+            ['Retries:', self._retry.retries],
+            ['Failed requests:', self._retry.failures],
+        ])
+        if self._errors:
+            raise UploaderError('{0} of {1} files weren\'t uploaded'.format(
+                len(self._errors), len(self._errors) + self._uploaded))
+
+    async def _set_object_permissions(self, public, status):
+        if (status, public) in ((1, 'true'), (0, 'false')):
+            self._log.warning('Object already {0}'.format(
+                ('private', 'public')[status]))
+            return
+
+        self._log.info('Making object {0}'.format(
+            ('private', 'public')[public == 'true']))
+        await self._api.get_object_public(
+            object_id=self._obj.object_id,
+            setter=('0', '1')[public == 'true'])
+
+    async def _upload_dir(self, dir_path, folder_token):
+        try:
+            folder_token = await self._folder_create(
+                Uploader._path_leaf(dir_path), folder_token)
+        except Exception as err:
+            self._on_error(dir_path, err)
+            return
+
+        try:
+            files, dirs = await asyncio.get_running_loop().run_in_executor(
+                None, self._scan_dir, dir_path)
+        except OSError as err:
+            # Unreadable or gone since its parent was scanned
+            self._on_error(dir_path, err)
+            return
+        self._log.info('Found {0} files and {1} subdirs in {2}'.format(
+            len(files), len(dirs), dir_path))
+
+        await asyncio.gather(
+            *[self._upload_file(file, folder_token) for file in files],
+            *[self._upload_dir(subdir, folder_token) for subdir in dirs])
+
+    async def _check_folders(self, view_response):
+        if self._obj.folder_id:
+            upload_list = (await self._api.get_object_folder_view(
+                self._obj.folder_id,
+                object_id=self._obj.object_id)).get('upload_list', [])
+        else:
+            upload_list = view_response.get('upload_list', [])
+        self._folders.reconcile(self._obj.object_id, self._obj.folder_id,
+                                upload_list)
+
+    async def _folder_create(self, folder_name, folder_token):
+        folder_token = await self._current_folder(folder_token)
+        token = self._folders.get(self._obj.object_id, folder_token,
+                                  folder_name) if self._folders else None
+        if token:
+            self._reused_folders[token] = (folder_name, folder_token)
+            return token
+        try:
+            return await self._new_folder(folder_name, folder_token)
+        except APIError:
+            # The parent may be a reused folder deleted on the server
+            if folder_token not in self._reused_folders:
+                raise
+            return await self._new_folder(
+                folder_name, await self._recreate_folder(folder_token))
+
+    async def _new_folder(self, folder_name, folder_token):
+        token = await self._api.get_object_folder_create(
+            folder_name=folder_name, folder_id=folder_token,
+            setter=None if folder_token else '0',
+            object_id=self._obj.object_id)
+        if self._folders:
+            self._folders.add(self._obj.object_id, folder_token, folder_name,
+                              token)
+        return token
+
+    async def _recreate_folder(self, token):
+        # Once per folder, the first upload to find it gone creates it again
+        # and the others wait for the new token
+        if token not in self._replaced_folders:
+            folder_name, folder_token = self._reused_folders[token]
+            self._log.warning('Folder {0} is gone from the server, creating '
+                              'it again'.format(token))
+            if self._folders:
+                self._folders.evict(self._obj.object_id, token)
+            self._replaced_folders[token] = asyncio.ensure_future(
+                self._folder_create(folder_name, folder_token))
+        return await self._replaced_folders[token]
+
+    async def _current_folder(self, token):
+        # Uploads still pointing at a folder created again go to the new one
+        if token in self._replaced_folders:
+            return await self._replaced_folders[token]
+        return token
+
+    async def _upload_file(self, file, folder_token, view_response=None):
+        filename = Uploader._path_leaf(file)
+        queued = time.monotonic()
+        try:
+            size = os.path.getsize(file)
+            self._progress.add_expected(1, size)
+            async with self._semaphore:
+                started = time.monotonic()
+                self._metrics.observe_queue_wait(started - queued)
+                # aiohttp has no per-chunk hook, progress moves per file
+                progress = self._progress.start_file(filename, size)
+                uploaded = False
+                try:
+                    uploaded_json, headers = await self._transfer(
+                        file, filename, folder_token)
+                    uploaded = True
+                finally:
+                    self._progress.finish_file(progress, uploaded)
+            if not uploaded_json.get('result'):
+                raise UploaderError('File {0} wasn\'t uploaded'.format(filename))
+            folder_token = await self._current_folder(folder_token)
+        except Exception as err:
+            self._on_error(file, err)
+            return
+
+        self._uploaded += 1
+        self._log.info('Uploaded {0}'.format(filename))
+        if self._obj.output == 'jsonl':
+            self._printer.print_record(self._printer.file_record(
+                file, uploaded_json, time.monotonic() - started,
+                folder_token=folder_token))
+
+        if view_response is None:
+            return
+
+        if self._obj.output != 'table':
+            return
+        with self._progress.suspended():
+            self._printer.print_result(uploaded_json, headers.get('date'),
+                                       time.monotonic() - started,
+                                       view_response)
+
+    def _on_error(self, path, err):
+        # A file or a directory whose files weren't even found
+        self._log.error('Failed to upload {0}: {1}'.format(path, err))
+        self._errors.append((path, err))
+        if self._obj.output == 'jsonl':
+            self._printer.print_record({'type': 'error', 'file': path,
+                                        'error': str(err)})
+
+    async def _transfer(self, file, filename, folder_token):
+        folder_token = await self._current_folder(folder_token)
+        if folder_token not in self._reused_folders:
+            return await self._transfer_retrying(file, filename, folder_token)
+        # A reused folder may have been deleted on the server since it was
+        # cached, uploads into it fail until it is created again
+        try:
+            result = await self._transfer_retrying(file, filename,
+                                                   folder_token)
+            if result[0].get('result'):
+                return result
+        except aiohttp.ClientResponseError:
+            pass
+        return await self._transfer_retrying(
+            file, filename, await self._recreate_folder(folder_token))
+
+    async def _transfer_retrying(self, file, filename, folder_token):
+        size = os.path.getsize(file)
+        tried = []
+        attempt = 0
+        while True:
+            upload_server = self._servers.acquire(exclude=tried)
+            tried.append(upload_server)
+            upload_url = '/'.join(filter(None, [upload_server,
+                                                self._obj.object_id,
+                                                folder_token]))
+            started = time.monotonic()
+            try:
+                with open(file, 'rb', buffering=self._obj.buffer_size) as f:
+                    form = aiohttp.FormData()
+                    form.add_field('file', f, filename=filename)
+                    result = await self._api.post(upload_url, form)
+            except aiohttp.ClientError as err:
+                self._servers.release(upload_server, error=True)
+                self._metrics.observe_upload(upload_server, size,
+                                             time.monotonic() - started,
+                                             error=True)
+                delay = self._retry.get_delay(attempt, err)
+                if delay is None:
+                    raise
+                self._log.warning('Upload of {0} failed: {1}, retrying in '
+                                  '{2:.1f}s'.format(file, err, delay))
+                self._metrics.increment('upload_retries')
+                attempt += 1
+                if len(tried) >= len(self._servers.stats):
+                    tried = []
+                await asyncio.sleep(delay)
+                continue
+            elapsed = time.monotonic() - started
+            self._servers.release(upload_server, size, elapsed)
+            self._metrics.observe_upload(upload_server, size, elapsed)
+            return result
+
+    @staticmethod
+    def _scan_dir(dir_path):
+        files = []
+        dirs = []
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.is_file():
+                    files.append(entry.path)
+                if entry.is_dir():
+                    dirs.append(entry.path)
+        return files, dirs
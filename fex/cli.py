@@ -0,0 +1,242 @@
+import argparse
+
+from fex.compress import CODECS
+from fex.constants import (READ_BUFFER_SIZE, DEDUP_INDEX_SIZE,
+                           ASYNC_HOST_CONNECTION_LIMIT, RETRY_ATTEMPTS,
+                           RETRY_BACKOFF, PROGRESS_INTERVAL, SESSION_TTL,
+                           WATCH_SETTLE_TIME, WATCH_POLL_INTERVAL,
+                           WATCH_BATCH_SIZE, FOLDER_CACHE_TTL, PACK_THRESHOLD,
+                           PACK_SIZE)
+from fex.scheduling import POLICIES
+from fex.throttle import parse_schedule
+from fex.utils import parse_size
+
+
+def schedule_type(value):
+    # Rejects a bad schedule when parsing arguments instead of at startup
+    try:
+        return parse_schedule(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'invalid schedule {0!r}, expected windows like '
+            '09:00-18:00=50M,18:00-09:00=0'.format(value))
+
+
+# Shared by fex_uploader.py and FexClient, which takes its defaults from
+# parse_args([])
+def create_parser():
+    parser = argparse.ArgumentParser(description='FEX.net uploader')
+    group = parser.add_argument_group('user upload')
+    parser.add_argument('-a', '--anonymous', action='store_true', # works
+                        default=False,
+                        dest='is_anonymous',
+                        help='upload anonymously')
+    group.add_argument('-u', '--user', action='store', dest='username', # works
+                       help='set a username')
+    group.add_argument('-p', '--password', action='store', dest='password', # works
+                       help='set a password')
+    parser.add_argument('-s', '--secret', action='store', dest='secret', # works
+                        help='set a password for an object')
+    parser.add_argument('--hint', action='store', dest='hint', # works
+                        help='set a password hint for an object')
+    parser.add_argument('--folder_name', action='store', dest='folder_name', # N/A
+                        help='folder name to be created')
+    group.add_argument('-o', '--object', action='store', dest='object_id', # works
+                       help='set an object id')
+    group.add_argument('-f', '--file', action='store', dest='file_list', # works
+                       help='file name(s)', nargs='+')
+    parser.add_argument('--view-password', action='store', # ????????????????????
+                        dest='view_password',
+                        help='object\'s password')
+    # ABSENT
+    parser.add_argument('--object-name', action='store',
+                        dest='object_name',
+                        help='object\'s name')
+    # ABSENT
+    parser.add_argument('--object-description', action='store',
+                        dest='object_description',
+                        help='object\'s description')
+    parser.add_argument('-d', '--dir', action='store', dest='dir_path', # works +=
+                        help='recursive upload of directory')
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=1,
+                        dest='jobs',
+                        help='number of files uploaded at once, default 1')
+    parser.add_argument('--order', action='store', default='fifo',
+                        choices=POLICIES, dest='order',
+                        help='upload order: fifo as found, lpt largest '
+                             'first for the shortest run, spt smallest '
+                             'first, locality by directory, default fifo')
+    parser.add_argument('--buffer-size', action='store', type=int,
+                        default=READ_BUFFER_SIZE, dest='buffer_size',
+                        help='file read buffer size in bytes, default 1MB')
+    parser.add_argument('--mmap', action='store_true', default=False,
+                        dest='is_mmap',
+                        help='read files through mmap while uploading')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        dest='is_resume',
+                        help='skip files finished by a previous run of the '
+                             'same upload')
+    parser.add_argument('--journal', action='store', dest='journal',
+                        help='transfer journal path used by --resume')
+    parser.add_argument('--dedup', action='store_true', default=False,
+                        dest='is_dedup',
+                        help='copy files already uploaded elsewhere instead '
+                             'of sending them again')
+    parser.add_argument('--dedup-index', action='store', dest='dedup_index',
+                        help='dedup index path used by --dedup')
+    parser.add_argument('--dedup-size', action='store', type=int,
+                        default=DEDUP_INDEX_SIZE, dest='dedup_size',
+                        help='max entries kept in the dedup index')
+    parser.add_argument('--sync', action='store_true', default=False,
+                        dest='is_sync',
+                        help='upload only new or changed files of a directory')
+    parser.add_argument('--sync-manifest', action='store',
+                        dest='sync_manifest',
+                        help='manifest path used by --sync')
+    parser.add_argument('--pack', action='store_true', default=False,
+                        dest='is_pack',
+                        help='upload small files of a directory as tar '
+                             'bundles built on the fly')
+    parser.add_argument('--pack-threshold', action='store', type=parse_size,
+                        default=PACK_THRESHOLD, dest='pack_threshold',
+                        help='files smaller than this are packed, default '
+                             '1M')
+    parser.add_argument('--pack-size', action='store', type=parse_size,
+                        default=PACK_SIZE, dest='pack_size',
+                        help='max size of the files in one bundle, default '
+                             '256M')
+    parser.add_argument('--pack-index', action='store', dest='pack_index',
+                        help='index of packed files, default in temp dir')
+    parser.add_argument('--pack-find', action='store', dest='pack_find',
+                        help='show which bundle a packed file went to')
+    parser.add_argument('--split-size', action='store', type=parse_size,
+                        dest='split_size',
+                        help='upload files larger than this in parts of this '
+                             'size in parallel, with a .parts.json manifest, '
+                             'e.g. 1G')
+    parser.add_argument('--compress', action='store', choices=sorted(CODECS),
+                        dest='compress',
+                        help='compress files while uploading, already '
+                             'compressed ones are sent as they are, zstd '
+                             'requires zstandard')
+    parser.add_argument('--compress-level', action='store', type=int,
+                        dest='compress_level',
+                        help='compression level, default 6 for gzip and 3 '
+                             'for zstd')
+    parser.add_argument('--async', action='store_true', default=False,
+                        dest='is_async',
+                        help='run API calls and uploads on asyncio, '
+                             'requires aiohttp')
+    parser.add_argument('--host-connections', action='store', type=int,
+                        default=ASYNC_HOST_CONNECTION_LIMIT,
+                        dest='host_connections',
+                        help='max connections per host with --async, '
+                             'default 10')
+    parser.add_argument('--retries', action='store', type=int,
+                        default=RETRY_ATTEMPTS, dest='retries',
+                        help='retries per request or file, default 5')
+    parser.add_argument('--retry-backoff', action='store', type=float,
+                        default=RETRY_BACKOFF, dest='retry_backoff',
+                        help='base retry delay in seconds, doubled on each '
+                             'attempt, default 1')
+    parser.add_argument('--limit-rate', action='store', type=parse_size,
+                        dest='limit_rate',
+                        help='total upload rate limit, e.g. 200M/s')
+    parser.add_argument('--limit-schedule', action='store',
+                        type=schedule_type, dest='limit_schedule',
+                        help='rate limits by time of day, e.g. '
+                             '09:00-18:00=50M,18:00-09:00=0')
+    parser.add_argument('--limit-file', action='store', dest='limit_file',
+                        help='file holding the rate limit, reread when '
+                             'changed or on SIGHUP')
+    parser.add_argument('--output', action='store', default='table',
+                        choices=('table', 'jsonl', 'summary'), dest='output',
+                        help='table per file, jsonl with one record per '
+                             'file on stdout or summary only, default table')
+    parser.add_argument('--progress', action='store', default='auto',
+                        choices=('auto', 'tty', 'json', 'quiet'),
+                        dest='progress',
+                        help='progress display, auto is tty when stdout is a '
+                             'terminal and quiet otherwise, json goes to '
+                             'stderr')
+    parser.add_argument('--progress-interval', action='store', type=float,
+                        default=PROGRESS_INTERVAL, dest='progress_interval',
+                        help='seconds between progress updates, '
+                             'default {0}'.format(PROGRESS_INTERVAL))
+    parser.add_argument('--metrics-out', action='store', dest='metrics_out',
+                        help='write request and upload metrics to this file '
+                             'at the end of the run')
+    parser.add_argument('--metrics-format', action='store', default='json',
+                        choices=('json', 'prometheus'), dest='metrics_format',
+                        help='metrics file format, default json')
+    parser.add_argument('--metrics-interval', action='store', type=float,
+                        dest='metrics_interval',
+                        help='also rewrite the metrics file every N seconds')
+    parser.add_argument('--session-ttl', action='store', type=int,
+                        default=SESSION_TTL, dest='session_ttl',
+                        help='seconds a validated login is trusted without '
+                             'checking it again, default {0}'.format(
+                                 SESSION_TTL))
+    parser.add_argument('--manifest', action='store', dest='jobs_manifest',
+                        help='JSONL file of upload jobs, one {"source", '
+                             '"object_id", "folder", "secret", "hint", '
+                             '"public"} per line')
+    parser.add_argument('--manifest-status', action='store',
+                        dest='manifest_status',
+                        help='JSONL file the result of every job is written '
+                             'to, default next to the manifest')
+    parser.add_argument('--watch', action='store', dest='watch_dir',
+                        help='keep running and upload files as they appear '
+                             'in this directory')
+    parser.add_argument('--watch-state', action='store', dest='watch_state',
+                        help='file remembering what --watch uploaded, '
+                             'default in temp dir')
+    parser.add_argument('--watch-settle', action='store', type=float,
+                        default=WATCH_SETTLE_TIME, dest='watch_settle',
+                        help='seconds a file must stay unchanged before '
+                             'upload, default {0}'.format(WATCH_SETTLE_TIME))
+    parser.add_argument('--watch-poll', action='store', type=float,
+                        default=WATCH_POLL_INTERVAL, dest='watch_poll',
+                        help='seconds between rescans without inotify, '
+                             'default {0}'.format(WATCH_POLL_INTERVAL))
+    parser.add_argument('--watch-batch', action='store', type=int,
+                        default=WATCH_BATCH_SIZE, dest='watch_batch',
+                        help='files uploaded per batch, default {0}'.format(
+                            WATCH_BATCH_SIZE))
+    parser.add_argument('--force', action='store_true', default=False, # works
+                        dest='is_force',
+                        help='force login')
+    parser.add_argument('--verify', action='store_true', default=False,
+                        dest='is_verify',
+                        help='verify checksums')
+    parser.add_argument('--own', action='store', dest='own_object_id', # works
+                        help='inherit object', nargs='+')
+    parser.add_argument('--folder-create', action='store', # not implemented
+                        dest='folder_create',
+                        help='create folder with name')
+    parser.add_argument('--folder', action='store', dest='folder_id', # works
+                        help='upload to existent folder id or /path, object '
+                             'id required')
+    parser.add_argument('--list-dirs', action='store_true', default=False,
+                        dest='is_list_dirs',
+                        help='list folders for object')
+    parser.add_argument('--folder-cache', action='store', dest='folder_cache',
+                        help='folder tree cache, default in temp dir')
+    parser.add_argument('--folder-cache-ttl', action='store', type=int,
+                        default=FOLDER_CACHE_TTL, dest='folder_cache_ttl',
+                        help='seconds a cached folder tree is used, default '
+                             '{0}'.format(FOLDER_CACHE_TTL))
+    parser.add_argument('--refresh-folders', action='store_true',
+                        default=False, dest='is_refresh_folders',
+                        help='fetch the folder tree even if cached')
+    # parser.add_argument('--list-objects', action='store_true', # n/a printer off
+    #                     default=False, dest='is_list_objects',
+    #                     help='list objects')
+    parser.add_argument('--public', default=None, # works
+                        choices=('true', 'false'), dest='public',
+                        help='make object public or private, default true')
+    # parser.add_argument('--info', action='store', dest='object_id_info',
+    #                     help='print object info', nargs='+')
+    parser.add_argument('--version', action='version',
+                        version='%(prog)s 0.1')
+    return parser
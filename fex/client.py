@@ -0,0 +1,167 @@
+import argparse
+import collections
+import logging
+import threading
+
+from fex.api import API
+from fex.cli import create_parser
+from fex.constants import HOST
+from fex.exceptions import ConfigError, OwnObjectError, UploaderError
+from fex.folders import FolderCache
+from fex.metrics import Metrics
+from fex.printer import Printer
+from fex.retry import RetryPolicy
+from fex.throttle import RateLimiter
+from fex.uploader import Uploader
+from fex.utils import get_temp_dir, parse_size
+
+# Split files have no upload of their own, their manifest and parts do
+FileResult = collections.namedtuple(
+    'FileResult', 'file upload_id size sha1 url manifest_upload_id parts',
+    defaults=(None, None))
+UploadResult = collections.namedtuple(
+    'UploadResult', 'object_id folder_id url files skipped errors')
+OwnResult = collections.namedtuple('OwnResult', 'object_id url error')
+
+# Run modes of the command line that don't fit a call returning a result
+UNSUPPORTED = ('is_resume', 'is_dedup', 'is_sync', 'is_async', 'watch_dir',
+               'jobs_manifest', 'metrics_out', 'pack_find', 'is_list_dirs',
+               'own_object_id')
+
+
+# Collects the per-file records of --output jsonl instead of printing them
+class RecordPrinter(Printer):
+    def __init__(self, obj):
+        super().__init__(obj)
+        self.files = []
+
+    def print_record(self, record):
+        if record.get('type') == 'file':
+            self.files.append(FileResult(
+                record['file'], record['upload_id'], record['size'],
+                record['sha1'], record['url'],
+                record.get('manifest_upload_id'), record.get('parts')))
+
+    def print_summary(self, msg, object_url=True):
+        pass
+
+    def print_mesasge(self, msg, headers=None, showindex=None):
+        pass
+
+
+# Long-lived client for services: logs in once and keeps the session, the
+# connection pool, retry state and folder cache across calls. Every call
+# works on its own copy of the options, so calls can run from several
+# threads at once
+class FexClient:
+    def __init__(self, username=None, password=None, pool_size=10,
+                 **options):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._options = self._create_options(options, username=username,
+                                             password=password,
+                                             is_anonymous=not username,
+                                             output='jsonl',
+                                             progress='quiet')
+        self._retry = RetryPolicy(attempts=self._options.retries,
+                                  backoff=self._options.retry_backoff)
+        self._metrics = Metrics()
+        self._api = API(pool_size=pool_size, retry=self._retry,
+                        metrics=self._metrics,
+                        session_ttl=self._options.session_ttl)
+        self._api.initialize_cookies(username)
+        # Options given here skip the argument parser, '200M' is parsed too
+        limit_rate = self._options.limit_rate
+        if isinstance(limit_rate, str):
+            limit_rate = parse_size(limit_rate)
+        self._limiter = RateLimiter(limit_rate) if limit_rate else None
+        self._folders = FolderCache(
+            self._options.folder_cache or '{0}fex_folders.sqlite'.format(
+                get_temp_dir()), self._options.folder_cache_ttl)
+        self._lock = threading.Lock()
+        self._logged_in = False
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def close(self):
+        self._folders.close()
+        self._api._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def upload_file(self, files, object_id=None, folder_id=None, **options):
+        if isinstance(files, str):
+            files = [files]
+        return self._upload(options, file_list=list(files),
+                            object_id=object_id, folder_id=folder_id)
+
+    def upload_dir(self, path, object_id=None, folder_id=None, **options):
+        return self._upload(options, dir_path=path, object_id=object_id,
+                            folder_id=folder_id)
+
+    def own(self, object_ids):
+        if isinstance(object_ids, str):
+            object_ids = [object_ids]
+        self._login()
+        results = []
+        for object_id in object_ids:
+            error = None
+            try:
+                self._api.get_object_own(object_id)
+            except OwnObjectError as err:
+                error = str(err)
+            results.append(OwnResult(object_id,
+                                     '{0}/#!{1}'.format(HOST, object_id),
+                                     error))
+        return results
+
+    def _upload(self, options, **target):
+        obj = self._create_options(options, **target)
+        self._login()
+        printer = RecordPrinter(obj)
+        uploader = Uploader(api=self._api, printer=printer, obj=obj,
+                            retry=self._retry, limiter=self._limiter,
+                            metrics=self._metrics, folders=self._folders)
+        try:
+            uploader.upload()
+        except UploaderError as err:
+            # Failed files are in the result, anything else is raised
+            self._log.warning(str(err))
+        return UploadResult(
+            obj.object_id, obj.folder_id,
+            '{0}/#!{1}'.format(HOST, obj.object_id), tuple(printer.files),
+            uploader.counts['skipped'],
+            tuple((file, str(err)) for file, err in uploader.errors))
+
+    def _login(self):
+        with self._lock:
+            if self._logged_in or self._options.is_anonymous:
+                return
+            self._api.login(username=self._options.username,
+                            password=self._options.password,
+                            force=self._options.is_force)
+            self._logged_in = True
+
+    def _create_options(self, options, **fixed):
+        # Command line defaults for everything not given, so the uploader
+        # sees the same options as when run from fex_uploader.py
+        base = getattr(self, '_options', None) or \
+            create_parser().parse_args([])
+        obj = argparse.Namespace(**vars(base))
+        for key, value in options.items():
+            if not hasattr(obj, key):
+                raise ConfigError('Unknown option {0}'.format(key))
+            if key in UNSUPPORTED and value:
+                raise ConfigError('{0} isn\'t supported by '
+                                  'FexClient'.format(key))
+            setattr(obj, key, value)
+        for key, value in fixed.items():
+            setattr(obj, key, value)
+        if obj.folder_id and obj.folder_id.startswith('/'):
+            raise ConfigError('FexClient takes folder ids, not paths')
+        return obj
@@ -0,0 +1,110 @@
+import logging
+import os
+import queue
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from fex.constants import (COMPRESS_QUEUE_SIZE, COMPRESS_SAMPLE_SIZE,
+                           COMPRESS_MIN_RATIO, COMPRESSED_EXTENSIONS)
+
+CODECS = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def create_compressor(codec, level=None):
+    if codec == 'gzip':
+        # wbits 31 writes a gzip header and trailer instead of raw zlib
+        return zlib.compressobj(6 if level is None else level,
+                                zlib.DEFLATED, 31)
+    if zstandard is None:
+        raise ImportError('zstd compression requires the zstandard package')
+    return zstandard.ZstdCompressor(level=3 if level is None else level) \
+        .compressobj()
+
+
+def is_compressible(file, names=None):
+    # Known compressed formats are skipped by name, anything else by how
+    # well its first block compresses
+    names = names or [file]
+    if all(os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS
+           for name in names):
+        return False
+    with open(file, 'rb') as f:
+        sample = f.read(COMPRESS_SAMPLE_SIZE)
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) / len(sample) < COMPRESS_MIN_RATIO
+
+
+# Compresses a stream in a worker thread so compression overlaps with the
+# network send. At most queue_size compressed chunks wait in memory, the
+# worker blocks when the sender falls behind
+class CompressingReader:
+    def __init__(self, stream, codec, level=None, buffer_size=2 ** 20,
+                 queue_size=COMPRESS_QUEUE_SIZE):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._stream = stream
+        self._compressor = create_compressor(codec, level)
+        self._buffer_size = buffer_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = threading.Event()
+        self._pending = b''
+        self._eof = False
+        # Counters of the source and the compressed side
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._pending) < size):
+            chunk = self._queue.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if chunk is None:
+                self._eof = True
+                break
+            self._pending += chunk
+        if size < 0:
+            size = len(self._pending)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+    def close(self):
+        self._closed.set()
+        # Unblocks a worker waiting on a full queue
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _run(self):
+        try:
+            while not self._closed.is_set():
+                chunk = self._stream.read(self._buffer_size)
+                if not chunk:
+                    break
+                self.bytes_read += len(chunk)
+                self._put(self._compressor.compress(chunk))
+            self._put(self._compressor.flush())
+            self._put(None)
+        except Exception as err:
+            self._log.error('Compression failed: {0}'.format(err))
+            self._put(err)
+
+    def _put(self, chunk):
+        if chunk is not None and not isinstance(chunk, Exception):
+            if not chunk:
+                return
+            self.bytes_written += len(chunk)
+        while not self._closed.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
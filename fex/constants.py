@@ -1,19 +1,77 @@
-HOST = 'https://fex.net'
+import os
+import urllib.parse
+
+# FEX_HOST points the client at another server, e.g. bench/fake_server.py
+HOST = os.environ.get('FEX_HOST', 'https://fex.net')
 REQUEST_HEADERS = {
     'User-Agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
                    'AppleWebKit/537.36 (KHTML, like Gecko) '
                    'Chrome/61.0.3163.79 Safari/537.36'),
-    'Host': 'fex.net',
+    'Host': urllib.parse.urlsplit(HOST).netloc,
     'Upgrade-Insecure-Requests': '1',
     'Accept-Encoding': 'gzip, deflate, br',
 }
 
+READ_BUFFER_SIZE = 2 ** 20
+DEDUP_INDEX_SIZE = 10 ** 6
+ASYNC_CONNECTION_LIMIT = 100
+ASYNC_HOST_CONNECTION_LIMIT = 10
+SERVER_EWMA_ALPHA = 0.3
+SERVER_MIN_SAMPLE_SIZE = 2 ** 20
+RETRY_ATTEMPTS = 5
+RETRY_BACKOFF = 1.0
+RETRY_MAX_BACKOFF = 60
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+PROGRESS_INTERVAL = 0.25
+SESSION_TTL = 3600
+AUTH_ERROR_CODES = (401, 403)
+WATCH_SETTLE_TIME = 2.0
+WATCH_POLL_INTERVAL = 5.0
+WATCH_BATCH_SIZE = 100
+FOLDER_CACHE_TTL = 3600
+LIST_JOBS = 8
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60]
+THROUGHPUT_BUCKETS = [2 ** n for n in range(16, 31, 2)]
+QUEUE_WAIT_BUCKETS = [0.01, 0.1, 1, 5, 15, 60, 300, 900, 3600]
+PACK_THRESHOLD = 2 ** 20
+PACK_SIZE = 2 ** 28
+PACK_NAME = 'fexpack-{0}.tar'
+SPLIT_PART_NAME = '{0}.part{1:04d}'
+SPLIT_MANIFEST_NAME = '{0}.parts.json'
+COMPRESS_QUEUE_SIZE = 4
+COMPRESS_SAMPLE_SIZE = 2 ** 16
+COMPRESS_MIN_RATIO = 0.9
+COMPRESSED_EXTENSIONS = ('.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4', '.zip',
+                         '.7z', '.rar', '.jpg', '.jpeg', '.png', '.gif',
+                         '.webp', '.mp3', '.mp4', '.mkv', '.avi', '.mov',
+                         '.webm', '.pdf', '.docx', '.xlsx', '.pptx', '.apk',
+                         '.jar')
+
 # USER_LOGIN_ERRORS = {
 #     'auth_err': {'msg': 'Authentication error, verify credentials'},
 #     'captcha_request':  {'msg': 'Authentication error, captcha request'},
 #     'non_exist_obj_id':  {'msg': 'Are you uploading to non-existing Object ID?'}
 # }
 
+# Calls that are safe to repeat when the response was lost
+IDEMPOTENT_ENDPOINTS = {
+    '/j_account',
+    '/j_archive/',
+    '/j_home/',
+    '/j_object_access/',
+    '/j_object_folder_list/',
+    '/j_object_folder_view/',
+    '/j_object_free/',
+    '/j_object_own/',
+    '/j_object_public/',
+    '/j_object_set_delete_time/',
+    '/j_object_set_view_pass/',
+    '/j_object_view/',
+}
+
 API_ENDPOINTS = {
     'account': '/j_account',
     'archive': '/j_archive/',
@@ -0,0 +1,187 @@
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                wait)
+
+from fex.constants import FOLDER_CACHE_TTL, LIST_JOBS
+
+
+# Remote folder trees of objects, one row per folder with its parent, so
+# paths are built locally instead of asking the server for every folder.
+# Folders created by uploads are added too, so later runs reuse them
+class FolderCache:
+    def __init__(self, path, ttl=FOLDER_CACHE_TTL):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS folders (
+                object_id TEXT, upload_id TEXT, parent TEXT, name TEXT,
+                PRIMARY KEY (object_id, upload_id));
+            CREATE INDEX IF NOT EXISTS folders_parent
+                ON folders (object_id, parent, name);
+            CREATE TABLE IF NOT EXISTS listings (
+                object_id TEXT PRIMARY KEY, fetched REAL);
+        ''')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def is_fresh(self, object_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT fetched FROM listings WHERE object_id = ?',
+                (object_id,)).fetchone()
+        return row is not None and time.time() - row[0] < self._ttl
+
+    def replace(self, object_id, folders):
+        # folders is a list of (upload_id, parent upload_id or '', name)
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.execute('DELETE FROM folders WHERE object_id = ?',
+                               (object_id,))
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)',
+                [(object_id,) + folder for folder in folders])
+            self._conn.execute(
+                'INSERT OR REPLACE INTO listings VALUES (?, ?)',
+                (object_id, time.time()))
+            self._conn.execute('COMMIT')
+
+    def get_folders(self, object_id):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT upload_id, parent, name FROM folders '
+                'WHERE object_id = ?', (object_id,)).fetchall()
+
+    def get(self, object_id, parent, name):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT upload_id FROM folders WHERE object_id = ? '
+                'AND parent = ? AND name = ?',
+                (object_id, parent or '', name)).fetchone()
+        return row[0] if row else None
+
+    def add(self, object_id, parent, name, upload_id):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)',
+                (object_id, upload_id, parent or '', name))
+
+    def reconcile(self, object_id, parent, upload_list):
+        # Makes the children of parent match a fresh listing of it, folders
+        # deleted on the server are dropped along with everything below them
+        remote = {elem.get('upload_id'): elem.get('name')
+                  for elem in upload_list if elem.get('is_folder')}
+        with self._lock:
+            cached = self._conn.execute(
+                'SELECT upload_id FROM folders WHERE object_id = ? '
+                'AND parent = ?', (object_id, parent or '')).fetchall()
+            gone = [row[0] for row in cached if row[0] not in remote]
+            self._conn.execute('BEGIN')
+            self._evict(object_id, gone)
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?)',
+                [(object_id, upload_id, parent or '', name)
+                 for upload_id, name in remote.items()])
+            self._conn.execute('COMMIT')
+        if gone:
+            self._log.info('Dropped {0} folders deleted from object '
+                           '{1}'.format(len(gone), object_id))
+
+    def evict(self, object_id, upload_id):
+        # Drops a folder found deleted on the server and everything below it
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._evict(object_id, [upload_id])
+            self._conn.execute('COMMIT')
+
+    def find(self, object_id, path):
+        # Walks a path like /photos/2020 name by name from the object root
+        parent = ''
+        with self._lock:
+            for name in filter(None, path.split('/')):
+                row = self._conn.execute(
+                    'SELECT upload_id FROM folders WHERE object_id = ? '
+                    'AND parent = ? AND name = ?',
+                    (object_id, parent, name)).fetchone()
+                if not row:
+                    return None
+                parent = row[0]
+        return parent or None
+
+    def _evict(self, object_id, upload_ids):
+        while upload_ids:
+            self._conn.executemany(
+                'DELETE FROM folders WHERE object_id = ? AND upload_id = ?',
+                [(object_id, upload_id) for upload_id in upload_ids])
+            children = []
+            for upload_id in upload_ids:
+                children.extend(row[0] for row in self._conn.execute(
+                    'SELECT upload_id FROM folders WHERE object_id = ? '
+                    'AND parent = ?', (object_id, upload_id)))
+            upload_ids = children
+
+
+# Fetches the folder tree of an object breadth-first, keeping up to jobs
+# folder_view requests in flight
+class FolderLister:
+    def __init__(self, api, jobs=LIST_JOBS):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._api = api
+        self._jobs = jobs
+
+    def fetch(self, object_id, upload_list):
+        folders = []
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            pending = set()
+
+            def add_children(parent, children):
+                for elem in children:
+                    if not elem.get('is_folder'):
+                        continue
+                    folder_id = elem.get('upload_id')
+                    folders.append((folder_id, parent, elem.get('name')))
+                    future = executor.submit(self._api.get_object_folder_view,
+                                             folder_id, object_id=object_id)
+                    future.folder_id = folder_id
+                    pending.add(future)
+
+            add_children('', upload_list)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    add_children(future.folder_id,
+                                 future.result().get('upload_list', []))
+                self._log.debug('Found {0} folders, {1} pending'.format(
+                    len(folders), len(pending)))
+        self._log.info('Fetched {0} folders of object {1}'.format(
+            len(folders), object_id))
+        return folders
+
+    @staticmethod
+    def build_paths(folders):
+        # upload_id -> /parent/.../name from the parent map
+        parents = {folder_id: (parent, name)
+                   for folder_id, parent, name in folders}
+        paths = {'': ''}
+
+        def resolve(folder_id):
+            chain = []
+            while folder_id not in paths:
+                parent, name = parents.get(folder_id, ('', folder_id))
+                chain.append((folder_id, name))
+                folder_id = parent
+            path = paths[folder_id]
+            for child_id, name in reversed(chain):
+                path = '{0}/{1}'.format(path, name)
+                paths[child_id] = path
+            return path
+
+        return {folder_id: resolve(folder_id) for folder_id in parents}
@@ -0,0 +1,95 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class DedupIndex:
+    def __init__(self, path, max_entries):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._adds = 0
+        self._conn = sqlite3.connect(path, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY, size INTEGER, mtime REAL,
+                inode INTEGER, sha1 TEXT, used REAL);
+            CREATE TABLE IF NOT EXISTS uploads (
+                sha1 TEXT, object_id TEXT, folder TEXT, upload_id TEXT,
+                used REAL, PRIMARY KEY (sha1, object_id, folder));
+            CREATE INDEX IF NOT EXISTS hashes_used ON hashes (used);
+            CREATE INDEX IF NOT EXISTS uploads_used ON uploads (used);
+        ''')
+        self._log.info('Dedup index {0} opened'.format(path))
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._conn.close()
+
+    def get_hash(self, file):
+        # Trust the stored hash while path, size, mtime and inode are unchanged
+        stat = os.stat(file)
+        path = os.path.abspath(file)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT size, mtime, inode, sha1 FROM hashes WHERE path = ?',
+                (path,)).fetchone()
+            if not row or tuple(row[:3]) != (stat.st_size, stat.st_mtime,
+                                             stat.st_ino):
+                return None
+            self._conn.execute('UPDATE hashes SET used = ? WHERE path = ?',
+                               (time.time(), path))
+        return row[3]
+
+    def get_uploads(self, sha1):
+        # A hit keeps the content's uploads from being evicted, the latest
+        # upload is still tried first
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT object_id, folder, upload_id FROM uploads '
+                'WHERE sha1 = ? ORDER BY used DESC, rowid DESC',
+                (sha1,)).fetchall()
+            if rows:
+                self._conn.execute('UPDATE uploads SET used = ? '
+                                   'WHERE sha1 = ?', (time.time(), sha1))
+        return rows
+
+    def add_hash(self, file, sha1):
+        stat = os.stat(file)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)',
+                (os.path.abspath(file), stat.st_size, stat.st_mtime,
+                 stat.st_ino, sha1, time.time()))
+            self._added()
+
+    def add_upload(self, sha1, object_id, folder_token, upload_id):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?)',
+                (sha1, object_id, folder_token or '', upload_id, time.time()))
+            self._added()
+
+    def _added(self):
+        self._adds += 1
+        if not self._adds % 1000:
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used rows once a table outgrows max_entries
+        for table, key in (('hashes', 'path'), ('uploads', 'rowid')):
+            count = self._conn.execute(
+                'SELECT COUNT(*) FROM {0}'.format(table)).fetchone()[0]
+            if count <= self._max_entries:
+                continue
+            self._conn.execute(
+                'DELETE FROM {0} WHERE {1} IN (SELECT {1} FROM {0} '
+                'ORDER BY used LIMIT ?)'.format(table, key),
+                (count - self._max_entries,))
+            self._log.debug('Evicted {0} rows from {1}'.format(
+                count - self._max_entries, table))
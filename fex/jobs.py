@@ -0,0 +1,159 @@
+import collections
+import json
+import logging
+import os
+import time
+
+from fex.exceptions import (APIError, ConfigError, UploaderError,
+                            ObjectUploadPermissionsError)
+
+JOB_FIELDS = ('source', 'object_id', 'folder', 'secret', 'hint', 'public',
+              'view_password')
+# Set on the object, not per upload, so one value per object
+OBJECT_FIELDS = ('secret', 'hint', 'public', 'view_password')
+
+
+def read_jobs(path):
+    # One JSON object per line: {"source": "dir or file", "object_id": "...",
+    # "folder": "id or /path", "secret": "...", "public": true}
+    jobs = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as err:
+                raise ConfigError('{0}:{1}: {2}'.format(path, line_no, err))
+            if not isinstance(job, dict) or not job.get('source'):
+                raise ConfigError('{0}:{1}: source is required'.format(
+                    path, line_no))
+            unknown = set(job) - set(JOB_FIELDS)
+            if unknown:
+                logging.getLogger('read_jobs').warning(
+                    '{0}:{1}: ignoring {2}'.format(path, line_no,
+                                                   ', '.join(sorted(unknown))))
+            if isinstance(job.get('public'), bool):
+                job['public'] = ('false', 'true')[job['public']]
+            job['line'] = line_no
+            jobs.append(job)
+    return jobs
+
+
+# Runs the jobs of a manifest with one uploader, session and connection
+# pool. Jobs are grouped by object so the upload servers are looked up and
+# permissions set once per object instead of once per job
+class JobScheduler:
+    def __init__(self, uploader, printer, obj, jobs, status_path,
+                 resolve_folder=None):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._uploader = uploader
+        self._printer = printer
+        self._obj = obj
+        self._jobs = jobs
+        self._status_path = status_path
+        self._resolve_folder = resolve_folder
+        self._status = None
+        self._counts = collections.Counter()
+
+    def run(self):
+        groups = self._group()
+        self._log.info('Running {0} jobs for {1} objects'.format(
+            len(self._jobs), len(groups)))
+        with open(self._status_path, 'w') as self._status:
+            for jobs in groups:
+                self._run_group(jobs)
+
+        self._printer.print_summary([
+            ['Jobs done:', self._counts['done']],
+            ['Jobs failed:', self._counts['failed']],
+            ['Objects:', len(groups)],
+            ['Status file:', self._status_path],
+        ], object_url=False)
+        if self._counts['failed']:
+            raise UploaderError('{0} of {1} jobs failed'.format(
+                self._counts['failed'], len(self._jobs)))
+
+    def _group(self):
+        # Manifest order within and across objects, jobs without an object
+        # each get a new one
+        groups = collections.OrderedDict()
+        for job in self._jobs:
+            key = job.get('object_id') or ('new', job['line'])
+            groups.setdefault(key, []).append(job)
+        return list(groups.values())
+
+    def _run_group(self, jobs):
+        self._obj.object_id = jobs[0].get('object_id')
+        for field in OBJECT_FIELDS:
+            setattr(self._obj, field, self._object_option(jobs, field))
+        self._obj.folder_id = None
+        try:
+            if not self._obj.object_id:
+                # The journal finds objects of new uploads by their source
+                self._set_source(jobs[0])
+            view_response = self._uploader.open_object()
+        except (APIError, ConfigError, ObjectUploadPermissionsError,
+                OSError) as err:
+            self._log.error('Can\'t open object {0}: {1}'.format(
+                self._obj.object_id, err))
+            for job in jobs:
+                self._write_status(job, 'failed', 0, error=str(err))
+            return
+
+        for job in jobs:
+            self._run_job(job, view_response)
+
+    def _run_job(self, job, view_response):
+        started = time.monotonic()
+        self._log.info('Job {0}: {1} to object {2}'.format(
+            job['line'], job['source'], self._obj.object_id))
+        try:
+            self._set_source(job)
+            self._obj.folder_id = job.get('folder')
+            if self._obj.folder_id and self._obj.folder_id.startswith('/') \
+                    and self._resolve_folder:
+                self._obj.folder_id = self._resolve_folder(self._obj.folder_id)
+            self._uploader.upload_source(view_response)
+        except UploaderError as err:
+            self._write_status(job, 'failed', time.monotonic() - started,
+                               error=str(err), counts=True)
+        except (APIError, ConfigError, OSError) as err:
+            self._log.error('Job {0} failed: {1}'.format(job['line'], err))
+            self._write_status(job, 'failed', time.monotonic() - started,
+                               error=str(err))
+        else:
+            self._write_status(job, 'done', time.monotonic() - started,
+                               counts=True)
+
+    def _set_source(self, job):
+        if os.path.isdir(job['source']):
+            self._obj.dir_path, self._obj.file_list = job['source'], None
+        elif os.path.isfile(job['source']):
+            self._obj.dir_path, self._obj.file_list = None, [job['source']]
+        else:
+            raise ConfigError('{0} not found'.format(job['source']))
+
+    def _object_option(self, jobs, field):
+        values = [job[field] for job in jobs if job.get(field) is not None]
+        if len(set(values)) > 1:
+            self._log.warning('Jobs for object {0} set different {1}, using '
+                              'the first one'.format(self._obj.object_id,
+                                                     field))
+        return values[0] if values else None
+
+    def _write_status(self, job, status, elapsed, error=None, counts=False):
+        self._counts[status] += 1
+        record = {'line': job['line'], 'source': job['source'],
+                  'object_id': self._obj.object_id,
+                  'folder_id': self._obj.folder_id, 'status': status,
+                  'elapsed': round(elapsed, 3)}
+        if counts:
+            record.update(self._uploader.counts)
+            record['errors'] = ['{0}: {1}'.format(file, err)
+                                for file, err in self._uploader.errors]
+        if error:
+            record['error'] = error
+        self._status.write(json.dumps(record) + '\n')
+        self._status.flush()
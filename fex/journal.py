@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import threading
+
+
+class TransferJournal:
+    def __init__(self, path):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._path = path
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._files = {}
+        self._load()
+        self._handle = open(self._path, 'a')
+
+    def close(self):
+        with self._lock:
+            self._handle.close()
+
+    def get_object_id(self, source):
+        return self._objects.get(source)
+
+    def add_object(self, source, object_id):
+        self._objects[source] = object_id
+        self._write({'type': 'object', 'source': source,
+                     'object_id': object_id})
+
+    def is_done(self, object_id, folder_token, file):
+        record = self._files.get(self._file_key(
+            self._file_record(object_id, folder_token, file)))
+        return bool(record) and record['status'] == 'done'
+
+    def is_started(self, object_id, folder_token, file):
+        record = self._files.get(self._file_key(
+            self._file_record(object_id, folder_token, file)))
+        return bool(record) and record['status'] == 'started'
+
+    def start(self, object_id, folder_token, file):
+        record = self._file_record(object_id, folder_token, file,
+                                   status='started')
+        self._files[self._file_key(record)] = record
+        self._write(record)
+
+    def finish(self, object_id, folder_token, file, upload_id):
+        record = self._file_record(object_id, folder_token, file,
+                                   status='done', upload_id=upload_id)
+        self._files[self._file_key(record)] = record
+        self._write(record)
+
+    def _load(self):
+        if not os.path.isfile(self._path):
+            return
+
+        with open(self._path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line may be cut off by a crash mid-write
+                    self._log.warning('Skipping broken journal record')
+                    continue
+                if record['type'] == 'object':
+                    self._objects[record['source']] = record['object_id']
+                elif record['type'] == 'folder':
+                    # Folders are kept in fex.folders.FolderCache now
+                    continue
+                else:
+                    self._files[self._file_key(record)] = record
+        self._log.info('Journal {0} loaded: {1} files'.format(
+            self._path, len(self._files)))
+        self._compact()
+
+    def _compact(self):
+        tmp_path = '{0}.tmp'.format(self._path)
+        with open(tmp_path, 'w') as f:
+            for source, object_id in self._objects.items():
+                f.write(self._dumps({'type': 'object', 'source': source,
+                                     'object_id': object_id}))
+            for record in self._files.values():
+                f.write(self._dumps(record))
+        os.replace(tmp_path, self._path)
+
+    def _write(self, record):
+        with self._lock:
+            self._handle.write(self._dumps(record))
+            self._handle.flush()
+
+    @staticmethod
+    def _dumps(record):
+        return '{0}\n'.format(json.dumps(record, separators=(',', ':')))
+
+    @staticmethod
+    def _file_record(object_id, folder_token, file, **kwargs):
+        stat = os.stat(file)
+        record = {'type': 'file', 'object_id': object_id,
+                  'folder': folder_token or '', 'path': os.path.abspath(file),
+                  'size': stat.st_size, 'mtime': stat.st_mtime}
+        record.update(kwargs)
+        return record
+
+    @staticmethod
+    def _file_key(record):
+        return (record['object_id'], record['folder'], record['path'],
+                record['size'], record['mtime'])
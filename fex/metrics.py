@@ -0,0 +1,207 @@
+import collections
+import itertools
+import json
+import logging
+import os
+import threading
+
+from fex.constants import (LATENCY_BUCKETS, THROUGHPUT_BUCKETS,
+                           QUEUE_WAIT_BUCKETS)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = None
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the quantile, good enough for
+        # capacity planning without keeping every sample
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': {str(bound): count for bound, count in
+                        zip(self.buckets + [float('inf')],
+                            itertools.accumulate(self.counts))},
+        }
+
+
+# Timings and counters of API calls and uploads, recorded from worker threads
+# and exported as JSON or Prometheus text
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = collections.defaultdict(
+            lambda: Histogram(LATENCY_BUCKETS))
+        self._request_errors = collections.Counter()
+        self._hosts = collections.defaultdict(
+            lambda: {'bytes': 0, 'seconds': 0.0, 'files': 0, 'errors': 0})
+        self._file_throughput = Histogram(THROUGHPUT_BUCKETS)
+        self._queue_wait = Histogram(QUEUE_WAIT_BUCKETS)
+        self._counters = collections.Counter()
+
+    def observe_request(self, endpoint, elapsed, error=False):
+        endpoint = endpoint.strip('/')
+        with self._lock:
+            self._requests[endpoint].observe(elapsed)
+            if error:
+                self._request_errors[endpoint] += 1
+
+    def observe_upload(self, host, size, elapsed, error=False):
+        with self._lock:
+            stats = self._hosts[host]
+            stats['seconds'] += elapsed
+            if error:
+                stats['errors'] += 1
+                return
+            stats['bytes'] += size
+            stats['files'] += 1
+            self._counters['bytes_sent'] += size
+            if elapsed > 0:
+                self._file_throughput.observe(size / elapsed)
+
+    def observe_queue_wait(self, elapsed):
+        with self._lock:
+            self._queue_wait.observe(elapsed)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'requests': {endpoint: dict(histogram.to_dict(),
+                                            errors=self._request_errors[
+                                                endpoint])
+                             for endpoint, histogram in
+                             sorted(self._requests.items())},
+                'hosts': {host: dict(stats, throughput=int(
+                    stats['bytes'] / stats['seconds'])
+                    if stats['seconds'] else None)
+                          for host, stats in sorted(self._hosts.items())},
+                'file_throughput': self._file_throughput.to_dict(),
+                'queue_wait': self._queue_wait.to_dict(),
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                lines.append('# TYPE fex_{0}_total counter'.format(name))
+                lines.append('fex_{0}_total {1}'.format(name, value))
+
+            lines.append('# TYPE fex_request_seconds histogram')
+            for endpoint, histogram in sorted(self._requests.items()):
+                lines.extend(self._format_histogram(
+                    'fex_request_seconds', histogram,
+                    'endpoint="{0}"'.format(endpoint)))
+            lines.append('# TYPE fex_request_errors_total counter')
+            for endpoint, count in sorted(self._request_errors.items()):
+                lines.append('fex_request_errors_total{{endpoint="{0}"}} '
+                             '{1}'.format(endpoint, count))
+
+            for key in ('bytes', 'seconds', 'files', 'errors'):
+                lines.append('# TYPE fex_host_{0}_total counter'.format(key))
+                for host, stats in sorted(self._hosts.items()):
+                    lines.append('fex_host_{0}_total{{host="{1}"}} '
+                                 '{2}'.format(key, host, stats[key]))
+
+            lines.append('# TYPE fex_file_throughput_bytes histogram')
+            lines.extend(self._format_histogram('fex_file_throughput_bytes',
+                                                self._file_throughput))
+            lines.append('# TYPE fex_queue_wait_seconds histogram')
+            lines.extend(self._format_histogram('fex_queue_wait_seconds',
+                                                self._queue_wait))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path, fmt='json'):
+        data = self.to_prometheus() if fmt == 'prometheus' else self.to_json()
+        tmp_path = '{0}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _format_histogram(name, histogram, labels=''):
+        prefix = '{0},'.format(labels) if labels else ''
+        lines = []
+        for bound, count in zip(histogram.buckets + [float('inf')],
+                                itertools.accumulate(histogram.counts)):
+            lines.append('{0}_bucket{{{1}le="{2}"}} {3}'.format(
+                name, prefix, '+Inf' if bound == float('inf') else bound,
+                count))
+        suffix = '{{{0}}}'.format(labels) if labels else ''
+        lines.append('{0}_sum{1} {2}'.format(name, suffix, histogram.sum))
+        lines.append('{0}_count{1} {2}'.format(name, suffix, histogram.count))
+        return lines
+
+
+# Rewrites the metrics file every interval seconds during long runs and once
+# more when stopped
+class MetricsExporter:
+    def __init__(self, metrics, path, fmt='json', interval=None):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._metrics = metrics
+        self._path = path
+        self._fmt = fmt
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self._interval:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._dump()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self._dump()
+
+    def _dump(self):
+        try:
+            self._metrics.dump(self._path, self._fmt)
+        except OSError as err:
+            self._log.error('Can\'t write metrics to {0}: {1}'.format(
+                self._path, err))
+            return
+        self._log.debug('Metrics written to {0}'.format(self._path))
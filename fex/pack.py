@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tarfile
+import threading
+import time
+
+from fex.constants import PACK_NAME
+
+
+def plan_bundles(files, threshold, max_size, sizes=None):
+    # Splits the files of a directory into ones uploaded as they are and
+    # bundles of the small ones, a bundle of one file is no gain
+    singles = []
+    small = []
+    for file in sorted(files):
+        size = sizes[file] if sizes and file in sizes \
+            else os.path.getsize(file)
+        (small if size < threshold else singles).append((file, size))
+
+    bundles = []
+    current, current_size = [], 0
+    for file, size in small:
+        if current and current_size + size > max_size:
+            bundles.append(current)
+            current, current_size = [], 0
+        current.append(file)
+        current_size += size
+    if current:
+        bundles.append(current)
+
+    singles = [file for file, size in singles]
+    singles.extend(files[0] for files in bundles if len(files) == 1)
+    return singles, [Bundle(files) for files in bundles if len(files) > 1]
+
+
+# Tar archive of small files that is never written to disk: headers are
+# built up front so the exact length is known before the upload starts and
+# the body is generated while the multipart encoder reads it
+class Bundle:
+    def __init__(self, files, skipped=None):
+        self.files = files
+        self.skipped = skipped or []
+        self.members = []
+        offset = 0
+        for file in files:
+            stat = os.stat(file)
+            info = tarfile.TarInfo(os.path.basename(file))
+            info.size = stat.st_size
+            info.mtime = int(stat.st_mtime)
+            info.mode = stat.st_mode & 0o7777
+            header = info.tobuf(tarfile.PAX_FORMAT, tarfile.ENCODING,
+                                'surrogateescape')
+            # offset is where the file data starts inside the archive
+            self.members.append((file, header, offset + len(header),
+                                 stat.st_size, stat.st_mtime))
+            offset += len(header) + self._padded(stat.st_size)
+        self.size = offset + 2 * tarfile.BLOCKSIZE
+        digest = hashlib.sha1('\n'.join(os.path.abspath(file)
+                                        for file in files).encode(
+                                            errors='surrogateescape'))
+        self.name = PACK_NAME.format(digest.hexdigest()[:12])
+
+    def __str__(self):
+        return self.name
+
+    def exclude(self, files):
+        files = set(files)
+        return Bundle([file for file in self.files if file not in files],
+                      self.skipped + [file for file in self.files
+                                      if file in files])
+
+    def open(self, buffer_size):
+        return TarStream(self, buffer_size)
+
+    @staticmethod
+    def _padded(size):
+        return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+class TarStream:
+    def __init__(self, bundle, buffer_size):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._bundle = bundle
+        self._buffer_size = buffer_size
+        self._left = bundle.size
+        self._chunks = self._generate()
+        self._pending = b''
+
+    @property
+    def len(self):
+        return self._left
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._left
+        parts = []
+        read = 0
+        while read < size:
+            if not self._pending:
+                self._pending = next(self._chunks, b'')
+                if not self._pending:
+                    break
+            part = self._pending[:size - read]
+            self._pending = self._pending[len(part):]
+            parts.append(part)
+            read += len(part)
+        self._left -= read
+        return b''.join(parts)
+
+    def close(self):
+        self._chunks.close()
+
+    def _generate(self):
+        for file, header, offset, size, mtime in self._bundle.members:
+            yield header
+            left = size
+            with open(file, 'rb') as f:
+                while left:
+                    chunk = f.read(min(left, self._buffer_size))
+                    if not chunk:
+                        break
+                    left -= len(chunk)
+                    yield chunk
+            if left:
+                # The length is already promised, a file that shrank since
+                # the bundle was planned is padded with zeros
+                self._log.warning('{0} shrank while packing, padded with {1} '
+                                  'zero bytes'.format(file, left))
+                yield bytes(left)
+            padding = -size % tarfile.BLOCKSIZE
+            if padding:
+                yield bytes(padding)
+        yield bytes(2 * tarfile.BLOCKSIZE)
+
+
+# Where every packed file went: object, folder, bundle and its offset in the
+# bundle, so a single file can be found and cut out of the tar later
+class BundleIndex:
+    def __init__(self, path):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS members (
+                path TEXT, object_id TEXT, folder TEXT, bundle TEXT,
+                upload_id TEXT, offset INTEGER, size INTEGER, mtime REAL,
+                added REAL, PRIMARY KEY (path, object_id, folder));
+            CREATE INDEX IF NOT EXISTS members_bundle ON members (upload_id);
+        ''')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add(self, bundle, object_id, folder_token, upload_id):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO members VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(os.path.abspath(file), object_id, folder_token or '',
+                  bundle.name, upload_id, offset, size, mtime, now)
+                 for file, header, offset, size, mtime in bundle.members])
+
+    def find(self, name):
+        # Exact path or any path containing name, _ and % of file names
+        # aren't wildcards
+        path = os.path.abspath(name)
+        pattern = name.replace('\\', '\\\\').replace('%', '\\%') \
+            .replace('_', '\\_')
+        with self._lock:
+            return self._conn.execute(
+                'SELECT path, object_id, folder, bundle, upload_id, offset, '
+                'size FROM members WHERE path = ? OR path LIKE ? '
+                "ESCAPE '\\' ORDER BY path, added DESC",
+                (path, '%{0}%'.format(pattern))).fetchall()
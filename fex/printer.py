@@ -1,4 +1,6 @@
+import json
 import logging
+import re
 
 from tabulate import tabulate
 from fex.constants import HOST
@@ -14,18 +16,21 @@ class Printer:
                       secret=None, hint=None):
         date = object.headers['date']
         upload_time = object.elapsed.total_seconds()
-        object = object.json()
+        return self._parse_result(object.json(), date, upload_time,
+                                  view_response, view_password, secret, hint)
+
+    def _parse_result(self, object, date, upload_time, view_response,
+                      view_password=None, secret=None, hint=None):
         size = convert_size(object['size'])
-        post = view_response.get('post')
+        name, _, description = view_response.get('post').partition('\n')
         msgs = [
             ['File name:', object['name']],
             ['File size:', size],
             ['SHA1 server:', object['sha1']],
             ['CRC32 server:', object['crc32']],
             ['Upload date:', date],
-            ['Object name:', post.split('\n', 1)[0]],
-            ['Object description:',
-             ('', post.split('\n', 1)[-1])[len(post.split('\n')) >= 2]],
+            ['Object name:', name],
+            ['Object description:', description],
             ['Object ID:', self._obj.object_id],
             ['Object URL:', '{0}/#!{1}'.format(HOST, self._obj.object_id)],
             ['Folder ID:', self._obj.folder_id],
@@ -53,6 +58,51 @@ class Printer:
         headers = headers or []
         print(tabulate(parsed_obj, headers=headers, showindex=showindex))
 
+    def print_result(self, result, date, upload_time, view_response,
+                     headers=None, showindex=None):
+        parsed_obj = self._parse_result(result, date, upload_time,
+                                        view_response)
+        headers = headers or []
+        print(tabulate(parsed_obj, headers=headers, showindex=showindex))
+
     def print_mesasge(self, msg, headers=None, showindex=None):
         headers = headers or []
         print(tabulate(msg, headers=headers, showindex=showindex))
+
+    def print_record(self, record):
+        # One compact JSON line per event for --output jsonl
+        print(json.dumps(record, separators=(',', ':')), flush=True)
+
+    def print_summary(self, msg, object_url=True):
+        if self._obj.output == 'jsonl':
+            self.print_record(dict(
+                {'type': 'summary'},
+                **{re.sub('[^a-z0-9]+', '_', label.lower()).strip('_'): value
+                   for label, value in msg}))
+            return
+        if self._obj.output != 'table' and object_url:
+            # Stands in for the per-file tables that carried it
+            msg = msg + [['Object URL:', '{0}/#!{1}'.format(
+                HOST, self._obj.object_id)]]
+        self.print_mesasge(msg)
+
+    def file_record(self, file, result, upload_time, folder_token=None,
+                    **extra):
+        record = {
+            'type': 'file',
+            'file': file,
+            'name': result.get('name'),
+            'size': result.get('size'),
+            'upload_id': result.get('upload_id'),
+            'object_id': self._obj.object_id,
+            # Directory uploads go to folders of their own, the target
+            # folder only stands in when the caller doesn't know it
+            'folder_id': folder_token or self._obj.folder_id,
+            'sha1': result.get('sha1'),
+            'crc32': result.get('crc32'),
+            'url': '{0}/load/{1}/{2}'.format(HOST, self._obj.object_id,
+                                             result.get('upload_id')),
+            'upload_time': round(upload_time, 3),
+        }
+        record.update(extra)
+        return record
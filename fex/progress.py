@@ -0,0 +1,158 @@
+import contextlib
+import json
+import shutil
+import sys
+import threading
+import time
+
+from fex.constants import PROGRESS_INTERVAL
+from fex.utils import convert_size
+
+
+class FileProgress:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.bytes_read = 0
+        self.started = time.monotonic()
+
+    def update(self, monitor):
+        # Called for every chunk, so only store the counter. The multipart
+        # framing is counted too, hence the cap
+        self.bytes_read = min(monitor.bytes_read, self.size)
+
+
+# Collects byte counters of all transfers in flight and redraws a summary at
+# a fixed rate instead of printing on every chunk
+class ProgressReporter:
+    def __init__(self, mode='auto', interval=PROGRESS_INTERVAL):
+        if mode == 'auto':
+            mode = 'tty' if sys.stdout.isatty() else 'quiet'
+        self._mode = mode
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._active = []
+        self._expected_files = 0
+        self._expected_bytes = 0
+        self._done_files = 0
+        self._done_bytes = 0
+        self._started = None
+        self._rate = 0.0
+        self._last_sample = (0.0, 0)
+        self._drawn = False
+
+    def start(self):
+        self._started = time.monotonic()
+        self._last_sample = (self._started, 0)
+        if self._mode == 'quiet':
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self._draw()
+        if self._drawn:
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+            self._drawn = False
+
+    def add_expected(self, files, size):
+        with self._lock:
+            self._expected_files += files
+            self._expected_bytes += size
+
+    def start_file(self, name, size):
+        progress = FileProgress(name, size)
+        with self._lock:
+            self._active.append(progress)
+        return progress
+
+    def finish_file(self, progress, uploaded=True):
+        with self._lock:
+            self._active.remove(progress)
+            if uploaded:
+                self._done_files += 1
+                self._done_bytes += progress.size
+
+    @contextlib.contextmanager
+    def suspended(self):
+        # Keeps the status line out of the way of other output
+        with self._lock:
+            self._clear()
+            yield
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self._draw()
+
+    def _draw(self):
+        with self._lock:
+            now = time.monotonic()
+            sent = self._done_bytes + sum(p.bytes_read for p in self._active)
+            last_time, last_sent = self._last_sample
+            if now > last_time:
+                sample = (sent - last_sent) / (now - last_time)
+                self._rate = sample if not self._rate else \
+                    self._rate + 0.3 * (sample - self._rate)
+            self._last_sample = (now, sent)
+
+            left = max(self._expected_bytes - sent, 0)
+            eta = left / self._rate if self._rate else None
+            if self._mode == 'json':
+                self._draw_json(now, sent, eta)
+            else:
+                self._draw_tty(sent, eta)
+
+    def _draw_tty(self, sent, eta):
+        parts = ['{0}/{1} files'.format(self._done_files,
+                                        self._expected_files),
+                 '{0}/{1}'.format(convert_size(sent),
+                                  convert_size(self._expected_bytes)),
+                 '{0}/s'.format(convert_size(self._rate)),
+                 'ETA {0}'.format(self._format_eta(eta))]
+        now = time.monotonic()
+        for progress in self._active:
+            elapsed = max(now - progress.started, 1e-6)
+            parts.append('{0} {1:.0f}% {2}/s'.format(
+                progress.name,
+                progress.bytes_read / max(progress.size, 1) * 100,
+                convert_size(progress.bytes_read / elapsed)))
+        width = shutil.get_terminal_size().columns - 1
+        sys.stdout.write('\r{0}\033[K'.format(' | '.join(parts)[:width]))
+        sys.stdout.flush()
+        self._drawn = True
+
+    def _draw_json(self, now, sent, eta):
+        sys.stderr.write('{0}\n'.format(json.dumps({
+            'elapsed': round(now - self._started, 2),
+            'files_done': self._done_files,
+            'files_total': self._expected_files,
+            'bytes_sent': sent,
+            'bytes_total': self._expected_bytes,
+            'rate': int(self._rate),
+            'eta': round(eta, 1) if eta is not None else None,
+            'active': [{'name': p.name, 'bytes_read': p.bytes_read,
+                        'size': p.size} for p in self._active],
+        })))
+        sys.stderr.flush()
+
+    def _clear(self):
+        if self._drawn:
+            sys.stdout.write('\r\033[K')
+            sys.stdout.flush()
+
+    @staticmethod
+    def _format_eta(eta):
+        if eta is None:
+            return '--:--'
+        minutes, seconds = divmod(int(eta), 60)
+        hours, minutes = divmod(minutes, 60)
+        return '{0}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
@@ -0,0 +1,137 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from fex.constants import (RETRY_ATTEMPTS, RETRY_BACKOFF, RETRY_MAX_BACKOFF,
+                           RETRY_STATUS_CODES, BREAKER_THRESHOLD,
+                           BREAKER_RESET_TIMEOUT)
+
+# The request may not have reached the server or its answer got lost. A bad
+# URL, header or schema fails the same way every time
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError, TimeoutError)
+if aiohttp is not None:
+    RETRYABLE_ERRORS += (aiohttp.ClientConnectionError,
+                         aiohttp.ClientPayloadError)
+# The file being uploaded can't be read, another attempt won't change that
+LOCAL_ERRORS = (FileNotFoundError, PermissionError, IsADirectoryError)
+
+
+# Opens per host after too many consecutive failures, closes on success
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = {}
+        self._opened = {}
+
+    def is_open(self, host):
+        # Once the timeout passes requests go through again, but the failure
+        # count is kept so a single failure reopens the circuit
+        with self._lock:
+            opened = self._opened.get(host)
+            return opened is not None and \
+                time.monotonic() - opened < self._reset_timeout
+
+    def record_success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            if self._opened.pop(host, None) is not None:
+                self._log.info('Circuit for {0} closed'.format(host))
+
+    def record_failure(self, host):
+        with self._lock:
+            self._failures[host] = self._failures.get(host, 0) + 1
+            if self._failures[host] >= self._threshold:
+                if host not in self._opened:
+                    self._log.warning('Circuit for {0} opened after {1} '
+                                      'failures'.format(host,
+                                                        self._failures[host]))
+                self._opened[host] = time.monotonic()
+
+
+class RetryPolicy:
+    def __init__(self, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF,
+                 max_backoff=RETRY_MAX_BACKOFF):
+        self._lock = threading.Lock()
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker()
+        self.retries = 0
+        self.failures = 0
+
+    def get_delay(self, attempt, err, idempotent=True):
+        # Returns seconds to wait before the next attempt or None to give up
+        with self._lock:
+            self.failures += 1
+            if attempt >= self.attempts or not self.is_retryable(err,
+                                                                 idempotent):
+                return None
+            self.retries += 1
+
+        retry_after = self._get_retry_after(err)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        # Full jitter keeps concurrent workers from retrying in lockstep
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def is_retryable(err, idempotent=True):
+        status = RetryPolicy._get_status(err)
+        if status is not None:
+            # 429 and 503 mean the request wasn't processed
+            return status in (429, 503) or (idempotent and
+                                            status in RETRY_STATUS_CODES)
+        if RetryPolicy._is_local_error(err):
+            return False
+        if isinstance(err, requests.ConnectTimeout):
+            return True
+        return idempotent and isinstance(err, RETRYABLE_ERRORS)
+
+    @staticmethod
+    def _is_local_error(err):
+        # requests reports a failed read of the body as a connection error,
+        # the OSError is in the arguments of the exceptions it wraps
+        while err is not None:
+            if isinstance(err, LOCAL_ERRORS):
+                return True
+            err = next((arg for arg in getattr(err, 'args', ())
+                        if isinstance(arg, BaseException)), None)
+        return False
+
+    @staticmethod
+    def _get_status(err):
+        response = getattr(err, 'response', None)
+        if response is not None:
+            return response.status_code
+        return getattr(err, 'status', None)
+
+    @staticmethod
+    def _get_retry_after(err):
+        response = getattr(err, 'response', None)
+        headers = getattr(response, 'headers', None) \
+            or getattr(err, 'headers', None) or {}
+        value = headers.get('Retry-After')
+        if not value:
+            return None
+        if value.isdigit():
+            return int(value)
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0, date.timestamp() - time.time())
@@ -0,0 +1,143 @@
+import contextlib
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+POLICIES = ('fifo', 'lpt', 'spt', 'locality')
+
+
+# Holds transfers until a worker is free and then starts the best one by
+# policy: lpt (largest first) keeps a big file from starting last and
+# deciding when the run ends, spt (smallest first) gets results out early,
+# locality keeps files of a directory together. Only jobs transfers are
+# handed to the executor at a time so the order is decided here
+class TransferQueue:
+    def __init__(self, executor, jobs, policy='fifo'):
+        self._executor = executor
+        self._jobs = jobs
+        self._policy = policy
+        self._lock = threading.Lock()
+        self._heap = []
+        self._order = itertools.count()
+        self._running = 0
+        self._paused = 0
+        # [started, finished, size, predicted duration] of every transfer,
+        # in start order
+        self._transfers = []
+        # Running sums for the duration fit: n, sizes, durations, squared
+        # sizes, size * duration
+        self._fit = [0, 0.0, 0.0, 0.0, 0.0]
+
+    def submit(self, path, size, fn, *args):
+        future = Future()
+        with self._lock:
+            heapq.heappush(self._heap, (self._key(path, size),
+                                        next(self._order), size, fn, args,
+                                        future))
+        self._dispatch()
+        return future
+
+    @contextlib.contextmanager
+    def paused(self):
+        # Collects a batch before starting any of it, so the policy sees
+        # the whole batch instead of starting the first submitted
+        with self._lock:
+            self._paused += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._paused -= 1
+            self._dispatch()
+
+    def report(self):
+        # Actual makespan from the first start to the last finish against
+        # the list schedule of the durations predicted when each transfer
+        # started, and the lower bound no order can beat
+        with self._lock:
+            transfers = [list(t) for t in self._transfers]
+        finished = [t for t in transfers if t[1] is not None]
+        if not finished:
+            return None
+        durations = [finished_at - started for started, finished_at, size,
+                     predicted in finished]
+        workers = [0.0] * min(self._jobs, len(finished))
+        for started, finished_at, size, predicted in finished:
+            heapq.heapreplace(workers, workers[0] + (predicted or 0.0))
+        return {
+            'policy': self._policy,
+            'transfers': len(finished),
+            'predicted': max(workers),
+            'lower_bound': max(max(durations),
+                               sum(durations) / self._jobs),
+            'actual': max(t[1] for t in finished) -
+            min(t[0] for t in finished),
+        }
+
+    def _key(self, path, size):
+        if self._policy == 'lpt':
+            return (-size,)
+        if self._policy == 'spt':
+            return (size,)
+        if self._policy == 'locality':
+            return os.path.split(path)
+        return ()
+
+    def _estimate(self, size):
+        # duration = latency + size / throughput fitted by least squares to
+        # the transfers finished so far, None before the first one
+        n, sizes, durations, squares, products = self._fit
+        if not n:
+            return None
+        variance = n * squares - sizes ** 2
+        if variance > 0:
+            slope = (n * products - sizes * durations) / variance
+            latency = (durations - slope * sizes) / n
+            if slope >= 0 and latency >= 0:
+                return latency + slope * size
+        # One size so far or a fit that makes no sense, scale the average
+        if sizes:
+            return durations / sizes * size
+        return durations / n
+
+    def _add_sample(self, size, duration):
+        first = not self._fit[0]
+        for index, value in enumerate((1, size, duration, size * size,
+                                       size * duration)):
+            self._fit[index] += value
+        if first:
+            # Transfers started before anything finished get the first
+            # estimate there is
+            for record in self._transfers:
+                if record[3] is None:
+                    record[3] = self._estimate(record[2])
+
+    def _dispatch(self):
+        started = []
+        with self._lock:
+            while not self._paused and self._running < self._jobs \
+                    and self._heap:
+                key, order, size, fn, args, future = heapq.heappop(self._heap)
+                self._running += 1
+                record = [time.monotonic(), None, size, self._estimate(size)]
+                self._transfers.append(record)
+                started.append((fn, args, future, record))
+        for fn, args, future, record in started:
+            self._executor.submit(fn, *args).add_done_callback(
+                lambda inner, future=future, record=record:
+                self._on_done(inner, future, record))
+
+    def _on_done(self, inner, future, record):
+        with self._lock:
+            self._running -= 1
+            record[1] = time.monotonic()
+            self._add_sample(record[2], record[1] - record[0])
+        # Start the next transfer before waking whoever waits on this one
+        self._dispatch()
+        if inner.exception():
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
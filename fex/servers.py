@@ -0,0 +1,68 @@
+import logging
+import threading
+
+from fex.constants import SERVER_EWMA_ALPHA, SERVER_MIN_SAMPLE_SIZE
+
+
+class ServerStats:
+    def __init__(self):
+        self.active = 0
+        self.throughput = None
+        self.error_rate = 0.0
+        self.uploaded = 0
+        self.errors = 0
+
+
+# Spreads transfers over every fs_upload host FEX returned, preferring hosts
+# that are fast and healthy, and sidelining hosts that start failing
+class UploadServerPool:
+    def __init__(self, servers, breaker):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._breaker = breaker
+        self._lock = threading.Lock()
+        self._stats = {server: ServerStats() for server in servers}
+        self._log.debug('Upload servers: {0}'.format(servers))
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def acquire(self, exclude=()):
+        with self._lock:
+            candidates = [server for server in self._stats
+                          if server not in exclude] or list(self._stats)
+            healthy = [server for server in candidates
+                       if not self._breaker.is_open(server)]
+            server = max(healthy or candidates, key=self._score)
+            self._stats[server].active += 1
+        return server
+
+    def release(self, server, size=0, elapsed=0.0, error=False):
+        with self._lock:
+            stats = self._stats[server]
+            stats.active -= 1
+            stats.error_rate += SERVER_EWMA_ALPHA * (error - stats.error_rate)
+            if error:
+                stats.errors += 1
+                self._breaker.record_failure(server)
+                self._log.warning('Upload server {0} failed, error rate '
+                                  '{1:.2f}'.format(server, stats.error_rate))
+                return
+
+            stats.uploaded += size
+            self._breaker.record_success(server)
+            # Tiny files measure latency rather than throughput
+            if size >= SERVER_MIN_SAMPLE_SIZE and elapsed > 0:
+                sample = size / elapsed
+                stats.throughput = sample if stats.throughput is None else \
+                    stats.throughput + SERVER_EWMA_ALPHA * (sample -
+                                                            stats.throughput)
+
+    def _score(self, server):
+        stats = self._stats[server]
+        # Unmeasured hosts look as fast as the best one so they get tried
+        measured = [s.throughput for s in self._stats.values()
+                    if s.throughput is not None]
+        throughput = stats.throughput if stats.throughput is not None \
+            else max(measured, default=1.0)
+        return throughput * (1 - stats.error_rate) / (stats.active + 1)
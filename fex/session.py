@@ -0,0 +1,75 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows, processes there don't share the jar
+    fcntl = None
+
+from fex.constants import SESSION_TTL
+
+
+# Remembers when the cookie jar was last checked against the account
+# endpoint, so runs within the TTL can skip that round trip. Shared by all
+# uploader processes of a user, the lock file serializes them
+class SessionCache:
+    def __init__(self, path, ttl=SESSION_TTL):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._path = path
+        self._lock_path = '{0}.lock'.format(path)
+        self._ttl = ttl
+        # flock isn't reentrant within a process, a relogin can happen while
+        # login holds the lock
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def lock(self):
+        with self._thread_lock:
+            self._depth += 1
+            try:
+                if self._depth > 1 or fcntl is None:
+                    yield
+                    return
+                with open(self._lock_path, 'a') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+            finally:
+                self._depth -= 1
+
+    def get_account(self):
+        # Account info of the last validation while it's still fresh
+        data = self._load()
+        if not data or time.time() - data.get('validated', 0) >= self._ttl:
+            return None
+        return data.get('account')
+
+    def validated(self, account):
+        data = {'validated': time.time(), 'account': account}
+        tmp_path = '{0}.tmp'.format(self._path)
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path)
+
+    def invalidate(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path)
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            self._log.warning('Session cache {0} is corrupt, '
+                              'ignoring'.format(self._path))
+            return None
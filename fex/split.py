@@ -0,0 +1,75 @@
+import io
+import json
+import os
+
+from fex.constants import SPLIT_PART_NAME, SPLIT_MANIFEST_NAME
+
+
+def split_file(file, part_size):
+    size = os.path.getsize(file)
+    return [FilePart(file, number, offset, min(part_size, size - offset))
+            for number, offset in enumerate(range(0, size, part_size), 1)]
+
+
+# A byte range of a large file uploaded as a file of its own, read straight
+# from the original by offset
+class FilePart:
+    def __init__(self, file, number, offset, size):
+        self.file = file
+        self.number = number
+        self.offset = offset
+        self.size = size
+        self.name = SPLIT_PART_NAME.format(os.path.basename(file), number)
+
+    def __str__(self):
+        return self.name
+
+    def open(self, buffer_size):
+        return FilePartReader(self, buffer_size)
+
+
+class FilePartReader:
+    def __init__(self, part, buffer_size):
+        self._file = open(part.file, 'rb', buffering=buffer_size)
+        self._file.seek(part.offset)
+        self._left = part.size
+
+    @property
+    def len(self):
+        return self._left
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._left:
+            size = self._left
+        chunk = self._file.read(size)
+        self._left -= len(chunk)
+        return chunk
+
+    def close(self):
+        self._file.close()
+
+
+# Sidecar uploaded next to the parts once all of them are done: part order,
+# offsets, sizes and SHA1s, enough to put the file back together and check it
+class SplitManifest:
+    def __init__(self, file, parts, results):
+        stat = os.stat(file)
+        self.name = SPLIT_MANIFEST_NAME.format(os.path.basename(file))
+        self.parts = [{'name': part.name, 'offset': part.offset,
+                       'size': part.size, 'sha1': sha1,
+                       'upload_id': upload_id}
+                      for part, (sha1, upload_id) in zip(parts, results)]
+        self.data = json.dumps({
+            'name': os.path.basename(file),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'part_size': parts[0].size,
+            'parts': self.parts,
+        }, indent=1).encode()
+        self.size = len(self.data)
+
+    def __str__(self):
+        return self.name
+
+    def open(self, buffer_size):
+        return io.BytesIO(self.data)
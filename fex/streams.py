@@ -0,0 +1,62 @@
+import os
+from binascii import crc32
+from hashlib import sha1
+
+
+def stream_size(stream):
+    if hasattr(stream, '__len__'):
+        return len(stream)
+    if hasattr(stream, 'len'):
+        return stream.len
+    if hasattr(stream, 'getvalue'):
+        return len(stream.getvalue()) - stream.tell()
+    if not hasattr(stream, 'fileno'):
+        # Generated while read, e.g. compressed, the size isn't known
+        return None
+    return os.fstat(stream.fileno()).st_size - stream.tell()
+
+
+# Checksums the bytes as the multipart encoder reads them, so verifying an
+# upload doesn't need another pass over the file
+class HashingReader:
+    def __init__(self, stream):
+        self._stream = stream
+        self._left = stream_size(stream)
+        self._sha1 = sha1()
+        self._crc32 = 0
+
+    @property
+    def len(self):
+        return self._left
+
+    def read(self, size=-1):
+        chunk = self._stream.read(size)
+        if self._left is not None:
+            self._left -= len(chunk)
+        self._sha1.update(chunk)
+        self._crc32 = crc32(chunk, self._crc32)
+        return chunk
+
+    def sha1(self):
+        return self._sha1.hexdigest()
+
+    def crc32(self):
+        return '%08x' % (self._crc32 & 0xFFFFFFFF)
+
+
+class ThrottledReader:
+    def __init__(self, stream, limiter):
+        self._stream = stream
+        self._left = stream_size(stream)
+        self._limiter = limiter
+
+    @property
+    def len(self):
+        return self._left
+
+    def read(self, size=-1):
+        chunk = self._stream.read(size)
+        if self._left is not None:
+            self._left -= len(chunk)
+        self._limiter.consume(len(chunk))
+        return chunk
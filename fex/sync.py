@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import threading
+
+
+class SyncManifest:
+    def __init__(self, path, root):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._path = path
+        self._root = os.path.abspath(root)
+        self._lock = threading.Lock()
+        self.object_id = None
+        self.parent = ''
+        self._files = {}
+        self._folders = {}
+        self._load()
+
+    @property
+    def is_empty(self):
+        return not self._folders
+
+    def reset(self, object_id, parent_token):
+        self.object_id = object_id
+        self.parent = parent_token or ''
+        self._files = {}
+        self._folders = {}
+
+    def is_current(self, file):
+        record = self._files.get(self.relpath(file))
+        if not record:
+            return False
+        stat = os.stat(file)
+        # Remote listings carry no mtime, size alone decides then
+        return record[0] == stat.st_size and record[1] in (None,
+                                                           stat.st_mtime)
+
+    def add_file(self, file):
+        stat = os.stat(file)
+        with self._lock:
+            self._files[self.relpath(file)] = [stat.st_size, stat.st_mtime]
+
+    def add_remote_file(self, relpath, size):
+        self._files[relpath] = [size, None]
+
+    def get_folder(self, dir_path):
+        with self._lock:
+            return self._folders.get(self.relpath(dir_path))
+
+    def add_folder(self, dir_path, token):
+        with self._lock:
+            self._folders[self.relpath(dir_path)] = token
+
+    def add_remote_folder(self, relpath, token):
+        self._folders[relpath] = token
+
+    def relpath(self, path):
+        relpath = os.path.relpath(os.path.abspath(path), self._root)
+        return '' if relpath == '.' else relpath.replace(os.sep, '/')
+
+    def save(self):
+        with self._lock:
+            data = {'root': self._root, 'object_id': self.object_id,
+                    'parent': self.parent, 'files': self._files,
+                    'folders': self._folders}
+            tmp_path = '{0}.tmp'.format(self._path)
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp_path, self._path)
+        self._log.info('Sync manifest saved to {0}: {1} files, {2} '
+                       'folders'.format(self._path, len(self._files),
+                                        len(self._folders)))
+
+    def _load(self):
+        if not os.path.isfile(self._path):
+            return
+
+        with open(self._path) as f:
+            data = json.load(f)
+        if data.get('root') != self._root:
+            self._log.warning('Sync manifest {0} belongs to {1}, '
+                              'ignoring'.format(self._path, data.get('root')))
+            return
+        self.object_id = data['object_id']
+        self.parent = data['parent']
+        self._files = data['files']
+        self._folders = data['folders']
+        self._log.info('Sync manifest {0} loaded: {1} files, {2} '
+                       'folders'.format(self._path, len(self._files),
+                                        len(self._folders)))
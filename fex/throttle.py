@@ -0,0 +1,98 @@
+import logging
+import os
+import threading
+import time
+
+from fex.utils import parse_size
+
+
+def parse_schedule(schedule):
+    # "09:00-18:00=50M,18:00-09:00=0", a rate of 0 means unlimited
+    windows = []
+    for item in filter(None, schedule.split(',')):
+        window, rate = item.split('=')
+        start, end = (_parse_time(value) for value in window.split('-'))
+        windows.append((start, end, parse_size(rate)))
+    return windows
+
+
+def _parse_time(value):
+    hours, minutes = (int(part) for part in value.strip().split(':'))
+    if not (0 <= minutes < 60 and 0 <= hours * 60 + minutes <= 24 * 60):
+        raise ValueError('{0} isn\'t a time of day'.format(value))
+    return hours * 60 + minutes
+
+
+# Token bucket shared by every upload worker, so the sum of all transfers
+# stays under the cap. The cap follows an optional time-of-day schedule and
+# an optional control file that can be edited while uploads run
+class RateLimiter:
+    def __init__(self, rate=0, schedule=None, control_file=None):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._schedule = schedule or []
+        self._control_file = control_file
+        self._control_mtime = None
+        self._control_checked = 0.0
+        self._tokens = 0.0
+        self._last = time.monotonic()
+
+    @property
+    def rate(self):
+        with self._lock:
+            return self._get_rate()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._rate = rate
+        self._log.info('Upload rate limit set to {0}/s'.format(rate or
+                                                              'unlimited'))
+
+    def reload(self):
+        self._control_mtime = None
+        self._control_checked = 0.0
+
+    def consume(self, size):
+        with self._lock:
+            self._check_control_file()
+            rate = self._get_rate()
+            now = time.monotonic()
+            if not rate:
+                self._tokens, self._last = 0.0, now
+                return
+            # At most one second worth of burst
+            self._tokens = min(rate, self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= size
+            delay = -self._tokens / rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def _get_rate(self):
+        now = time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self._schedule:
+            if start <= minute < end or (end < start and
+                                         (minute >= start or minute < end)):
+                return rate
+        return self._rate
+
+    def _check_control_file(self):
+        if not self._control_file \
+                or time.monotonic() - self._control_checked < 5:
+            return
+        self._control_checked = time.monotonic()
+        try:
+            mtime = os.stat(self._control_file).st_mtime
+            if mtime == self._control_mtime:
+                return
+            self._control_mtime = mtime
+            with open(self._control_file) as f:
+                self._rate = parse_size(f.read().strip() or '0')
+        except (OSError, ValueError) as err:
+            self._log.warning('Can\'t read rate limit from {0}: {1}'.format(
+                self._control_file, err))
+            return
+        self._log.info('Upload rate limit set to {0}/s from {1}'.format(
+            self._rate or 'unlimited', self._control_file))
@@ -1,119 +1,645 @@
+import collections
+import contextlib
+import functools
 import logging
+import mmap
 import ntpath
 import os
-import sys
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
+import requests
 from requests_toolbelt import (MultipartEncoder, MultipartEncoderMonitor)
 
-from fex.utils import convert_size, calculate_crc32, calculate_sha1
-from fex.exceptions import UploaderError, ObjectUploadPermissionsError
+from fex.compress import CODECS, CompressingReader, is_compressible
+from fex.metrics import Metrics
+from fex.pack import Bundle, plan_bundles
+from fex.progress import ProgressReporter
+from fex.retry import RetryPolicy
+from fex.scheduling import TransferQueue
+from fex.servers import UploadServerPool
+from fex.split import SplitManifest, split_file
+from fex.streams import HashingReader, ThrottledReader
+from fex.utils import calculate_sha1, convert_size
+from fex.exceptions import (APIError, UploaderError,
+                            ObjectUploadPermissionsError)
+
+
+# A file found in the dedup index: copied_from is the source upload when it
+# was copied, None when it already was in the target folder
+DedupResult = collections.namedtuple('DedupResult',
+                                     'sha1 upload_id copied_from')
 
 
 class Uploader:
-    def __init__(self, api, printer, obj):
+    def __init__(self, api, printer, obj, journal=None, index=None,
+                 manifest=None, retry=None, limiter=None, progress=None,
+                 metrics=None, folders=None, bundles=None):
         self._log = logging.getLogger(self.__class__.__name__)
         self._api = api
         self._printer = printer
         self._obj = obj
+        self._journal = journal
+        self._index = index
+        self._manifest = manifest
+        self._retry = retry or RetryPolicy()
+        self._limiter = limiter
+        self._progress = progress or ProgressReporter('quiet')
+        self._metrics = metrics or Metrics()
+        self._folders = folders
+        self._bundles = bundles
+        self._servers = None
+        self._queue = None
+        self._sizes = {}
+        self._splits = {}
+        self._errors = []
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._compressed = collections.Counter()
+        # Folders taken from the cache or the last sync, token -> how to
+        # create them again, and the tokens of those that were
+        self._reused_folders = {}
+        self._replaced_folders = {}
+        self._folder_lock = threading.RLock()
+
+    @property
+    def failed(self):
+        return [file for file, err in self._errors]
+
+    @property
+    def errors(self):
+        return list(self._errors)
+
+    @property
+    def counts(self):
+        return {'uploaded': self._counts['uploaded'],
+                'copied': self._counts['copied'],
+                'skipped': self._counts['skipped'],
+                'failed': len(self._errors)}
 
     def upload(self):
+        view_response = self.open_object()
+        self.upload_source(view_response)
+
+    def open_object(self):
+        # Object level setup: creation or upload servers, permissions and
+        # secret. Done once per object, then upload_source() runs for every
+        # source in it
+        self._reused_folders = {}
+        self._replaced_folders = {}
+        # reuse the object created by a previous run of the same upload
+        if self._journal and not self._obj.object_id:
+            self._obj.object_id = self._journal.get_object_id(self._source())
+            if self._obj.object_id:
+                self._log.info('Resuming upload to Object ID: {0}'.format(
+                    self._obj.object_id))
+        if self._manifest and not self._obj.object_id:
+            self._obj.object_id = self._manifest.object_id
+
         # create new object if self._obj.object_id == None (for anonymous too)
         # or get upload server
         if (self._obj.is_anonymous and not self._obj.object_id) or not self._obj.object_id:
             self._log.info('Object ID not provided, creating new')
-            upload_server, self._obj.object_id = self._api.get_object_create()
+            upload_servers, self._obj.object_id = self._api.get_object_create()
             self._log.info('Created Object ID: {0}'.format(self._obj.object_id))
+            if self._journal:
+                self._journal.add_object(self._source(), self._obj.object_id)
             view_response = self._api.get_object_view(
                 view_password=self._obj.view_password,
                 object_id=self._obj.object_id)
         else:
-            upload_server, view_response = self._api.get_upload_server(
+            upload_servers, view_response = self._api.get_upload_server(
                                   self._obj.object_id, self._obj.view_password)
-            self._log.debug('Uploader server: {0}, view response: '
-                            '{1}'.format(upload_server, view_response))
+            self._log.debug('Uploader servers: {0}, view response: '
+                            '{1}'.format(upload_servers, view_response))
+        self._servers = UploadServerPool(upload_servers, self._retry.breaker)
 
         if self._obj.public:
             self._set_object_permissions(self._obj.public,
                                          view_response.get('public'))
+        if self._obj.secret:
+            self._api.get_object_set_view_pass(object_id=self._obj.object_id,
+                                               secret=self._obj.secret,
+                                               hint=self._obj.hint)
+        return view_response
+
+    def upload_source(self, view_response):
+        # Uploads obj.dir_path or obj.file_list to an opened object
+        self._errors = []
+        self._counts = collections.Counter()
+        self._compressed = collections.Counter()
+        self._sizes = {}
+        self._splits = {}
+        if self._folders and self._obj.dir_path:
+            self._check_folders(view_response)
 
         # if folder name was provided, create a folder inside the object and return folder_id
         if self._obj.folder_name and not self._obj.folder_id:
             self._log.debug('Folder name: {0}'.format(self._obj.folder_name))
             folder_id = self._folder_create(self._obj.folder_name)
 
-        upload_url = '/'.join([upload_server, self._obj.object_id])
-
-        # Upload to existent folder id
-        if self._obj.folder_id:
-            upload_url = '/'.join([upload_url, self._obj.folder_id])
+        self._progress.start()
+        try:
+            self._upload(view_response)
+        finally:
+            self._progress.stop()
 
+    def _upload(self, view_response):
         if self._obj.dir_path:
-            self._log.debug(
-                'Using dir_path: {0}, folder id: {1}, upload server: {2}'.format(
-                    self._obj.dir_path, self._obj.folder_id, upload_server))
-            self.upload_dir_recursive(self._obj.dir_path, self._obj.folder_id,
-                                      upload_server)
+            self._log.debug('Using dir_path: {0}, folder id: {1}'.format(
+                self._obj.dir_path, self._obj.folder_id))
+            if not self._manifest:
+                self.upload_dir_recursive(self._obj.dir_path,
+                                          self._obj.folder_id)
+                return
+
+            self._prepare_manifest(view_response)
+            try:
+                self.upload_dir_recursive(self._obj.dir_path,
+                                          self._obj.folder_id)
+            finally:
+                self._manifest.save()
             return
 
         if not self._obj.file_list:
             return
 
-        # upload file(s)
-        secret_set = False
-        for file in self._obj.file_list:
-            uploaded = self._upload_file(file, upload_url)
+        # upload file(s), to existent folder id if provided
+        files = [file for file in self._obj.file_list
+                 if not self._is_uploaded(file, self._obj.folder_id)]
+        self._counts['skipped'] += len(self._obj.file_list) - len(files)
+        self._progress.add_expected(len(files), sum(os.path.getsize(file)
+                                                    for file in files))
+
+        with ThreadPoolExecutor(max_workers=self._obj.jobs) as self._executor:
+            self._queue = TransferQueue(self._executor, self._obj.jobs,
+                                        self._obj.order)
+            with self._queue.paused():
+                futures = {self._submit(file, self._obj.folder_id): file
+                           for file in files}
+            for future in as_completed(futures):
+                self._on_uploaded(futures[future], future, view_response,
+                                  self._obj.folder_id)
+        self._finish()
+
+    def upload_dir_recursive(self, dir_path, folder_token):
+        # Walking, folder creation and file transfers overlap: a folder is
+        # created as soon as its parent exists and files start uploading as
+        # soon as their folder token is known
+        # (kind, path, future, folder token) of everything walked
+        self._done = queue.Queue()
+        with ThreadPoolExecutor(max_workers=self._obj.jobs) as self._executor, \
+                ThreadPoolExecutor(
+                    max_workers=self._obj.jobs) as self._folder_executor:
+            self._queue = TransferQueue(self._executor, self._obj.jobs,
+                                        self._obj.order)
+            walker = threading.Thread(target=self._walk_dir,
+                                      args=(dir_path, folder_token),
+                                      daemon=True)
+            walker.start()
+
+            total, handled = None, 0
+            while total is None or handled < total:
+                kind, path, future, token = self._done.get()
+                if kind is None:
+                    total = path
+                    continue
+                handled += 1
+                if kind == 'folder':
+                    self._on_folder_created(path, future)
+                elif kind == 'skip':
+                    self._counts['skipped'] += len(self._members(path))
+                elif kind == 'error':
+                    self._on_schedule_error(path, future)
+                else:
+                    self._on_uploaded(path, future, folder_token=token)
+        self._finish()
+
+    def _walk_dir(self, dir_path, folder_token):
+        parent_token = Future()
+        parent_token.set_result(folder_token)
+        root_token = Future()
+        self._schedule_folder(dir_path, root_token, parent_token)
+        stack = [(dir_path, root_token)]
+        total = 1
+        try:
+            while stack:
+                path, token = stack.pop()
+                try:
+                    files, dirs = self._scan_dir(path)
+                except OSError as err:
+                    # Unreadable or gone since its parent was scanned, the
+                    # rest of the tree is still walked
+                    total += 1
+                    self._done.put(('error', path, err, None))
+                    continue
+                self._log.info('Found {0} files and {1} subdirs in {2}'.format(
+                    len(files), len(dirs), path))
+                bundles = []
+                if self._obj.is_pack:
+                    files, bundles = plan_bundles(files,
+                                                  self._obj.pack_threshold,
+                                                  self._obj.pack_size,
+                                                  self._sizes)
+                total += len(files) + len(dirs) + len(bundles)
+
+                token.add_done_callback(functools.partial(
+                    self._schedule_files, files, bundles))
+                for subdir in dirs:
+                    subdir_token = Future()
+                    token.add_done_callback(functools.partial(
+                        self._schedule_folder, subdir, subdir_token))
+                    stack.append((subdir, subdir_token))
+        except Exception as err:
+            self._log.error('Failed to walk {0}: {1}'.format(dir_path, err))
+            self._errors.append((dir_path, err))
+        finally:
+            self._done.put((None, total, None, None))
+
+    # The _schedule_* methods run as future callbacks, where exceptions are
+    # swallowed. Whatever they were given has to end up on the done queue,
+    # or upload_dir_recursive waits for it forever
+    def _schedule_folder(self, dir_path, token, parent_token):
+        if parent_token.exception():
+            token.set_exception(parent_token.exception())
+            self._done.put(('folder', dir_path, token, None))
+            return
+
+        def resolve(future):
+            if future.exception():
+                token.set_exception(future.exception())
+            else:
+                token.set_result(future.result())
+            self._done.put(('folder', dir_path, token, None))
+
+        try:
+            self._folder_executor.submit(
+                self._folder_create, self._path_leaf(dir_path),
+                parent_token.result(), dir_path).add_done_callback(resolve)
+        except Exception as err:
+            token.set_exception(err)
+            self._done.put(('folder', dir_path, token, None))
+
+    def _schedule_files(self, files, bundles, token):
+        # A directory's files are queued together, ordered by the policy
+        with self._queue.paused():
+            for file in files:
+                self._schedule_item(self._schedule_file, file, token)
+            for bundle in bundles:
+                self._schedule_item(self._schedule_bundle, bundle, token)
+
+    def _schedule_item(self, schedule, item, token):
+        # A file deleted since the scan fails its stat here, not in a worker
+        try:
+            schedule(item, token)
+        except Exception as err:
+            self._done.put(('error', item, err, None))
+
+    def _schedule_file(self, file, token):
+        if token.exception():
+            self._done.put(('file', file, token, None))
+            return
+
+        if self._is_uploaded(file, token.result()):
+            self._done.put(('skip', file, None, None))
+            return
+
+        self._progress.add_expected(1, self._get_size(file))
+        self._submit(file, token.result()).add_done_callback(
+            lambda future: self._done.put(('file', file, future,
+                                           token.result())))
+
+    def _submit(self, file, folder_token):
+        size = self._get_size(file)
+        if not self._obj.split_size or size <= self._obj.split_size:
+            return self._queue.submit(file, size, self._transfer, file,
+                                      folder_token, time.monotonic())
+
+        # Parts go through the pool like files of their own, so they upload
+        # in parallel and spread over the upload servers. The sidecar is
+        # queued like any other transfer once the last part is done
+        parts = split_file(file, self._obj.split_size)
+        self._log.info('Splitting {0} into {1} parts'.format(file,
+                                                             len(parts)))
+        self._progress.add_expected(len(parts), 0)
+        result = Future()
+        lock = threading.Lock()
+        left = [len(parts)]
+        futures = [self._queue.submit(file, part.size, self._transfer, part,
+                                      folder_token, time.monotonic())
+                   for part in parts]
+
+        def on_manifest_done(future):
+            try:
+                uploaded, reader = future.result()
+                if self._journal:
+                    self._journal.finish(self._obj.object_id, folder_token,
+                                         file, uploaded.json().get('upload_id'))
+            except Exception as err:
+                result.set_exception(err)
+            else:
+                result.set_result((uploaded, reader))
+
+        def on_part_done(future):
+            with lock:
+                left[0] -= 1
+                if left[0]:
+                    return
+            try:
+                manifest = self._split_manifest(
+                    file, parts, [future.result() for future in futures])
+                with self._lock:
+                    self._splits[file] = manifest
+                self._queue.submit(file, manifest.size, self._transfer,
+                                   manifest, folder_token, time.monotonic()) \
+                    .add_done_callback(on_manifest_done)
+            except Exception as err:
+                result.set_exception(err)
+
+        for future in futures:
+            future.add_done_callback(on_part_done)
+        return result
+
+    def _schedule_bundle(self, bundle, token):
+        if token.exception():
+            self._done.put(('file', bundle, token, None))
+            return
+
+        uploaded = [file for file in bundle.files
+                    if self._is_uploaded(file, token.result())]
+        if uploaded:
+            bundle = bundle.exclude(uploaded)
+        if not bundle.files:
+            self._done.put(('skip', bundle.skipped, None, None))
+            return
+
+        self._log.debug('Packing {0} files into {1}'.format(
+            len(bundle.files), bundle.name))
+        self._progress.add_expected(1, bundle.size)
+        self._queue.submit(bundle.files[0], bundle.size, self._transfer,
+                           bundle, token.result(), time.monotonic()) \
+            .add_done_callback(
+                lambda future: self._done.put(('file', bundle, future,
+                                               token.result())))
+
+    def _split_manifest(self, file, parts, results):
+        hashes = []
+        for part, (uploaded, reader) in zip(parts, results):
             uploaded_json = uploaded.json()
+            if not uploaded_json.get('result'):
+                raise UploaderError('Part {0} wasn\'t uploaded'.format(part))
+            if self._obj.is_verify and \
+                    str(uploaded_json.get('sha1')).lower() != reader.sha1():
+                raise UploaderError('Checksums of {0} differ'.format(part))
+            hashes.append((reader.sha1(), uploaded_json.get('upload_id')))
+        return SplitManifest(file, parts, hashes)
 
+    def _on_schedule_error(self, file, err):
+        members = self._members(file)
+        self._log.error('Failed to upload {0}: {1}'.format(file, err))
+        self._errors.extend((member, err) for member in members)
+        self._print_errors(members, err)
+
+    def _on_folder_created(self, dir_path, future):
+        if future.exception():
+            self._log.error('Failed to create folder for {0}: {1}'.format(
+                dir_path, future.exception()))
+        else:
+            self._log.debug('Created folder {0} for {1}'.format(
+                future.result(), dir_path))
+
+    def _on_uploaded(self, file, future, view_response=None,
+                     folder_token=None):
+        # Runs in the calling thread, workers only do the transfer itself
+        folder_token = self._replaced_folders.get(folder_token, folder_token)
+        filename = self._get_name(file)
+        members = self._members(file)
+        if isinstance(file, Bundle):
+            self._counts['skipped'] += len(file.skipped)
+        try:
+            uploaded, reader = future.result()
+            if uploaded is None:
+                # No transfer, reader is the DedupResult of the index lookup
+                self._on_duplicate(file, reader, folder_token)
+                return
+            uploaded_json = uploaded.json()
             if not uploaded_json.get('result'):
-                raise UploaderError('File {0} wasn\'t uploaded'.format(self.filename))
-
-            self._log.info('Uploaded {0}'.format(self.filename))
-
-            if self._obj.secret and not secret_set:
-                self._api.get_object_set_view_pass(object_id=self._obj.object_id,
-                                                   secret=self._obj.secret,
-                                                   hint=self._obj.hint)
-                secret_set = True
-            self._printer.print_on_complete(uploaded, view_response)
-
-            # if self._obj.is_verify:
-            #     self._log.info('Verifying checksums...')
-            #     args = self._verify_checksums(file, uploaded_json['sha1'],
-            #                                   uploaded_json['crc32'])
-            #     hashes = self._parse_hashes(args)
-            #     parsed_hashes = self._process_hashes(hashes,
-            #                                          uploaded_json['sha1'],
-            #                                          uploaded_json['crc32'])
-                # self._printer.print_on_complete(parsed_hashes)
-
-    def upload_dir_recursive(self, dir_path, folder_token, upload_server):
-        folder_token = self._folder_create(self._path_leaf(dir_path),
-                                           folder_token)
-        upload_url = '/'.join([upload_server, self._obj.object_id, folder_token])
-        files, dirs = self._scan_dir(dir_path)
-
-        self._log.info(
-            'Found {0} files and {1} subdirs'.format(len(files), len(dirs)))
-
-        for file in files:
-            self._upload_file(file, upload_url)
-
-        for subdir in dirs:
-            self.upload_dir_recursive(subdir, folder_token, upload_server)
-
-            # r = self._api.get_object_view(object_id=self._obj.object_id)
-            # upload_count = r['upload_count']
-            # upload_size = convert_size(r['upload_size'])
-            #
-            # self._log.info(
-            #     'Uploaded {0} files and folders, size: {1}'.format(upload_count,
-            #                                                        upload_size))
-
-    def _verify_checksums(self, file, sha1_server, crc32_server):
-        sha1_local = calculate_sha1(file)
-        crc32_local = calculate_crc32(file)
-        sha1_state = (False, True)[sha1_local == sha1_server]
-        crc32_state = (False, True)[crc32_local == crc32_server]
+                raise UploaderError('File {0} wasn\'t uploaded'.format(filename))
+        except Exception as err:
+            self._log.error('Failed to upload {0}: {1}'.format(file, err))
+            self._errors.extend((member, err) for member in members)
+            self._print_errors(members, err)
+            return
+
+        self._log.info('Uploaded {0}'.format(filename))
+
+        hashes = None
+        if self._obj.is_verify:
+            hashes = self._parse_hashes(self._verify_checksums(
+                reader, uploaded_json['sha1'], uploaded_json['crc32']))
+            if not (hashes['sha1_state'] and hashes['crc32_state']):
+                err = UploaderError('Checksums of {0} differ'.format(filename))
+                self._log.error(str(err))
+                self._errors.extend((member, err) for member in members)
+                self._print_errors(members, err)
+                return
+        self._counts['uploaded'] += len(members)
+        for member in members:
+            self._remember_file(member)
+        upload_time = uploaded.elapsed.total_seconds()
+        if self._obj.output == 'jsonl':
+            self._print_records(file, uploaded_json, upload_time, hashes,
+                                folder_token)
+
+        if view_response is None:
+            return
+
+        if self._obj.output != 'table':
+            return
+        with self._progress.suspended():
+            # The response is already parsed, print_on_complete would parse
+            # it again
+            self._printer.print_result(uploaded_json,
+                                       uploaded.headers.get('date'),
+                                       upload_time, view_response)
+            if hashes:
+                self._printer.print_mesasge(self._process_hashes(
+                    hashes, uploaded_json['sha1'], uploaded_json['crc32']))
+
+    def _on_duplicate(self, file, duplicate, folder_token):
+        self._remember_file(file)
+        if not duplicate.copied_from:
+            self._log.info('Skipped {0}, identical file already on '
+                           'server'.format(file))
+            self._counts['skipped'] += 1
+            return
+
+        self._log.info('Copied {0} from upload {1}'.format(
+            file, duplicate.copied_from))
+        self._counts['copied'] += 1
+        if self._obj.output == 'jsonl':
+            self._printer.print_record(self._printer.file_record(
+                file, {'name': self._path_leaf(file),
+                       'size': self._get_size(file),
+                       'upload_id': duplicate.upload_id,
+                       'sha1': duplicate.sha1}, 0,
+                folder_token=folder_token, copied_from=duplicate.copied_from))
+
+    def _print_records(self, file, uploaded_json, upload_time, hashes,
+                       folder_token):
+        extra = {'verified': True} if hashes else {}
+        extra['folder_token'] = folder_token
+        with self._lock:
+            manifest = self._splits.pop(file, None) \
+                if isinstance(file, str) else None
+        if manifest:
+            # The server's answer describes the sidecar, the record is
+            # about the file it puts back together
+            self._printer.print_record(self._printer.file_record(
+                file, uploaded_json, upload_time, name=self._get_name(file),
+                size=self._get_size(file), upload_id=None, sha1=None,
+                crc32=None, url=None,
+                manifest_upload_id=uploaded_json.get('upload_id'),
+                parts=manifest.parts, **extra))
+            return
+        if not isinstance(file, Bundle):
+            self._printer.print_record(self._printer.file_record(
+                file, uploaded_json, upload_time, **extra))
+            return
+        # Checksums of the server are the bundle's, members get their place
+        # in it instead
+        for member, header, offset, size, mtime in file.members:
+            self._printer.print_record(self._printer.file_record(
+                member, uploaded_json, upload_time, size=size, sha1=None,
+                crc32=None, bundle=file.name, offset=offset, **extra))
+
+    def _print_errors(self, files, err):
+        if self._obj.output == 'jsonl':
+            for file in files:
+                self._printer.print_record({'type': 'error', 'file': file,
+                                            'error': str(err)})
+
+    def _is_uploaded(self, file, folder_token):
+        if (self._journal and self._journal.is_done(self._obj.object_id,
+                                                    folder_token, file)) \
+                or (self._manifest and self._manifest.is_current(file)):
+            self._log.debug('Skipping {0}, already uploaded'.format(file))
+            return True
+        return False
+
+    def _check_folders(self, view_response):
+        # The upload target is listed anyway or costs one request, enough to
+        # notice the usual case of a previously uploaded tree being deleted
+        if self._obj.folder_id:
+            upload_list = self._api.get_object_folder_view(
+                self._obj.folder_id,
+                object_id=self._obj.object_id).get('upload_list', [])
+        else:
+            upload_list = view_response.get('upload_list', [])
+        self._folders.reconcile(self._obj.object_id, self._obj.folder_id,
+                                upload_list)
+
+    def _prepare_manifest(self, view_response):
+        if not self._manifest.is_empty \
+                and self._manifest.object_id == self._obj.object_id \
+                and self._manifest.parent == (self._obj.folder_id or ''):
+            return
+
+        # No usable manifest from the last run, diff against the server
+        self._log.info('Fetching remote state of {0}'.format(
+            self._obj.dir_path))
+        self._manifest.reset(self._obj.object_id, self._obj.folder_id)
+        if self._obj.folder_id:
+            upload_list = self._api.get_object_folder_view(
+                self._obj.folder_id,
+                object_id=self._obj.object_id).get('upload_list', [])
+        else:
+            upload_list = view_response.get('upload_list', [])
+
+        name = self._path_leaf(self._obj.dir_path)
+        roots = [elem for elem in upload_list
+                 if elem.get('is_folder') and elem.get('name') == name]
+        if not roots:
+            return
+
+        stack = [('', roots[0].get('upload_id'))]
+        self._manifest.add_remote_folder('', roots[0].get('upload_id'))
+        while stack:
+            relpath, folder_id = stack.pop()
+            upload_list = self._api.get_object_folder_view(
+                folder_id, object_id=self._obj.object_id).get('upload_list', [])
+            if self._folders:
+                self._folders.reconcile(self._obj.object_id, folder_id,
+                                        upload_list)
+            for elem in upload_list:
+                child = '/'.join(filter(None, [relpath, elem.get('name')]))
+                if elem.get('is_folder'):
+                    self._manifest.add_remote_folder(child,
+                                                     elem.get('upload_id'))
+                    stack.append((child, elem.get('upload_id')))
+                else:
+                    self._manifest.add_remote_file(child, int(elem.get('size')))
+
+    def _remember_file(self, file):
+        if self._manifest:
+            self._manifest.add_file(file)
+
+    def _source(self):
+        # Identifies an upload in the journal across runs
+        if self._obj.dir_path:
+            return os.path.abspath(self._obj.dir_path)
+        return '\n'.join(sorted(os.path.abspath(file)
+                                for file in self._obj.file_list or []))
+
+    def _finish(self):
+        self._progress.stop()
+        self._printer.print_summary([
+            ['Files uploaded:', self._counts['uploaded']],
+        ] + ([['Files copied:', self._counts['copied']]] if self._index
+             else []) + [
+            ['Files skipped:', self._counts['skipped']],
+            ['Files failed:', len(self._errors)],
+            ['Retries:', self._retry.retries],
+            ['Failed requests:', self._retry.failures],
+        ] + self._compression_report() + self._makespan_report())
+        if self._errors:
+            raise UploaderError('{0} of {1} files weren\'t uploaded'.format(
+                len(self._errors), len(self._errors) + self._counts['uploaded']))
+
+    def _compression_report(self):
+        if not self._obj.compress:
+            return []
+        with self._lock:
+            compressed = dict(self._compressed)
+        if not compressed.get('files'):
+            return [['Files compressed:', 0]]
+        return [
+            ['Files compressed:', compressed['files']],
+            ['Compression ratio:', round(
+                compressed['bytes_in'] / max(compressed['bytes_out'], 1), 2)],
+            ['Bytes saved:', convert_size(compressed['bytes_in'] -
+                                          compressed['bytes_out'])],
+        ]
+
+    def _makespan_report(self):
+        report = self._queue.report() if self._queue else None
+        if not report:
+            return []
+        return [
+            ['Order:', report['policy']],
+            ['Predicted makespan (s):', round(report['predicted'], 1)],
+            ['Lower bound (s):', round(report['lower_bound'], 1)],
+            ['Actual makespan (s):', round(report['actual'], 1)],
+        ]
+
+    def _verify_checksums(self, reader, sha1_server, crc32_server):
+        sha1_local = reader.sha1()
+        crc32_local = reader.crc32()
+        sha1_state = (False, True)[sha1_local == str(sha1_server).lower()]
+        crc32_state = (False, True)[crc32_local == str(crc32_server).lower()]
         return sha1_state, sha1_local, crc32_state, crc32_local
 
     def _set_object_permissions(self, public, status):
@@ -134,31 +660,304 @@ class Uploader:
         self._api.get_object_public(object_id=self._obj.object_id,
                                     setter=setter)
 
-    def _folder_create(self, folder_name, folder_token=None):
+    def _folder_create(self, folder_name, folder_token=None, dir_path=None):
+        folder_token = self._replaced_folders.get(folder_token, folder_token)
+        # Folders of the last sync are known even with the cache gone
+        token = self._manifest.get_folder(dir_path) \
+            if self._manifest and dir_path else None
+        if not token and self._folders:
+            token = self._folders.get(self._obj.object_id, folder_token,
+                                      folder_name)
+        if token:
+            self._log.debug('Reusing folder {0} for {1}'.format(
+                token, dir_path or folder_name))
+            with self._folder_lock:
+                self._reused_folders[token] = (folder_name, folder_token,
+                                               dir_path)
+            if self._manifest and dir_path:
+                self._manifest.add_folder(dir_path, token)
+            return token
+
+        try:
+            return self._new_folder(folder_name, folder_token, dir_path)
+        except APIError:
+            # The parent may be a reused folder deleted on the server
+            if folder_token not in self._reused_folders:
+                raise
+            return self._new_folder(folder_name,
+                                    self._recreate_folder(folder_token),
+                                    dir_path)
+
+    def _new_folder(self, folder_name, folder_token, dir_path):
         setter = None if folder_token else '0'
-        return self._api.get_object_folder_create(folder_name=folder_name,
-                                                 folder_id=folder_token,
-                                                 setter=setter,
-                                                 object_id=self._obj.object_id)
-
-    def _upload_file(self, file, upload_url):
-        self.filename = self._path_leaf(file)
-        payload = MultipartEncoder(
-            fields={'file': (self.filename, open(file, 'rb').read())})
-        monitor = MultipartEncoderMonitor(payload, self.__callback)
-
-        res = self._api._session.post(upload_url, data=monitor, headers={
-            'Content-Type': monitor.content_type})
+        token = self._api.get_object_folder_create(
+            folder_name=folder_name, folder_id=folder_token, setter=setter,
+            object_id=self._obj.object_id)
+        if self._folders:
+            self._folders.add(self._obj.object_id, folder_token, folder_name,
+                              token)
+        if self._manifest and dir_path:
+            self._manifest.add_folder(dir_path, token)
+        return token
+
+    def _recreate_folder(self, token):
+        # Once per folder, whoever finds it gone first creates it again and
+        # everyone else gets the new token
+        with self._folder_lock:
+            if token in self._replaced_folders:
+                return self._replaced_folders[token]
+            folder_name, folder_token, dir_path = self._reused_folders[token]
+            self._log.warning('Folder {0} of {1} is gone from the server, '
+                              'creating it again'.format(
+                                  token, dir_path or folder_name))
+            if self._folders:
+                self._folders.evict(self._obj.object_id, token)
+            self._replaced_folders[token] = self._folder_create(
+                folder_name, folder_token, None)
+            if self._manifest and dir_path:
+                self._manifest.add_folder(dir_path,
+                                          self._replaced_folders[token])
+            return self._replaced_folders[token]
+
+    def _transfer(self, file, folder_token=None, queued=None):
+        if queued is not None:
+            self._metrics.observe_queue_wait(time.monotonic() - queued)
+        folder_token = self._replaced_folders.get(folder_token, folder_token)
+        if self._index and isinstance(file, str):
+            duplicate = self._find_duplicate(file, folder_token)
+            if duplicate:
+                self._progress.add_expected(-1, -self._get_size(file))
+                if duplicate.copied_from:
+                    self._metrics.increment('dedup_copies')
+                return None, duplicate
+
+        if folder_token not in self._reused_folders:
+            return self._transfer_retrying(file, folder_token)
+        # A reused folder may have been deleted on the server since it was
+        # cached, uploads into it fail until it is created again
+        try:
+            result = self._transfer_retrying(file, folder_token)
+            if result[0].json().get('result'):
+                return result
+        except requests.HTTPError:
+            pass
+        return self._transfer_retrying(file,
+                                       self._recreate_folder(folder_token))
+
+    def _transfer_retrying(self, file, folder_token):
+        # Retries go to another upload server while there is one left. A
+        # repeated upload at worst leaves a duplicate file, which beats
+        # aborting a long run
+        size = self._get_size(file)
+        tried = []
+        attempt = 0
+        while True:
+            upload_server = self._servers.acquire(exclude=tried)
+            tried.append(upload_server)
+            started = time.monotonic()
+            try:
+                result = self._upload_file(file, upload_server, folder_token)
+            except requests.RequestException as err:
+                self._servers.release(upload_server, error=True)
+                self._metrics.observe_upload(upload_server, size,
+                                             time.monotonic() - started,
+                                             error=True)
+                delay = self._retry.get_delay(attempt, err)
+                if delay is None:
+                    raise
+                self._log.warning('Upload of {0} failed: {1}, retrying in '
+                                  '{2:.1f}s'.format(file, err, delay))
+                self._metrics.increment('upload_retries')
+                attempt += 1
+                if len(tried) >= len(self._servers.stats):
+                    tried = []
+                time.sleep(delay)
+                continue
+            elapsed = time.monotonic() - started
+            self._servers.release(upload_server, size, elapsed)
+            self._metrics.observe_upload(upload_server, size, elapsed)
+            return result
+
+    def _find_duplicate(self, file, folder_token):
+        # New content has to be hashed up front to be found in the index,
+        # unchanged files reuse the stored hash
+        sha1 = self._index.get_hash(file)
+        if not sha1:
+            sha1 = calculate_sha1(file)
+            self._index.add_hash(file, sha1)
+
+        uploads = self._index.get_uploads(sha1)
+        for object_id, folder, upload_id in uploads:
+            if (object_id, folder) == (self._obj.object_id, folder_token or ''):
+                self._log.debug('{0} already uploaded as {1}'.format(file,
+                                                                    upload_id))
+                return DedupResult(sha1, upload_id, None)
+
+        # Copy server-side instead of sending the same bytes again
+        for object_id, folder, upload_id in uploads:
+            try:
+                res = self._api.get_upload_list_copy(self._obj.object_id,
+                                                     [upload_id], folder_token)
+            except APIError:
+                self._log.warning('Can\'t copy {0} from object {1}'.format(
+                    upload_id, object_id))
+                continue
+            copy_id = self._get_copy_id(res)
+            if not copy_id:
+                self._log.warning('Copy of {0} from object {1} returned no '
+                                  'upload'.format(upload_id, object_id))
+                continue
+            self._log.debug('Copied {0} from {1} in object {2} as {3}'.format(
+                file, upload_id, object_id, copy_id))
+            self._index.add_upload(sha1, self._obj.object_id, folder_token,
+                                   copy_id)
+            return DedupResult(sha1, copy_id, upload_id)
+        return None
+
+    @staticmethod
+    def _get_copy_id(res):
+        # The copy answers with the new upload or a listing of new uploads
+        if res.get('upload_id'):
+            return res['upload_id']
+        upload_list = res.get('upload_list') or [{}]
+        return upload_list[0].get('upload_id')
+
+    def _upload_file(self, file, upload_server, folder_token=None):
+        filename = self._get_name(file)
+        upload_url = '/'.join(filter(None, [upload_server, self._obj.object_id,
+                                            folder_token]))
+        if self._journal and isinstance(file, str):
+            if self._journal.is_started(self._obj.object_id, folder_token,
+                                        file):
+                self._log.info('Restarting interrupted upload of {0}'.format(
+                    file))
+            self._journal.start(self._obj.object_id, folder_token, file)
+
+        progress = self._progress.start_file(filename, self._get_size(file))
+        uploaded = False
+        try:
+            res, reader = self._send(file, filename, upload_url, progress)
+            uploaded = True
+        finally:
+            self._progress.finish_file(progress, uploaded)
+
+        if isinstance(file, Bundle):
+            uploaded_json = res.json()
+            if uploaded_json.get('result'):
+                self._record_bundle(file, folder_token,
+                                    uploaded_json.get('upload_id'))
+        elif (self._journal or self._index) and isinstance(file, str):
+            uploaded_json = res.json()
+            if uploaded_json.get('result'):
+                self._record_upload(file, folder_token, reader,
+                                    uploaded_json.get('upload_id'))
+        return res, reader
+
+    def _send(self, file, filename, upload_url, progress):
+        reader = None
+        compressing = None
+        with self._open_file(file) as stream:
+            if self._obj.compress and self._is_compressible(file):
+                stream = compressing = CompressingReader(
+                    stream, self._obj.compress, self._obj.compress_level,
+                    self._obj.buffer_size)
+                filename += CODECS[self._obj.compress]
+            # Checksums and the rate limit apply to the bytes on the wire,
+            # parts are always hashed for the split manifest
+            if self._obj.is_verify or self._index \
+                    or not isinstance(file, (str, Bundle)):
+                stream = reader = HashingReader(stream)
+            if self._limiter:
+                stream = ThrottledReader(stream, self._limiter)
+
+            try:
+                if compressing:
+                    boundary = uuid.uuid4().hex
+                    res = self._api._session.post(
+                        upload_url,
+                        data=self._iter_multipart(boundary, filename, stream,
+                                                  compressing, progress),
+                        headers={'Content-Type': 'multipart/form-data; '
+                                                 'boundary={0}'.format(
+                                                     boundary)})
+                else:
+                    payload = MultipartEncoder(
+                        fields={'file': (filename, stream)})
+                    monitor = MultipartEncoderMonitor(payload,
+                                                      progress.update)
+                    res = self._api._session.post(
+                        upload_url, data=monitor,
+                        headers={'Content-Type': monitor.content_type})
+            finally:
+                if compressing:
+                    compressing.close()
         res.raise_for_status()
+        if compressing:
+            self._add_compressed(compressing)
+        return res, reader
+
+    def _iter_multipart(self, boundary, filename, stream, compressing,
+                        progress):
+        # The compressed size isn't known up front, so the body can't go
+        # through MultipartEncoder and is sent chunked instead
+        yield ('--{0}\r\nContent-Disposition: form-data; name="file"; '
+               'filename="{1}"\r\n\r\n'.format(boundary, filename)).encode()
+        while True:
+            chunk = stream.read(self._obj.buffer_size)
+            if not chunk:
+                break
+            progress.update(compressing)
+            yield chunk
+        yield '\r\n--{0}--\r\n'.format(boundary).encode()
+
+    def _is_compressible(self, file):
+        # Parts must stay byte ranges of the original
+        if isinstance(file, Bundle):
+            return is_compressible(file.files[0], file.files)
+        return isinstance(file, str) and is_compressible(file)
+
+    def _add_compressed(self, compressing):
+        with self._lock:
+            self._compressed['files'] += 1
+            self._compressed['bytes_in'] += compressing.bytes_read
+            self._compressed['bytes_out'] += compressing.bytes_written
+        self._metrics.increment('compress_bytes_in', compressing.bytes_read)
+        self._metrics.increment('compress_bytes_out',
+                                compressing.bytes_written)
 
-        return res
+    def _record_upload(self, file, folder_token, reader, upload_id):
+        if self._journal:
+            self._journal.finish(self._obj.object_id, folder_token, file,
+                                 upload_id)
+        if self._index:
+            self._index.add_hash(file, reader.sha1())
+            self._index.add_upload(reader.sha1(), self._obj.object_id,
+                                   folder_token, upload_id)
 
-    def __callback(self, monitor):
-        print('Uploading {0}: {1:.1f}%\r'.format(self.filename,
-                                                 monitor.bytes_read / monitor.len * 100),
-                                                 end='')
-        if sys.platform != 'win32':
-            sys.stdout.write("\033[K")
+    def _record_bundle(self, bundle, folder_token, upload_id):
+        if self._bundles:
+            self._bundles.add(bundle, self._obj.object_id, folder_token,
+                              upload_id)
+        if self._journal:
+            for file in bundle.files:
+                self._journal.finish(self._obj.object_id, folder_token, file,
+                                     upload_id)
+
+    @contextlib.contextmanager
+    def _open_file(self, file):
+        # Body is streamed from disk, only buffer_size bytes are held at once
+        if not isinstance(file, str):
+            with contextlib.closing(file.open(self._obj.buffer_size)) as f:
+                yield f
+            return
+        with open(file, 'rb', buffering=self._obj.buffer_size) as f:
+            if not self._obj.is_mmap or not os.fstat(f.fileno()).st_size:
+                yield f
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                yield mm
 
     def _scan_dir(self, dir_path):
         files = []
@@ -170,11 +969,31 @@ class Uploader:
             for entry in it:
                 if entry.is_file():
                     files.append(entry.path)
+                    # Cached by scandir on Windows, one stat elsewhere
+                    self._sizes[entry.path] = entry.stat().st_size
                 if entry.is_dir():
                     dirs.append(entry.path)
 
         return files, dirs
 
+    def _get_name(self, file):
+        # Bundles, parts and split manifests carry their own name and size
+        return self._path_leaf(file) if isinstance(file, str) else file.name
+
+    def _get_size(self, file):
+        if not isinstance(file, str):
+            return file.size
+        # Sizes of walked files come from the directory scan
+        size = self._sizes.get(file)
+        return os.path.getsize(file) if size is None else size
+
+    @staticmethod
+    def _members(file):
+        # A bundle stands for the files in it, a skipped one is a plain list
+        if isinstance(file, Bundle):
+            return file.files
+        return file if isinstance(file, list) else [file]
+
     @staticmethod
     def _path_leaf(path):
         head, tail = ntpath.split(path)
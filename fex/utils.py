@@ -1,7 +1,14 @@
+import os
+import sys
 from binascii import crc32
 from hashlib import sha1
 
 
+def get_temp_dir():
+    return '{0}\\'.format(os.getenv('Temp')) if sys.platform == 'win32' \
+                                                               else '/tmp/'
+
+
 def convert_size(size, precision=2):
     suffixes = ['B', 'KB', 'MB', 'GB', 'TB']
     suffix_index = 0
@@ -11,6 +18,18 @@ def convert_size(size, precision=2):
     return '%.*f%s' % (precision, size, suffixes[suffix_index])
 
 
+def parse_size(size):
+    # "200M", "1.5G" or "200M/s" to bytes, same 1024 based suffixes as above
+    size = size.strip().upper()
+    if size.endswith('/S'):
+        size = size[:-2]
+    size = size.rstrip('B')
+    suffixes = ['', 'K', 'M', 'G', 'T']
+    if size and size[-1] in suffixes[1:]:
+        return int(float(size[:-1]) * 1024 ** suffixes.index(size[-1]))
+    return int(float(size))
+
+
 def calculate_sha1(file):
     sha1sum = sha1()
     with open(file, 'rb') as f:
@@ -21,8 +40,17 @@ def calculate_sha1(file):
     return sha1sum.hexdigest()
 
 
+def calculate_path_hash(path):
+    return sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+
+
 def calculate_crc32(file):
-    buf = open(file, 'rb').read()
-    buf = (crc32(buf) & 0xFFFFFFFF)
+    buf = 0
+    with open(file, 'rb') as f:
+        block = f.read(2 ** 16)
+        while len(block) != 0:
+            buf = crc32(block, buf)
+            block = f.read(2 ** 16)
+    buf = (buf & 0xFFFFFFFF)
     buf = '%08X' % buf
     return buf.lower()
@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+from fex.constants import WATCH_SETTLE_TIME, WATCH_POLL_INTERVAL
+
+
+# Finds files in a spool directory that are done being written: a file is
+# ready once its size and mtime haven't changed for settle_time seconds.
+# inotify (with the optional inotify_simple package) only wakes the loop up
+# early, without it the directory is rescanned every poll_interval seconds
+class SpoolWatcher:
+    def __init__(self, path, is_done, settle_time=WATCH_SETTLE_TIME,
+                 poll_interval=WATCH_POLL_INTERVAL):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._path = path
+        self._is_done = is_done
+        self._settle_time = settle_time
+        self._poll_interval = poll_interval
+        self._pending = {}
+        self._inotify = None
+        if inotify_simple:
+            self._inotify = inotify_simple.INotify()
+            flags = inotify_simple.flags
+            self._inotify.add_watch(path, flags.CLOSE_WRITE | flags.MOVED_TO
+                                    | flags.MODIFY)
+            self._log.info('Watching {0} with inotify'.format(path))
+        else:
+            self._log.info('inotify_simple not installed, polling {0} every '
+                           '{1}s'.format(path, poll_interval))
+        # Files that arrived while the daemon was down
+        self._scan()
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+
+    def add(self, files):
+        # Failed uploads come back here and are retried once settled again
+        now = time.monotonic()
+        for file in files:
+            self._pending[file] = (None, now)
+
+    def wait(self, stopped):
+        # Blocks until some files are ready or stopped is set
+        while not stopped.is_set():
+            self._wait_for_events(stopped)
+            ready = self._collect()
+            if ready:
+                return ready
+        return []
+
+    def _wait_for_events(self, stopped):
+        timeout = self._poll_interval
+        if self._pending:
+            timeout = min(timeout, self._settle_time)
+        if not self._inotify:
+            stopped.wait(timeout)
+            self._scan()
+            return
+
+        now = time.monotonic()
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            if event.name:
+                self._pending.setdefault(
+                    os.path.join(self._path, event.name), (None, now))
+
+    def _scan(self):
+        now = time.monotonic()
+        try:
+            with os.scandir(self._path) as it:
+                for entry in it:
+                    if entry.path in self._pending or not entry.is_file() \
+                            or self._is_ignored(entry.name) \
+                            or self._is_done(entry.path):
+                        continue
+                    self._pending[entry.path] = (None, now)
+        except OSError as err:
+            self._log.error('Can\'t scan {0}: {1}'.format(self._path, err))
+
+    def _collect(self):
+        now = time.monotonic()
+        ready = []
+        for file, (signature, since) in list(self._pending.items()):
+            if self._is_ignored(os.path.basename(file)):
+                del self._pending[file]
+                continue
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                del self._pending[file]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._pending[file] = (current, now)
+            elif now - since >= self._settle_time:
+                del self._pending[file]
+                ready.append(file)
+        return sorted(ready)
+
+    @staticmethod
+    def _is_ignored(name):
+        # Writers commonly create .name.tmp and rename it when done
+        return name.startswith('.')
+
+
+# Remembers which spool files were uploaded and to which object, so a
+# restarted daemon continues where it stopped
+class WatchState:
+    def __init__(self, path):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._path = path
+        self._lock = threading.Lock()
+        self.object_id = None
+        self._files = {}
+        self._load()
+
+    def is_uploaded(self, file):
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            return True
+        return self._files.get(os.path.abspath(file)) == \
+            [stat.st_size, stat.st_mtime_ns]
+
+    def add(self, file):
+        stat = os.stat(file)
+        with self._lock:
+            self._files[os.path.abspath(file)] = [stat.st_size,
+                                                  stat.st_mtime_ns]
+
+    def save(self):
+        with self._lock:
+            # Files removed from the spool can't come back as the same file
+            self._files = {file: signature for file, signature
+                           in self._files.items() if os.path.exists(file)}
+            tmp_path = '{0}.tmp'.format(self._path)
+            with open(tmp_path, 'w') as f:
+                json.dump({'object_id': self.object_id, 'files': self._files},
+                          f, separators=(',', ':'))
+            os.replace(tmp_path, self._path)
+
+    def _load(self):
+        if not os.path.isfile(self._path):
+            return
+        try:
+            with open(self._path) as f:
+                data = json.load(f)
+        except ValueError:
+            self._log.warning('Watch state {0} is corrupt, starting '
+                              'over'.format(self._path))
+            return
+        self.object_id = data.get('object_id')
+        self._files = data.get('files', {})
+        self._log.info('Watch state loaded: {0} files uploaded to object '
+                       '{1}'.format(len(self._files), self.object_id))
@@ -1,49 +1,320 @@
 #!/usr/bin/env python3
 
-import argparse
+import asyncio
 import logging
 import os
+import signal
 import sys
+import threading
 import time
 
 import fex.exceptions
 from fex.api import API
-from fex.constants import HOST
+from fex.cli import create_parser
+from fex.compress import create_compressor
+from fex.constants import HOST, LIST_JOBS
+from fex.folders import FolderCache, FolderLister
+from fex.index import DedupIndex
+from fex.jobs import JobScheduler, read_jobs
+from fex.journal import TransferJournal
+from fex.metrics import Metrics, MetricsExporter
+from fex.pack import BundleIndex
+from fex.sync import SyncManifest
 from fex.printer import Printer
+from fex.progress import ProgressReporter
+from fex.retry import RetryPolicy
+from fex.throttle import RateLimiter
 from fex.uploader import Uploader
-from fex.utils import convert_size
+from fex.watch import SpoolWatcher, WatchState
+from fex.utils import convert_size, calculate_path_hash, get_temp_dir
 
 
 class Fex:
     def __init__(self, arguments):
         self._log = logging.getLogger(self.__class__.__name__)
         self._obj = arguments
-        self._api = API()
+        self._retry = RetryPolicy(attempts=self._obj.retries,
+                                  backoff=self._obj.retry_backoff)
+        self._metrics = Metrics()
+        self._api = API(pool_size=self._obj.jobs, retry=self._retry,
+                        metrics=self._metrics,
+                        session_ttl=self._obj.session_ttl)
         self._api.initialize_cookies(self._obj.username)
         self._printer = Printer(obj=self._obj)
+        self._journal = self._open_journal() if self._obj.is_resume else None
+        self._index = self._open_index() if self._obj.is_dedup else None
+        self._manifest = self._open_manifest() if self._obj.is_sync else None
+        self._limiter = self._create_limiter()
+        self._check_compression()
+        self._folder_cache = self._open_folder_cache()
+        self._bundles = self._open_bundle_index() \
+            if self._obj.is_pack or self._obj.pack_find else None
+        # Progress lines would end up in the middle of the records
+        progress = 'quiet' if self._obj.output == 'jsonl' \
+            and self._obj.progress == 'auto' else self._obj.progress
+        self._progress = ProgressReporter(mode=progress,
+                                          interval=self._obj.progress_interval)
         self._uploader = Uploader(api=self._api, printer=self._printer,
-                                obj=self._obj)
+                                obj=self._obj, journal=self._journal,
+                                index=self._index, manifest=self._manifest,
+                                retry=self._retry, limiter=self._limiter,
+                                progress=self._progress,
+                                metrics=self._metrics,
+                                folders=self._folder_cache,
+                                bundles=self._bundles)
 
     def run(self):
         self._log.debug('Listing object\'s '
                         'attributes: {0}'.format(vars(self._obj)))
         if self._obj.username and self._obj.password:
             self._login()
-        elif not self._obj.is_anonymous or self._obj.object_id_info or \
-                self._obj.is_list_dirs:
+        elif (not self._obj.is_anonymous and not self._obj.pack_find) \
+                or self._obj.is_list_dirs:
             raise fex.exceptions.ConfigError('Bad login arguments, please verify')
 
+        exporter = None
+        if self._obj.metrics_out:
+            exporter = MetricsExporter(self._metrics, self._obj.metrics_out,
+                                       self._obj.metrics_format,
+                                       self._obj.metrics_interval)
+            exporter.start()
+        try:
+            if self._obj.folder_id and self._obj.folder_id.startswith('/'):
+                self._obj.folder_id = self._find_folder(self._obj.folder_id)
+            self._dispatch()
+        finally:
+            if exporter:
+                exporter.stop()
+            self._folder_cache.close()
+            if self._bundles:
+                self._bundles.close()
+            if self._journal:
+                self._journal.close()
+            if self._index:
+                self._index.close()
+
+    def _dispatch(self):
         if self._obj.own_object_id:
             self._own_objects()
         # elif self._obj.object_id_info:
         #     self._print_object_info()
-        # elif self._obj.is_list_dirs:
-        #     self._list_folders()
+        elif self._obj.is_list_dirs:
+            self._list_folders()
+        elif self._obj.pack_find:
+            self._find_packed()
         # elif self._obj.is_list_objects:
         #     self._list_objects()
+        elif self._obj.jobs_manifest:
+            self._run_jobs()
+        elif self._obj.watch_dir:
+            self._watch()
+        elif self._obj.is_async:
+            asyncio.run(self._upload_async())
         else:
             self._uploader.upload()
 
+    async def _upload_async(self):
+        if self._journal or self._index or self._manifest \
+                or self._obj.is_verify or self._limiter or self._obj.is_pack \
+                or self._obj.compress or self._obj.split_size \
+                or self._obj.order != 'fifo' or self._obj.folder_name:
+            raise fex.exceptions.ConfigError(
+                '--async can\'t be combined with --resume, --dedup, --sync, '
+                '--verify, --pack, --compress, --split-size, --order, '
+                '--folder_name or rate limits')
+
+        # aiohttp is only needed here
+        from fex.async_api import AsyncAPI
+        from fex.async_uploader import AsyncUploader
+
+        api = AsyncAPI(limit_per_host=self._obj.host_connections,
+                       retry=self._retry, metrics=self._metrics)
+        api.share_session(self._api)
+        try:
+            await AsyncUploader(api=api, printer=self._printer, obj=self._obj,
+                                retry=self._retry,
+                                progress=self._progress,
+                                metrics=self._metrics,
+                                folders=self._folder_cache).upload()
+        finally:
+            await api.close()
+
+    def _run_jobs(self):
+        if self._obj.dir_path or self._obj.file_list or self._manifest \
+                or self._obj.watch_dir or self._obj.is_async:
+            raise fex.exceptions.ConfigError(
+                '--manifest can\'t be combined with --dir, --file, --sync, '
+                '--watch or --async')
+
+        status_path = self._obj.manifest_status or '{0}.status.jsonl'.format(
+            os.path.splitext(self._obj.jobs_manifest)[0])
+        JobScheduler(self._uploader, self._printer, self._obj,
+                     read_jobs(self._obj.jobs_manifest), status_path,
+                     resolve_folder=self._find_folder).run()
+
+    def _watch(self):
+        if self._obj.dir_path or self._obj.file_list or self._manifest \
+                or self._obj.is_async:
+            raise fex.exceptions.ConfigError(
+                '--watch can\'t be combined with --dir, --file, --sync or '
+                '--async')
+
+        state_path = self._obj.watch_state or '{0}fex_watch_{1}.json'.format(
+            get_temp_dir(), calculate_path_hash(self._obj.watch_dir))
+        state = WatchState(state_path)
+        if not self._obj.object_id:
+            self._obj.object_id = state.object_id
+
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopped.set())
+
+        # One Fex, session and connection pool for the daemon's lifetime
+        watcher = SpoolWatcher(self._obj.watch_dir, state.is_uploaded,
+                               self._obj.watch_settle, self._obj.watch_poll)
+        self._log.info('Watching {0}, uploading to object {1}'.format(
+            self._obj.watch_dir, self._obj.object_id or '(new)'))
+        try:
+            while not stopped.is_set():
+                files = [file for file in watcher.wait(stopped)
+                         if not state.is_uploaded(file)]
+                for start in range(0, len(files), self._obj.watch_batch):
+                    if stopped.is_set():
+                        watcher.add(files[start:])
+                        break
+                    self._upload_batch(files[start:start +
+                                             self._obj.watch_batch],
+                                       state, watcher)
+        finally:
+            watcher.close()
+            state.save()
+
+    def _upload_batch(self, files, state, watcher):
+        self._obj.file_list = files
+        try:
+            self._uploader.upload()
+        except fex.exceptions.UploaderError as err:
+            self._log.error('{0}, retrying them later'.format(err))
+        except (fex.exceptions.APIError, OSError) as err:
+            self._log.error('Batch of {0} files failed: {1}'.format(
+                len(files), err))
+            watcher.add(files)
+            return
+
+        failed = set(self._uploader.failed)
+        watcher.add(failed)
+        for file in files:
+            if file not in failed and os.path.exists(file):
+                state.add(file)
+        state.object_id = self._obj.object_id
+        state.save()
+
+    def _open_folder_cache(self):
+        path = self._obj.folder_cache or '{0}fex_folders.sqlite'.format(
+            get_temp_dir())
+        return FolderCache(path, self._obj.folder_cache_ttl)
+
+    def _fetch_folders(self, refresh=False):
+        if not self._obj.object_id:
+            raise fex.exceptions.ConfigError('Object ID required')
+        if not refresh and self._folder_cache.is_fresh(self._obj.object_id):
+            return self._folder_cache.get_folders(self._obj.object_id)
+
+        view_response = self._api.get_object_view(
+            self._obj.object_id, view_password=self._obj.view_password)
+        if not view_response.get('result'):
+            raise fex.exceptions.APIError('Can\'t get info, wrong password '
+                                          'or private object?')
+        folders = FolderLister(self._api, max(self._obj.jobs, LIST_JOBS)) \
+            .fetch(self._obj.object_id, view_response.get('upload_list', []))
+        self._folder_cache.replace(self._obj.object_id, folders)
+        return folders
+
+    def _find_folder(self, path):
+        # Cached tree first, a fresh listing if the path isn't in it
+        refreshed = self._obj.is_refresh_folders
+        self._fetch_folders(refreshed)
+        folder_id = self._folder_cache.find(self._obj.object_id, path)
+        if folder_id is None and not refreshed:
+            self._fetch_folders(refresh=True)
+            folder_id = self._folder_cache.find(self._obj.object_id, path)
+        if folder_id is None:
+            raise fex.exceptions.ConfigError('Folder {0} not found in object '
+                                             '{1}'.format(path,
+                                                          self._obj.object_id))
+        self._log.info('Folder {0} is {1}'.format(path, folder_id))
+        return folder_id
+
+    def _list_folders(self):
+        folders = self._fetch_folders(self._obj.is_refresh_folders)
+        paths = FolderLister.build_paths(folders)
+        rows = sorted(((paths[folder_id], name, folder_id)
+                       for folder_id, parent, name in folders),
+                      key=lambda row: row[0].lower())
+        self._printer.print_mesasge(rows, headers=['Path', 'Folder name', 'ID'],
+                                    showindex=range(1, len(rows) + 1))
+
+    def _open_bundle_index(self):
+        path = self._obj.pack_index or '{0}fex_bundles.sqlite'.format(
+            get_temp_dir())
+        return BundleIndex(path)
+
+    def _find_packed(self):
+        rows = [(path, object_id, folder, bundle, upload_id, offset,
+                 convert_size(size))
+                for path, object_id, folder, bundle, upload_id, offset, size
+                in self._bundles.find(self._obj.pack_find)]
+        if not rows:
+            sys.exit('{0} not found in packed files'.format(
+                self._obj.pack_find))
+        self._printer.print_mesasge(rows, headers=['Path', 'Object ID',
+                                                   'Folder ID', 'Bundle',
+                                                   'Upload ID', 'Offset',
+                                                   'Size'])
+
+    def _open_journal(self):
+        path = self._obj.journal or '{0}{1}_journal.jsonl'.format(
+            get_temp_dir(), self._obj.username or 'anonymous')
+        return TransferJournal(path)
+
+    def _open_index(self):
+        path = self._obj.dedup_index or '{0}fex_dedup.sqlite'.format(
+            get_temp_dir())
+        return DedupIndex(path, self._obj.dedup_size)
+
+    def _open_manifest(self):
+        if not self._obj.dir_path:
+            raise fex.exceptions.ConfigError('--sync requires a directory')
+        path = self._obj.sync_manifest or '{0}fex_sync_{1}.json'.format(
+            get_temp_dir(), calculate_path_hash(self._obj.dir_path))
+        return SyncManifest(path, self._obj.dir_path)
+
+    def _create_limiter(self):
+        if not (self._obj.limit_rate or self._obj.limit_schedule
+                or self._obj.limit_file):
+            return None
+
+        limiter = RateLimiter(
+            rate=self._obj.limit_rate or 0,
+            schedule=self._obj.limit_schedule,
+            control_file=self._obj.limit_file)
+        # kill -HUP rereads the control file right away
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda *args: limiter.reload())
+        return limiter
+
+    def _check_compression(self):
+        if not self._obj.compress:
+            return
+        if self._index:
+            # The index would map files to hashes of their compressed form
+            raise fex.exceptions.ConfigError('--compress can\'t be combined '
+                                             'with --dedup')
+        try:
+            create_compressor(self._obj.compress, self._obj.compress_level)
+        except (ImportError, ValueError) as err:
+            raise fex.exceptions.ConfigError(str(err))
+
     def _login(self):
         try:
             self._api.login(username=self._obj.username,
@@ -88,23 +359,6 @@ class Fex:
     #         else:
     #             print('Can\'t get info, wrong password?')
 
-    # def _list_folders(self, object_id, view_password):
-    #     self._api.process_cookies()
-    #     view_response = self._api.get_object_view(object_id,
-    #                                              view_password=view_password)
-    #     if view_response.get('result'):
-    #         upload_list = view_response.get('upload_list')
-    #         self._log.info('Fetching data and building folder list...')
-    #         folders = self._process_list(upload_list)
-    #         self._printer.print_on_complete(folders,
-    #                                        headers=['Folder name', 'ID',
-    #                                                 'Path'],
-    #                                        showindex=[x + 1 for x in
-    #                                                   range(len(folders))])
-    #     else:
-    #         self._log.error(
-    #             'Can\'t get info, wrong password or private object?')
-    #
     # def _list_objects(self):
     #     objects_list = self._api.get_home()
     #     objects = [(obj.get('preview'),
@@ -120,48 +374,6 @@ class Fex:
     #     headers = ['Name', 'ID', 'Owner', 'Object size', 'Public', 'Password',
     #                'Editable', 'Created on']
     #     self._printer.print_on_complete(objects, headers=headers)
-    #
-    # def _process_list(self, upload_list, dirs=None, parent_folder=None):
-    #     if dirs is None:
-    #         dirs = []
-    #     if parent_folder is None:
-    #         parent_folder = []
-    #     # folder_list_url = '{0}{1}{2}'.format(HOST, API_METHODS['object_folder_list'], self.object_id)
-    #
-    #     for elem in upload_list:
-    #         if elem.get('is_folder'):
-    #             folder_id = elem.get('upload_id')
-    #             parent_folder.append(folder_id)
-    #             base_parent_folder = parent_folder[:-1]
-    #
-    #             # folder_view_url = '{0}{1}{2}/{3}'.format(HOST, API_METHODS['object_folder_view'],
-    #             #                                      self.object_id, folder_id)
-    #             # folder_view_r = self.s.post(folder_view_url)
-    #             # folder_view_r.raise_for_status()
-    #             folder_view_r = self._api.get_object_folder_view(
-    #                 folder_id=folder_id)
-    #             folder_view_r = folder_view_r.json()
-    #
-    #             parent_folder_ids = {'list': ','.join(parent_folder)}
-    #             # folder_list_r = self.s.post(folder_list_url, data=parent_folder_ids)
-    #             # folder_list_r.raise_for_status()
-    #             folder_list_r = self._api.get_object_folder_list(
-    #                 data=parent_folder_ids)
-    #             folder_list_r = folder_list_r.json()
-    #             folder_list = folder_list_r.get('folder_list')
-    #             folder_list = [elem.get('name') for elem in folder_list]
-    #             dirs.append((elem.get('name'), elem.get('upload_id'),
-    #                          ' \u2192 '.join(folder_list)))
-    #             self._log.info('Found folders {0}\r'.format(len(dirs)), end='')
-    #             if sys.platform != 'win32':
-    #                 sys.stdout.write("\033[K")
-    #
-    #             self._process_list(folder_view_r.get('upload_list'), dirs,
-    #                                parent_folder)
-    #             parent_folder = base_parent_folder
-    #
-    #     dirs = sorted(dirs, key=lambda x: x[2].lower())
-    #     return dirs
 
 
 if __name__ == '__main__':
@@ -171,71 +383,12 @@ if __name__ == '__main__':
         '{0}.log'.format(os.path.splitext(os.path.basename(__file__))[0]))
     file_handler.setFormatter(logging.Formatter(log_format))
 
-    parser = argparse.ArgumentParser(description='FEX.net uploader')
-    group = parser.add_argument_group('user upload')
-    parser.add_argument('-a', '--anonymous', action='store_true', # works
-                        default=False,
-                        dest='is_anonymous',
-                        help='upload anonymously')
-    group.add_argument('-u', '--user', action='store', dest='username', # works
-                       help='set a username')
-    group.add_argument('-p', '--password', action='store', dest='password', # works
-                       help='set a password')
-    parser.add_argument('-s', '--secret', action='store', dest='secret', # works
-                        help='set a password for an object')
-    parser.add_argument('--hint', action='store', dest='hint', # works
-                        help='set a password hint for an object')
-    parser.add_argument('--folder_name', action='store', dest='folder_name', # N/A
-                        help='folder name to be created')
-    group.add_argument('-o', '--object', action='store', dest='object_id', # works
-                       help='set an object id')
-    group.add_argument('-f', '--file', action='store', dest='file_list', # works
-                       help='file name(s)', nargs='+')
-    parser.add_argument('--view-password', action='store', # ????????????????????
-                        dest='view_password',
-                        help='object\'s password')
-    # ABSENT
-    parser.add_argument('--object-name', action='store',
-                        dest='object_name',
-                        help='object\'s name')
-    # ABSENT
-    parser.add_argument('--object-description', action='store',
-                        dest='object_description',
-                        help='object\'s description')
-    parser.add_argument('-d', '--dir', action='store', dest='dir_path', # works +=
-                        help='recursive upload of directory')
-    parser.add_argument('--force', action='store_true', default=False, # works
-                        dest='is_force',
-                        help='force login')
-    # Commented out since printer class is too
-    # parser.add_argument('--verify', action='store_true', default=False,
-    #                     dest='is_verify',
-    #                     help='verify checksums')
-    parser.add_argument('--own', action='store', dest='own_object_id', # works
-                        help='inherit object', nargs='+')
-    parser.add_argument('--folder-create', action='store', # not implemented
-                        dest='folder_create',
-                        help='create folder with name')
-    parser.add_argument('--folder', action='store', dest='folder_id', # works
-                        help='upload to existent folder id, object id required')
-    parser.add_argument('--list-dirs', action='store_true', default=False,
-                        dest='is_list_dirs',
-                        help='list folders for object')
-    # parser.add_argument('--list-objects', action='store_true', # n/a printer off
-    #                     default=False, dest='is_list_objects',
-    #                     help='list objects')
-    parser.add_argument('--public', default=None, # works
-                        choices=('true', 'false'), dest='public',
-                        help='make object public or private, default true')
-    # parser.add_argument('--info', action='store', dest='object_id_info',
-    #                     help='print object info', nargs='+')
-    parser.add_argument('--version', action='version',
-                        version='%(prog)s 0.1')
+    parser = create_parser()
 
     args = parser.parse_args()
     if not len(sys.argv) > 1:
         parser.print_help()
         sys.exit(1)
 
-    fex = Fex(args)
-    fex.run()
+    # Not bound to a name, it would shadow the fex package
+    Fex(args).run()
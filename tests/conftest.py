@@ -0,0 +1,97 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOADER = os.path.join(ROOT, 'fex_uploader.py')
+
+# fex.constants reads FEX_HOST on import, so the fake server's address has
+# to be set before anything from fex is imported
+with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    PORT = sock.getsockname()[1]
+os.environ['FEX_HOST'] = 'http://127.0.0.1:{0}'.format(PORT)
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'bench')]
+
+from fake_server import start_server  # noqa: E402
+from fex.api import API  # noqa: E402
+from fex.cli import create_parser  # noqa: E402
+from fex.printer import Printer  # noqa: E402
+
+
+# Keeps what an upload printed for the test to look at
+class CollectingPrinter(Printer):
+    def __init__(self, obj):
+        super().__init__(obj)
+        self.records = []
+        self.summary = None
+
+    def print_record(self, record):
+        self.records.append(record)
+
+    def print_summary(self, msg, object_url=True):
+        self.summary = dict(msg)
+
+
+def create_options(*args):
+    # Options as fex_uploader.py would parse them, anonymous with jsonl
+    return create_parser().parse_args(['-a', '--output', 'jsonl'] +
+                                      [str(arg) for arg in args])
+
+
+def create_api():
+    api = API()
+    api.initialize_cookies('fex_tests')
+    return api
+
+
+def run_bounded(fn, timeout=60):
+    # A hang fails the test instead of blocking the whole run, returns the
+    # exception fn raised if any
+    error = []
+
+    def target():
+        try:
+            fn()
+        except Exception as err:
+            error.append(err)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'Still running after {0}s'.format(timeout)
+    return error[0] if error else None
+
+
+@pytest.fixture(scope='session')
+def _server():
+    server = start_server(port=PORT)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def server(_server):
+    _server.state.reset()
+    return _server
+
+
+@pytest.fixture
+def run_uploader(server, tmp_path):
+    # Runs fex_uploader.py in tmp_path with its caches kept there, returns
+    # the exit code and the jsonl records it printed
+    def run(*args):
+        command = [sys.executable, UPLOADER, '-a', '--output', 'jsonl',
+                   '--folder-cache', str(tmp_path / 'folders.sqlite')]
+        process = subprocess.run(command + [str(arg) for arg in args],
+                                 cwd=str(tmp_path), stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, timeout=300)
+        records = [json.loads(line) for line in
+                   process.stdout.decode().splitlines() if line]
+        return process.returncode, records
+    return run
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import os
+import shutil
+
+import pytest
+
+from conftest import CollectingPrinter, create_options
+from fex.async_api import AsyncAPI
+from fex.async_uploader import AsyncUploader
+from fex.exceptions import UploaderError
+from fex.folders import FolderCache
+
+
+def upload(*args, folders=None, uploader_class=AsyncUploader):
+    obj = create_options('--async', *args)
+    printer = CollectingPrinter(obj)
+
+    async def run():
+        api = AsyncAPI()
+        try:
+            await uploader_class(api=api, printer=printer, obj=obj,
+                                 folders=folders).upload()
+        finally:
+            await api.close()
+
+    asyncio.run(run())
+    return printer
+
+
+def write_tree(root):
+    files = {}
+    for path, size in (('a', 10), ('b', 0), ('sub/c', 70000),
+                       ('sub/deeper/d', 5)):
+        path = os.path.join(str(root), path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = os.urandom(size)
+        with open(path, 'wb') as f:
+            f.write(data)
+        files[path] = hashlib.sha1(data).hexdigest()
+    return files
+
+
+def test_upload_dir(server, tmp_path):
+    files = write_tree(tmp_path / 'tree')
+    printer = upload('-j', '3', '-d', str(tmp_path / 'tree'))
+
+    assert {record['file']: record['sha1']
+            for record in printer.records} == files
+    assert printer.summary['Files uploaded:'] == len(files)
+    assert printer.summary['Files failed:'] == 0
+    # One folder per directory, files land in the folder of theirs
+    folders = {os.path.dirname(record['file']): record['folder_id']
+               for record in printer.records}
+    assert len(set(folders.values())) == 3
+    assert None not in folders.values()
+    stats = server.state.stats()
+    assert stats['requests']['j_object_folder_create'] == 3
+    assert stats['uploads'] == len(files)
+
+
+def test_upload_files(server, tmp_path):
+    files = write_tree(tmp_path)
+    printer = upload('-o', 'object1', '-f', *sorted(files))
+
+    assert sorted(record['file'] for record in printer.records) == \
+        sorted(files)
+    assert {record['object_id'] for record in printer.records} == {'object1'}
+    assert server.state.stats()['uploads'] == len(files)
+
+
+def test_upload_dir_sets_secret(server, tmp_path):
+    write_tree(tmp_path / 'tree')
+    upload('-o', 'object1', '-s', 'pass', '-d', str(tmp_path / 'tree'))
+
+    assert server.state.view_passes == {'object1': ('pass', '')}
+
+
+def test_deleted_nested_folder_is_created_again(server, tmp_path):
+    files = write_tree(tmp_path / 'tree')
+    folders = FolderCache(str(tmp_path / 'folders.sqlite'))
+
+    def upload_tree():
+        server.state.reset()
+        printer = upload('-o', 'object_async_folders', '-d', str(tmp_path / 'tree'),
+                         folders=folders)
+        assert printer.summary['Files uploaded:'] == len(files)
+        return ({os.path.relpath(os.path.dirname(record['file']),
+                                 str(tmp_path)): record['folder_id']
+                 for record in printer.records},
+                server.state.stats()['requests'].get(
+                    'j_object_folder_create', 0))
+
+    first, created = upload_tree()
+    assert created == 3
+    server.state.delete_folder('object_async_folders', first['tree/sub'])
+
+    second, created = upload_tree()
+    assert created == 2
+    assert second['tree'] == first['tree']
+    assert second['tree/sub'] != first['tree/sub']
+    assert second['tree/sub/deeper'] != first['tree/sub/deeper']
+    assert upload_tree() == (second, 0)
+
+
+def test_counts_files_and_dirs_gone_during_walk(server, tmp_path):
+    write_tree(tmp_path / 'tree')
+    gone = str(tmp_path / 'tree' / 'a')
+    printers = []
+
+    class RemovingUploader(AsyncUploader):
+        def __init__(self, printer, **kwargs):
+            super().__init__(printer=printer, **kwargs)
+            printers.append(printer)
+
+        @staticmethod
+        def _scan_dir(dir_path):
+            result = AsyncUploader._scan_dir(dir_path)
+            if dir_path.endswith('tree'):
+                os.remove(gone)
+                shutil.rmtree(str(tmp_path / 'tree' / 'sub'))
+            return result
+
+    with pytest.raises(UploaderError) as err:
+        upload('-d', str(tmp_path / 'tree'),
+               uploader_class=RemovingUploader)
+
+    printer, = printers
+    assert sorted(record['file'] for record in printer.records
+                  if record['type'] == 'error') == [
+        gone, str(tmp_path / 'tree' / 'sub')]
+    assert [record['file'] for record in printer.records
+            if record['type'] == 'file'] == [str(tmp_path / 'tree' / 'b')]
+    assert printer.summary['Files uploaded:'] == 1
+    assert printer.summary['Files failed:'] == 2
+    assert str(err.value) == '2 of 3 files weren\'t uploaded'
+
+
+@pytest.mark.parametrize('args', [('--order', 'lpt'),
+                                  ('--folder_name', 'folder')])
+def test_rejects_unsupported_options(run_uploader, server, tmp_path, args):
+    (tmp_path / 'file').write_bytes(b'data')
+    code, records = run_uploader('--async', '-f', 'file', *args)
+    assert code != 0
+    assert server.state.stats()['total_requests'] == 0
@@ -0,0 +1,54 @@
+import hashlib
+import os
+
+import pytest
+
+from fex.client import FexClient
+from fex.exceptions import ConfigError
+
+PART_SIZE = 2 ** 20
+
+
+@pytest.fixture
+def client(server, tmp_path):
+    with FexClient(folder_cache=str(tmp_path / 'folders.sqlite')) as client:
+        yield client
+
+
+def test_upload_dir(client, server, tmp_path):
+    os.makedirs(str(tmp_path / 'tree' / 'sub'))
+    (tmp_path / 'tree' / 'a').write_bytes(b'a')
+    (tmp_path / 'tree' / 'sub' / 'b').write_bytes(b'b')
+
+    result = client.upload_dir(str(tmp_path / 'tree'), object_id='object1')
+
+    assert result.object_id == 'object1'
+    assert result.errors == ()
+    assert sorted(os.path.basename(file.file) for file in result.files) == \
+        ['a', 'b']
+    assert all(file.upload_id and file.url for file in result.files)
+    assert all(file.parts is None for file in result.files)
+    assert server.state.stats()['uploads'] == 2
+
+
+def test_upload_split_file(client, server, tmp_path):
+    data = os.urandom(2 * PART_SIZE + 10)
+    (tmp_path / 'big').write_bytes(data)
+
+    result = client.upload_file(str(tmp_path / 'big'), object_id='object1',
+                                split_size=PART_SIZE)
+
+    file, = result.files
+    assert file.size == len(data)
+    assert file.upload_id is None
+    assert file.manifest_upload_id
+    assert [part['sha1'] for part in file.parts] == [
+        hashlib.sha1(data[offset:offset + PART_SIZE]).hexdigest()
+        for offset in range(0, len(data), PART_SIZE)]
+    assert server.state.stats()['uploads'] == len(file.parts) + 1
+
+
+@pytest.mark.parametrize('options', [{'is_sync': True}, {'no_such': 1}])
+def test_rejects_options(client, tmp_path, options):
+    with pytest.raises(ConfigError):
+        client.upload_file(str(tmp_path / 'file'), **options)
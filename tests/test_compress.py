@@ -0,0 +1,89 @@
+import gzip
+import io
+import os
+
+import pytest
+
+from conftest import run_bounded
+from fex.compress import CompressingReader, is_compressible
+
+TEXT = b''.join(b'line %d of a log file\n' % number
+                for number in range(20000))
+
+
+class FailingStream(io.BytesIO):
+    def read(self, size=-1):
+        if self.tell():
+            raise OSError('disk gone')
+        return super().read(size)
+
+
+def read_all(reader, size=1000):
+    chunks = []
+    while True:
+        chunk = reader.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    reader.close()
+    return b''.join(chunks)
+
+
+def test_gzip_round_trip():
+    reader = CompressingReader(io.BytesIO(TEXT), 'gzip', buffer_size=4096,
+                               queue_size=1)
+    assert gzip.decompress(read_all(reader)) == TEXT
+    assert reader.bytes_read == len(TEXT)
+    assert reader.bytes_written < len(TEXT) / 5
+
+
+def test_zstd_round_trip():
+    zstandard = pytest.importorskip('zstandard')
+    reader = CompressingReader(io.BytesIO(TEXT), 'zstd', buffer_size=4096)
+    data = read_all(reader)
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(data) == \
+        TEXT
+
+
+def test_source_errors_reach_the_reader():
+    reader = CompressingReader(FailingStream(TEXT), 'gzip', buffer_size=4096)
+    with pytest.raises(OSError):
+        read_all(reader)
+    reader.close()
+
+
+def test_close_stops_a_blocked_worker():
+    reader = CompressingReader(io.BytesIO(os.urandom(2 ** 20)), 'gzip',
+                               buffer_size=1024, queue_size=1)
+    reader.read(10)
+    assert run_bounded(reader.close, timeout=10) is None
+
+
+def test_is_compressible(tmp_path):
+    (tmp_path / 'log.txt').write_bytes(TEXT)
+    (tmp_path / 'random.bin').write_bytes(os.urandom(10000))
+    (tmp_path / 'text.gz').write_bytes(TEXT)
+    assert is_compressible(str(tmp_path / 'log.txt'))
+    assert not is_compressible(str(tmp_path / 'random.bin'))
+    # By name, whatever the content
+    assert not is_compressible(str(tmp_path / 'text.gz'))
+
+
+def test_compressed_upload(run_uploader, server, tmp_path):
+    (tmp_path / 'log.txt').write_bytes(TEXT)
+    (tmp_path / 'random.bin').write_bytes(os.urandom(10000))
+    server.state.store_uploads = True
+
+    code, records = run_uploader('--compress', 'gzip', '--verify', '-f',
+                                 'log.txt', 'random.bin')
+    assert code == 0
+    uploads = {record['file']: server.state.files[record['upload_id']]
+               for record in records if record['type'] == 'file'}
+    name, data = uploads['log.txt']
+    assert name == 'log.txt.gz'
+    assert gzip.decompress(data) == TEXT
+    assert uploads['random.bin'] == ('random.bin', (tmp_path /
+                                                    'random.bin').read_bytes())
+    summary, = [record for record in records if record['type'] == 'summary']
+    assert summary['files_compressed'] == 1
+    assert summary['compression_ratio'] == round(len(TEXT) / len(data), 2)
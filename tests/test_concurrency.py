@@ -0,0 +1,60 @@
+import os
+import time
+
+from conftest import CollectingPrinter, create_api, create_options, run_bounded
+from fex.exceptions import UploaderError
+from fex.uploader import Uploader
+
+LATENCY = 0.3
+
+
+def upload(*args):
+    obj = create_options(*args)
+    printer = CollectingPrinter(obj)
+    uploader = Uploader(api=create_api(), printer=printer, obj=obj)
+    started = time.monotonic()
+    error = run_bounded(uploader.upload)
+    return error, printer, time.monotonic() - started
+
+
+def write_files(tmp_path, count):
+    paths = []
+    for number in range(count):
+        path = tmp_path / 'file{0}'.format(number)
+        path.write_bytes(os.urandom(number * 1000))
+        paths.append(str(path))
+    return paths
+
+
+def test_uploads_run_at_once(server, tmp_path, monkeypatch):
+    files = write_files(tmp_path, 8)
+    monkeypatch.setattr(server.state, 'latency', LATENCY)
+
+    error, printer, elapsed = upload('-j', '8', '-o', 'object1', '-f',
+                                     *files)
+    assert error is None
+    # One at a time would take 8 * LATENCY for the uploads alone
+    assert elapsed < 4 * LATENCY
+    # Every record is about its own file, nothing is shared between workers
+    assert sorted((record['file'], record['name'], record['size'])
+                  for record in printer.records) == [
+        (file, os.path.basename(file), os.path.getsize(file))
+        for file in sorted(files)]
+    assert printer.summary['Files uploaded:'] == 8
+
+
+def test_errors_are_collected_per_file(server, tmp_path):
+    files = write_files(tmp_path, 4)
+    os.makedirs(str(tmp_path / 'not_a_file'))
+    files.insert(2, str(tmp_path / 'not_a_file'))
+
+    error, printer, elapsed = upload('-j', '3', '-o', 'object1', '-f',
+                                     *files)
+    assert isinstance(error, UploaderError)
+    assert [record['file'] for record in printer.records
+            if record['type'] == 'error'] == [str(tmp_path / 'not_a_file')]
+    assert printer.summary['Files uploaded:'] == 4
+    assert printer.summary['Files failed:'] == 1
+    # Reading the file fails the same way every time
+    assert printer.summary['Retries:'] == 0
+    assert server.state.stats()['uploads'] == 4
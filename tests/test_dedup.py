@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from fex.index import DedupIndex
+
+
+@pytest.fixture
+def dedup(run_uploader, tmp_path):
+    def run(*args):
+        return run_uploader('--dedup', '--dedup-index',
+                            tmp_path / 'dedup.sqlite', *args)
+    return run
+
+
+def summary(records):
+    return [record for record in records if record['type'] == 'summary'][0]
+
+
+def test_copies_content_uploaded_elsewhere(dedup, server, tmp_path):
+    (tmp_path / 'first').write_bytes(b'same content')
+    (tmp_path / 'second').write_bytes(b'same content')
+
+    code, records = dedup('-o', 'object1', '-f', 'first')
+    assert code == 0
+    original = records[0]['upload_id']
+    server.state.reset()
+
+    # Never hashed before under this path, still found by its content
+    code, records = dedup('-o', 'object2', '-f', 'second')
+    assert code == 0
+    copy = records[0]
+    assert copy['file'] == 'second'
+    assert copy['copied_from'] == original
+    assert copy['upload_id'] not in (None, original)
+    assert summary(records)['files_copied'] == 1
+    assert summary(records)['files_uploaded'] == 0
+    assert summary(records)['files_skipped'] == 0
+    assert server.state.stats()['requests'] == {'j_object_view': 1,
+                                                'j_upload_list_copy': 1}
+
+
+def test_skips_content_already_in_the_folder(dedup, server, tmp_path):
+    (tmp_path / 'file').write_bytes(b'content')
+    assert dedup('-o', 'object1', '-f', 'file')[0] == 0
+    (tmp_path / 'renamed').write_bytes(b'content')
+
+    code, records = dedup('-o', 'object1', '-f', 'renamed')
+    assert code == 0
+    assert summary(records)['files_skipped'] == 1
+    assert summary(records)['files_copied'] == 0
+    assert server.state.stats()['uploads'] == 1
+
+
+def test_uploads_changed_content(dedup, server, tmp_path):
+    path = tmp_path / 'file'
+    path.write_bytes(b'old')
+    assert dedup('-o', 'object1', '-f', 'file')[0] == 0
+    path.write_bytes(b'new content')
+
+    code, records = dedup('-o', 'object1', '-f', 'file')
+    assert code == 0
+    assert summary(records)['files_uploaded'] == 1
+    assert server.state.stats()['uploads'] == 2
+
+
+def test_uploads_when_copy_returns_no_upload(dedup, server, tmp_path):
+    (tmp_path / 'first').write_bytes(b'copied content')
+    (tmp_path / 'second').write_bytes(b'copied content')
+    assert dedup('-o', 'object1', '-f', 'first')[0] == 0
+    server.state.reset()
+    server.state.copy_without_ids = True
+
+    code, records = dedup('-o', 'object2', '-f', 'second')
+    assert code == 0
+    assert records[0]['upload_id']
+    assert 'copied_from' not in records[0]
+    assert summary(records)['files_uploaded'] == 1
+    assert summary(records)['files_copied'] == 0
+    assert server.state.stats()['uploads'] == 1
+
+
+def test_index_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(time, 'time', lambda: next(clock))
+    index = DedupIndex(str(tmp_path / 'dedup.sqlite'), max_entries=2)
+    index.add_upload('old', 'object1', None, 'id1')
+    index.add_upload('new', 'object1', None, 'id2')
+    assert index.get_uploads('old') == [('object1', '', 'id1')]
+    index.add_upload('third', 'object1', None, 'id3')
+    index.close()
+
+    index = DedupIndex(str(tmp_path / 'dedup.sqlite'), max_entries=2)
+    assert index.get_uploads('old') == [('object1', '', 'id1')]
+    assert index.get_uploads('new') == []
+    assert index.get_uploads('third') == [('object1', '', 'id3')]
+    index.close()
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for path in ('a', 'sub/b', 'sub/deeper/c'):
+        path = tmp_path / 'tree' / path
+        os.makedirs(str(path.parent), exist_ok=True)
+        path.write_bytes(b'data')
+    return tmp_path / 'tree'
+
+
+def folders(records):
+    return {os.path.dirname(record['file']): record['folder_id']
+            for record in records if record['type'] == 'file'}
+
+
+def upload(run_uploader, server):
+    server.state.reset()
+    code, records = run_uploader('-o', 'object_folders', '-d', 'tree')
+    assert code == 0
+    assert len(folders(records)) == 3
+    return folders(records), server.state.stats()['requests'].get(
+        'j_object_folder_create', 0)
+
+
+def test_reuses_folders(run_uploader, server, tree):
+    first, created = upload(run_uploader, server)
+    assert created == 3
+    assert upload(run_uploader, server) == (first, 0)
+
+
+def test_deleted_root_is_reconciled(run_uploader, server, tree):
+    first, created = upload(run_uploader, server)
+    server.state.delete_folder('object_folders', first['tree'])
+
+    second, created = upload(run_uploader, server)
+    assert created == 3
+    assert not set(first.values()) & set(second.values())
+
+
+def test_deleted_nested_folder_is_created_again(run_uploader, server, tree):
+    first, created = upload(run_uploader, server)
+    server.state.delete_folder('object_folders', first['tree/sub'])
+
+    second, created = upload(run_uploader, server)
+    assert created == 2
+    assert second['tree'] == first['tree']
+    assert second['tree/sub'] != first['tree/sub']
+    assert second['tree/sub/deeper'] != first['tree/sub/deeper']
+    assert server.state.get_folders('object_folders', second['tree/sub']) == [
+        {'is_folder': 1, 'upload_id': second['tree/sub/deeper'],
+         'name': 'deeper'}]
+
+    # The cache has the new folders
+    assert upload(run_uploader, server) == (second, 0)
@@ -0,0 +1,52 @@
+import json
+import os
+
+
+def write_jobs(tmp_path, jobs):
+    path = tmp_path / 'jobs.jsonl'
+    path.write_text(''.join(json.dumps(job) + '\n' for job in jobs))
+    return path
+
+
+def read_status(tmp_path):
+    with open(str(tmp_path / 'jobs.status.jsonl')) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_jobs_share_object(run_uploader, server, tmp_path):
+    os.makedirs(str(tmp_path / 'tree' / 'sub'))
+    (tmp_path / 'tree' / 'sub' / 'a').write_bytes(b'a')
+    (tmp_path / 'file').write_bytes(b'file')
+    jobs = write_jobs(tmp_path, [
+        {'source': 'tree', 'object_id': 'object1', 'secret': 'pass1',
+         'hint': 'hint1'},
+        {'source': 'file', 'object_id': 'object1'},
+        {'source': 'file', 'object_id': 'object2', 'secret': 'pass2'},
+        {'source': 'missing', 'object_id': 'object2'},
+    ])
+
+    code, records = run_uploader('--manifest', jobs)
+
+    assert code != 0
+    assert [(record['line'], record['status'])
+            for record in read_status(tmp_path)] == [
+        (1, 'done'), (2, 'done'), (3, 'done'), (4, 'failed')]
+    stats = server.state.stats()
+    assert stats['uploads'] == 3
+    # The secret is set once per object whatever its sources are
+    assert stats['requests']['j_object_view'] == 2
+    assert stats['requests']['j_object_set_view_pass'] == 2
+    assert server.state.view_passes == {'object1': ('pass1', 'hint1'),
+                                        'object2': ('pass2', '')}
+
+
+def test_dir_job_sets_secret(run_uploader, server, tmp_path):
+    os.makedirs(str(tmp_path / 'tree'))
+    (tmp_path / 'tree' / 'a').write_bytes(b'a')
+    jobs = write_jobs(tmp_path, [{'source': 'tree', 'secret': 'pass'}])
+
+    code, records = run_uploader('--manifest', jobs)
+
+    assert code == 0
+    object_id = read_status(tmp_path)[0]['object_id']
+    assert server.state.view_passes == {object_id: ('pass', '')}
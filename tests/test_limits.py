@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from fex.cli import create_parser
+from fex.throttle import RateLimiter, parse_schedule
+from fex.utils import parse_size
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('0', 0),
+    ('512', 512),
+    ('200K', 200 * 1024),
+    ('200M/s', 200 * 2 ** 20),
+    ('1.5G', int(1.5 * 2 ** 30)),
+    ('10mb/s', 10 * 2 ** 20),
+])
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+def test_parse_schedule():
+    assert parse_schedule('09:00-18:00=50M,18:00-09:00=0') == [
+        (9 * 60, 18 * 60, 50 * 2 ** 20), (18 * 60, 9 * 60, 0)]
+    assert parse_schedule('') == []
+
+
+@pytest.mark.parametrize('value', ['9-18=50M', '09:00-18:00', '25:00-09:00=1M',
+                                   '09:60-10:00=1M', '09:00-18:00=fast'])
+def test_parse_schedule_rejects(value):
+    with pytest.raises(ValueError):
+        parse_schedule(value)
+
+
+def test_arguments_are_parsed():
+    args = create_parser().parse_args([
+        '--limit-rate', '200M/s', '--limit-schedule', '22:00-06:00=0'])
+    assert args.limit_rate == 200 * 2 ** 20
+    assert args.limit_schedule == [(22 * 60, 6 * 60, 0)]
+
+
+@pytest.mark.parametrize('args', [['--limit-rate', 'fast'],
+                                  ['--limit-schedule', '9-18=50M']])
+def test_bad_arguments_are_rejected(args, capsys):
+    with pytest.raises(SystemExit):
+        create_parser().parse_args(args)
+    assert 'argument {0}'.format(args[0]) in capsys.readouterr().err
+
+
+def test_schedule_window_wraps_midnight(monkeypatch):
+    limiter = RateLimiter(rate=100, schedule=parse_schedule(
+        '22:00-06:00=10,06:00-22:00=0'))
+    for hour, rate in ((23, 10), (3, 10), (6, 0), (12, 0)):
+        now = time.struct_time((2026, 1, 1, hour, 0, 0, 3, 1, -1))
+        monkeypatch.setattr(time, 'localtime', lambda now=now: now)
+        assert limiter.rate == rate
+
+
+def test_control_file_overrides_rate(tmp_path):
+    control = tmp_path / 'limit'
+    control.write_text('1M')
+    limiter = RateLimiter(rate=100, control_file=str(control))
+    limiter.consume(0)
+    assert limiter.rate == 2 ** 20
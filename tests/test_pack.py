@@ -0,0 +1,110 @@
+import io
+import os
+import tarfile
+
+from fex.pack import Bundle, BundleIndex, plan_bundles
+
+SMALL = {'a': b'a' * 10, 'b': b'b' * 700, 'd_e': b'd' * 100, 'dxe': b''}
+
+
+def write_files(root, files):
+    os.makedirs(str(root), exist_ok=True)
+    paths = []
+    for name, data in files.items():
+        (root / name).write_bytes(data)
+        paths.append(str(root / name))
+    return paths
+
+
+def read_stream(bundle, buffer_size=64):
+    stream = bundle.open(buffer_size)
+    chunks = []
+    while True:
+        chunk = stream.read(100)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    stream.close()
+    return b''.join(chunks)
+
+
+def test_plan_bundles(tmp_path):
+    paths = write_files(tmp_path, dict(SMALL, big=b'x' * 2000))
+    singles, bundles = plan_bundles(paths, threshold=1000, max_size=800)
+    assert singles == [str(tmp_path / 'big')]
+    assert [bundle.files for bundle in bundles] == [
+        [str(tmp_path / 'a'), str(tmp_path / 'b')],
+        [str(tmp_path / 'd_e'), str(tmp_path / 'dxe')]]
+
+    # A bundle of one file is no gain
+    singles, bundles = plan_bundles(paths, threshold=5, max_size=800)
+    assert singles == [str(tmp_path / name)
+                       for name in ('a', 'b', 'big', 'd_e', 'dxe')]
+    assert bundles == []
+
+
+def test_bundle_is_a_tar_of_its_files(tmp_path):
+    bundle = Bundle(write_files(tmp_path, SMALL))
+    data = read_stream(bundle)
+    assert len(data) == bundle.size
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert {member.name: tar.extractfile(member).read()
+                for member in tar} == SMALL
+    # Members can be cut out of the archive by their offset
+    for file, header, offset, size, mtime in bundle.members:
+        assert data[offset:offset + size] == SMALL[os.path.basename(file)]
+
+
+def test_shrunk_file_keeps_the_length(tmp_path):
+    bundle = Bundle(write_files(tmp_path, SMALL))
+    (tmp_path / 'b').write_bytes(b'b' * 10)
+    data = read_stream(bundle)
+    assert len(data) == bundle.size
+    file, header, offset, size, mtime = bundle.members[1]
+    assert data[offset:offset + size] == b'b' * 10 + bytes(690)
+
+
+def test_exclude_renames_the_bundle(tmp_path):
+    bundle = Bundle(write_files(tmp_path, SMALL))
+    rest = bundle.exclude([str(tmp_path / 'a')])
+    assert rest.skipped == [str(tmp_path / 'a')]
+    assert len(rest.files) == 3
+    assert rest.name != bundle.name
+
+
+def test_index_find_matches_names_literally(tmp_path):
+    bundle = Bundle(write_files(tmp_path / 'tree', SMALL))
+    index = BundleIndex(str(tmp_path / 'pack.sqlite'))
+    index.add(bundle, 'object1', None, 'id1')
+    # _ is no wildcard in names
+    assert [os.path.basename(row[0]) for row in index.find('d_e')] == ['d_e']
+    assert len(index.find('tree')) == 4
+    index.close()
+
+
+def test_pack_upload(run_uploader, server, tmp_path):
+    write_files(tmp_path / 'tree', dict(SMALL, big=b'x' * 2000))
+    write_files(tmp_path / 'tree' / 'sub', {'alone': b'alone'})
+    server.state.store_uploads = True
+
+    code, records = run_uploader('--pack', '--pack-threshold', '1K',
+                                 '--pack-index', tmp_path / 'pack.sqlite',
+                                 '-d', 'tree')
+    assert code == 0
+    assert server.state.stats()['uploads'] == 3
+    packed = {os.path.basename(record['file']): record for record in records
+              if record.get('bundle')}
+    assert sorted(packed) == sorted(SMALL)
+    upload_id, = {record['upload_id'] for record in packed.values()}
+    name, data = server.state.files[upload_id]
+    assert name == packed['a']['bundle']
+    for member, record in packed.items():
+        assert data[record['offset']:record['offset'] + record['size']] == \
+            SMALL[member]
+
+    index = BundleIndex(str(tmp_path / 'pack.sqlite'))
+    path, object_id, folder, bundle, found_id, offset, size = \
+        index.find('tree/b')[0]
+    assert (bundle, found_id, offset, size) == (
+        name, upload_id, packed['b']['offset'], 700)
+    index.close()
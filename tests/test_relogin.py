@@ -0,0 +1,93 @@
+import asyncio
+import glob
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import CollectingPrinter, create_options
+from fex.api import API
+from fex.async_api import AsyncAPI
+from fex.async_uploader import AsyncUploader
+from fex.uploader import Uploader
+
+
+@pytest.fixture
+def api(server):
+    # A user of its own, so no session of an earlier run is picked up
+    username = 'relogin_{0}'.format(uuid.uuid4().hex)
+    server.state.require_login = True
+    api = API(pool_size=4)
+    api.initialize_cookies(username)
+    api.login(username, 'password')
+    yield api
+    for path in glob.glob('{0}*'.format(api._cookie_file)):
+        os.remove(path)
+
+
+def signins(server):
+    return server.state.stats()['requests']['j_signin']
+
+
+def write_tree(root):
+    for number in range(6):
+        path = root / 'dir{0}'.format(number) / 'file'
+        os.makedirs(str(path.parent))
+        path.write_bytes(b'data')
+
+
+def test_api_relogs_in_once(api, server):
+    server.state.sessions.clear()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(
+            lambda _: api.get_object_view('object1'), range(8)))
+    assert all(result['result'] for result in results)
+    assert signins(server) == 2
+
+
+def test_async_api_relogs_in_once(api, server):
+    server.state.sessions.clear()
+
+    async def run():
+        async_api = AsyncAPI()
+        async_api.share_session(api)
+        try:
+            return await asyncio.gather(*[
+                async_api.get_object_view('object1') for _ in range(8)])
+        finally:
+            await async_api.close()
+
+    assert all(result['result'] for result in asyncio.run(run()))
+    assert signins(server) == 2
+
+
+def test_upload_relogs_in_mid_run(api, server, tmp_path):
+    write_tree(tmp_path / 'tree')
+    obj = create_options('-j', '4', '-d', tmp_path / 'tree')
+    printer = CollectingPrinter(obj)
+    server.state.expire_after = 3
+
+    Uploader(api=api, printer=printer, obj=obj).upload()
+    assert len(printer.records) == 6
+    assert signins(server) == 2
+
+
+def test_async_upload_relogs_in_mid_run(api, server, tmp_path):
+    write_tree(tmp_path / 'tree')
+    obj = create_options('--async', '-j', '4', '-d', tmp_path / 'tree')
+    printer = CollectingPrinter(obj)
+    server.state.expire_after = 3
+
+    async def run():
+        async_api = AsyncAPI()
+        async_api.share_session(api)
+        try:
+            await AsyncUploader(api=async_api, printer=printer,
+                                obj=obj).upload()
+        finally:
+            await async_api.close()
+
+    asyncio.run(run())
+    assert len(printer.records) == 6
+    assert signins(server) == 2
@@ -0,0 +1,64 @@
+import pytest
+import requests
+from urllib3.exceptions import ProtocolError
+
+from fex.retry import RetryPolicy
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+@pytest.mark.parametrize('err', [
+    requests.ConnectionError(),
+    requests.ConnectTimeout(),
+    requests.ReadTimeout(),
+    requests.exceptions.ChunkedEncodingError(),
+    TimeoutError(),
+    http_error(500),
+    http_error(503),
+])
+def test_retries_transport_errors(err):
+    assert RetryPolicy.is_retryable(err)
+
+
+@pytest.mark.parametrize('err', [
+    requests.exceptions.InvalidURL(),
+    requests.exceptions.MissingSchema(),
+    requests.exceptions.InvalidHeader(),
+    FileNotFoundError(),
+    PermissionError(),
+    OSError(),
+    ValueError(),
+    http_error(400),
+    http_error(404),
+    # A file that can't be read any more while its body is sent
+    requests.ConnectionError(ProtocolError('Connection aborted.',
+                                           PermissionError(13, 'denied'))),
+])
+def test_gives_up_on_errors_that_repeat(err):
+    assert not RetryPolicy.is_retryable(err)
+
+
+def test_non_idempotent_requests():
+    assert RetryPolicy.is_retryable(requests.ConnectTimeout(), False)
+    assert RetryPolicy.is_retryable(http_error(429), False)
+    assert not RetryPolicy.is_retryable(requests.ReadTimeout(), False)
+    assert not RetryPolicy.is_retryable(http_error(500), False)
+
+
+def test_attempts_are_limited():
+    policy = RetryPolicy(attempts=2, backoff=0)
+    assert policy.get_delay(0, requests.ConnectionError()) is not None
+    assert policy.get_delay(1, requests.ConnectionError()) is not None
+    assert policy.get_delay(2, requests.ConnectionError()) is None
+    assert (policy.retries, policy.failures) == (2, 3)
+
+
+def test_async_errors():
+    aiohttp = pytest.importorskip('aiohttp')
+    assert RetryPolicy.is_retryable(aiohttp.ServerDisconnectedError())
+    assert RetryPolicy.is_retryable(aiohttp.ClientPayloadError())
+    assert not RetryPolicy.is_retryable(aiohttp.InvalidURL('bad'))
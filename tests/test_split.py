@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+
+from fex.split import FilePart, SplitManifest, split_file
+
+PART_SIZE = 2 ** 20
+
+
+def write_file(path, size):
+    data = os.urandom(size)
+    path.write_bytes(data)
+    return data
+
+
+def test_split_file(tmp_path):
+    path = tmp_path / 'file'
+    write_file(path, 3 * PART_SIZE + 10)
+    parts = split_file(str(path), PART_SIZE)
+    assert [(part.number, part.offset, part.size) for part in parts] == [
+        (1, 0, PART_SIZE), (2, PART_SIZE, PART_SIZE),
+        (3, 2 * PART_SIZE, PART_SIZE), (4, 3 * PART_SIZE, 10)]
+
+
+def test_part_reader_stops_at_part_end(tmp_path):
+    path = tmp_path / 'file'
+    data = write_file(path, 1000)
+    reader = FilePart(str(path), 2, 300, 400).open(128)
+    assert reader.len == 400
+    chunks = []
+    while True:
+        chunk = reader.read(128)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    reader.close()
+    assert b''.join(chunks) == data[300:700]
+
+
+def test_manifest_lists_parts(tmp_path):
+    path = tmp_path / 'file'
+    write_file(path, 2 * PART_SIZE + 1)
+    parts = split_file(str(path), PART_SIZE)
+    manifest = SplitManifest(str(path), parts,
+                             [('sha{0}'.format(n), 'id{0}'.format(n))
+                              for n in range(len(parts))])
+    data = json.loads(manifest.open(0).read().decode())
+    assert manifest.size == len(manifest.data)
+    assert data['name'] == 'file'
+    assert data['size'] == 2 * PART_SIZE + 1
+    assert data['part_size'] == PART_SIZE
+    assert data['parts'] == manifest.parts
+    assert [part['upload_id'] for part in data['parts']] == ['id0', 'id1',
+                                                             'id2']
+
+
+def test_split_upload(run_uploader, server, tmp_path):
+    data = write_file(tmp_path / 'big.bin', 3 * PART_SIZE + 123)
+    code, records = run_uploader('-j', '3', '--verify', '--split-size',
+                                 PART_SIZE, '-f', 'big.bin')
+    assert code == 0
+    record = records[0]
+    assert record['file'] == 'big.bin'
+    assert record['size'] == len(data)
+    assert record['manifest_upload_id']
+    # Parts are listed in file order whatever order they finished in
+    offset = 0
+    for part in record['parts']:
+        assert part['offset'] == offset
+        assert part['sha1'] == hashlib.sha1(
+            data[offset:offset + part['size']]).hexdigest()
+        offset += part['size']
+    assert offset == len(data)
+    assert server.state.stats()['uploads'] == len(record['parts']) + 1
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+from conftest import UPLOADER
+
+SIZE = 2 * 2 ** 30
+# Interpreter, requests and a few read buffers, nowhere near the file size
+MAX_RSS = 100 * 2 ** 20
+
+
+def test_large_file_is_streamed(server, tmp_path):
+    path = tmp_path / 'sparse.bin'
+    # Holes read back as zeros, the file takes no disk space
+    with open(str(path), 'wb') as f:
+        f.truncate(SIZE)
+
+    process = subprocess.Popen(
+        [sys.executable, UPLOADER, '-a', '--output', 'summary',
+         '--folder-cache', str(tmp_path / 'folders.sqlite'), '-f', str(path)],
+        cwd=str(tmp_path), stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    # wait4 gives the rusage of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert server.state.stats()['bytes_received'] > SIZE
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    assert peak_rss < MAX_RSS
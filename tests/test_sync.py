@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def tree(tmp_path):
+    os.makedirs(str(tmp_path / 'tree' / 'sub'))
+    (tmp_path / 'tree' / 'a').write_bytes(b'a')
+    (tmp_path / 'tree' / 'sub' / 'b').write_bytes(b'b')
+    return tmp_path / 'tree'
+
+
+@pytest.fixture
+def sync(run_uploader, tmp_path):
+    def run(*args):
+        return run_uploader('--sync', '--sync-manifest',
+                            tmp_path / 'manifest.json', '-o', 'object1',
+                            '-d', 'tree', *args)
+    return run
+
+
+def uploaded(records):
+    return sorted(record['file'] for record in records
+                  if record['type'] == 'file')
+
+
+def test_uploads_only_changes(sync, server, tree):
+    code, records = sync()
+    assert code == 0
+    assert uploaded(records) == ['tree/a', 'tree/sub/b']
+
+    (tree / 'sub' / 'b').write_bytes(b'changed')
+    (tree / 'c').write_bytes(b'new')
+    code, records = sync()
+    assert code == 0
+    assert uploaded(records) == ['tree/c', 'tree/sub/b']
+
+    code, records = sync()
+    assert code == 0
+    assert uploaded(records) == []
+
+
+def test_reuses_folders_without_folder_cache(sync, server, tree, tmp_path):
+    code, records = sync()
+    assert code == 0
+    folders = {record['file']: record['folder_id'] for record in records
+               if record['type'] == 'file'}
+
+    os.remove(str(tmp_path / 'folders.sqlite'))
+    (tree / 'sub' / 'b').write_bytes(b'changed')
+    server.state.reset()
+    code, records = sync()
+    assert code == 0
+    assert records[0]['folder_id'] == folders['tree/sub/b']
+    assert 'j_object_folder_create' not in server.state.stats()['requests']
@@ -0,0 +1,81 @@
+import os
+import shutil
+
+import pytest
+
+from conftest import (CollectingPrinter, create_api, create_options,
+                      run_bounded)
+from fex.exceptions import UploaderError
+from fex.sync import SyncManifest
+from fex.uploader import Uploader
+
+
+def write_tree(root, paths):
+    for path in paths:
+        path = os.path.join(str(root), path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'0123456789')
+
+
+def upload(tmp_path, uploader_class, *args, **kwargs):
+    obj = create_options('-d', tmp_path / 'tree', *args)
+    printer = CollectingPrinter(obj)
+    uploader = uploader_class(api=create_api(), printer=printer, obj=obj,
+                              **kwargs)
+    error = run_bounded(uploader.upload)
+    uploaded = sorted(os.path.relpath(record['file'], str(tmp_path))
+                      for record in printer.records
+                      if record['type'] == 'file')
+    failed = sorted(os.path.relpath(record['file'], str(tmp_path))
+                    for record in printer.records
+                    if record['type'] == 'error')
+    return error, uploaded, failed
+
+
+def removing(remove):
+    # Uploader that deletes a path right after the tree root is scanned
+    class RemovingUploader(Uploader):
+        def _scan_dir(self, dir_path):
+            result = super()._scan_dir(dir_path)
+            if dir_path.endswith('tree'):
+                remove()
+            return result
+    return RemovingUploader
+
+
+@pytest.mark.parametrize('args', [(), ('--split-size', '4')])
+def test_file_deleted_after_scan(server, tmp_path, args):
+    write_tree(tmp_path / 'tree', ['gone', 'kept', 'sub/other'])
+    gone = str(tmp_path / 'tree' / 'gone')
+    # Known to the last sync, checking whether it changed stats it
+    manifest = SyncManifest(str(tmp_path / 'manifest.json'),
+                            str(tmp_path / 'tree'))
+    manifest.reset('object1', None)
+    manifest.add_folder(str(tmp_path / 'tree'), 'folder1')
+    manifest.add_file(gone)
+    with open(gone, 'ab') as f:
+        f.write(b'changed')
+
+    error, uploaded, failed = upload(
+        tmp_path, removing(lambda: os.remove(gone)), '-o', 'object1', *args,
+        manifest=manifest)
+
+    assert isinstance(error, UploaderError)
+    assert failed == ['tree/gone']
+    if args:
+        # Each 10 byte file went up as parts and a manifest
+        assert server.state.stats()['uploads'] == 2 * 4
+    assert uploaded == ['tree/kept', 'tree/sub/other']
+
+
+def test_dir_removed_during_walk(server, tmp_path):
+    write_tree(tmp_path / 'tree', ['a/1', 'b/2', 'b/c/3', 'top'])
+    removed = str(tmp_path / 'tree' / 'b')
+
+    error, uploaded, failed = upload(
+        tmp_path, removing(lambda: shutil.rmtree(removed)))
+
+    assert isinstance(error, UploaderError)
+    assert failed == ['tree/b']
+    assert uploaded == ['tree/a/1', 'tree/top']